@@ -1,8 +1,5 @@
 import logging_init
-from media_agents.graph_description import build_workfrlow, compile_workflow
-
-workflow = build_workfrlow()
-graph = compile_workflow(workflow)
+from media_agents.cli import main
 
 if __name__ == "__main__":
-    graph.invoke({'last_processed_id':0})
+    main()
@@ -0,0 +1,225 @@
+"""Local stand-ins of the LLM, CourtListener and SMTP services, used to benchmark the workflow offline
+"""
+import copy
+import json
+import os
+import socketserver
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, NamedTuple, Optional
+from urllib.parse import parse_qs, urlparse
+
+from langchain_core.messages import AIMessage
+from langchain_core.runnables import Runnable
+
+from media_agents.structured_output import load_schema
+
+# Recorded CourtListener opinions the stand-in pages are built from
+RECORDED_OPINIONS = [os.path.join(os.path.dirname(__file__), '..', 'tests', 'data', name)
+                     for name in ('opinion1.json', 'opinion2.json')]
+
+
+class LatencyProfile(NamedTuple):
+    """
+    Latency of a fake LLM call: `base` seconds, plus time per 1000 input tokens and per output token.
+    """
+    base: float
+    per_1k_input_tokens: float
+    per_output_token: float
+
+
+PROFILES = {
+    "instant": LatencyProfile(0.0, 0.0, 0.0),
+    "fast": LatencyProfile(0.005, 0.001, 0.0001),
+    "gpt-4o-mini": LatencyProfile(0.3, 0.02, 0.008),
+    "gpt-4-turbo": LatencyProfile(0.6, 0.05, 0.03),
+}
+
+
+def count_tokens(text: str) -> int:
+    # about 4 characters per token, good enough for latency and cost estimates
+    return max(1, len(text) // 4)
+
+
+class FakeChatModel(Runnable):
+    """
+    Deterministic chat model answering each graph stage prompt with a valid output.
+
+    Answers depend only on the prompt, so repeated runs are comparable. Calls sleep according
+    to the latency profile and report token usage like the provider models.
+    """
+
+    model_name = "fake-chat-model"
+    temperature = 0.0
+
+    def __init__(self, profile: LatencyProfile = PROFILES["instant"], newsworthy_ratio: float = 0.5):
+        """
+        :param profile: The latency profile.
+        :param newsworthy_ratio: Share of the opinions assessed as newsworthy.
+        """
+        self.profile = profile
+        self.newsworthy_ratio = newsworthy_ratio
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def answer(self, sys_content: str, user_content: str) -> Any:
+        if "identify potential news leads" in sys_content:
+            id = int(user_content.split("#", 1)[1].split(":", 1)[0])
+            newsworthy = zlib.crc32(str(id).encode()) % 1000 < self.newsworthy_ratio * 1000
+            return {"id": id, "newsworthy": str(newsworthy), "influence": "Global",
+                    "reason": "The decision settles a question of national importance.", "labels": ["politics"]}
+        if "List key points" in sys_content:
+            return [{"text": "The court reversed the judgment.", "start_pos": 0, "end_pos": 32},
+                    {"text": "The case was remanded.", "start_pos": 33, "end_pos": 55}]
+        if "assess a news articles" in sys_content:
+            return {criterion: {"score": 9, "comments": []}
+                    for criterion in load_schema('schemas/article_assessment.json')["required"]}
+        if "improve your news article" in sys_content:
+            return {"id": 0, "rewritten_news_article": "The court reversed the judgment. " * 20,
+                    "keywords": [{"keyword": "court"}]}
+        if "create a news headlines" in sys_content:
+            return {"headline": "Court reverses judgment"}
+        if "condenses long court documents" in sys_content:
+            return {"summary": user_content[:400]}
+        return {"id": 0, "news_article": "The court reversed the judgment. " * 20, "keywords": [{"keyword": "court"}]}
+
+    def invoke(self, input: Any, config: Optional[Any] = None, **kwargs: Any) -> AIMessage:
+        sys_content, user_content = input[0].content, input[-1].content
+        content = json.dumps(self.answer(sys_content, user_content))
+        input_tokens = count_tokens(sys_content) + count_tokens(user_content)
+        output_tokens = count_tokens(content)
+        delay = (self.profile.base + self.profile.per_1k_input_tokens * input_tokens / 1000
+                 + self.profile.per_output_token * output_tokens)
+        if delay > 0:
+            time.sleep(delay)
+        with self._lock:
+            self.calls += 1
+        return AIMessage(content=content, usage_metadata={"input_tokens": input_tokens, "output_tokens": output_tokens,
+                                                          "total_tokens": input_tokens + output_tokens})
+
+
+def make_opinions(count: int, first_id: int = 1) -> List[Dict]:
+    """
+    Build opinions from the recorded ones, with consecutive ids.
+
+    :param count: The number of opinions.
+    :param first_id: The id of the first opinion.
+    :return: The opinions, ascending ids.
+    """
+    recorded = []
+    for path in RECORDED_OPINIONS:
+        with open(path, 'r', encoding='utf-8') as fh:
+            recorded.append(json.load(fh))
+    opinions = []
+    for i in range(count):
+        opinion = copy.deepcopy(recorded[i % len(recorded)])
+        id = first_id + i
+        opinion["id"] = id
+        opinion["resource_uri"] = f"https://www.courtlistener.com/api/rest/v3/opinions/{id}/"
+        opinion["absolute_url"] = f"/opinion/{id}/benchmark-{id}/"
+        opinions.append(opinion)
+    return opinions
+
+
+class CourtListenerStandIn:
+    """
+    Local HTTP server serving opinions in CourtListener result pages, newest first.
+    """
+
+    def __init__(self, opinions: List[Dict], page_size: int = 20, host: str = "127.0.0.1"):
+        """
+        :param opinions: The opinions, ascending ids.
+        :param page_size: The number of opinions per page.
+        :param host: The interface to listen on.
+        """
+        self.opinions = list(reversed(opinions))
+        self.page_size = page_size
+        self.requests = 0
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                page = int(parse_qs(urlparse(self.path).query).get("page", ["1"])[0])
+                start = (page - 1) * stand_in.page_size
+                results = stand_in.opinions[start:start + stand_in.page_size]
+                body = json.dumps({"count": len(stand_in.opinions), "results": results}).encode('utf-8')
+                stand_in.requests += 1
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, 0), Handler)
+        self.url = f"http://{host}:{self.server.server_address[1]}/api/rest/v3/opinions/?"
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, name='courtlistener-stand-in', daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class SMTPSink:
+    """
+    Local SMTP server accepting every message without authentication and keeping only counts.
+    """
+
+    def __init__(self, host: str = "127.0.0.1"):
+        """
+        :param host: The interface to listen on.
+        """
+        self.messages = 0
+        self.recipients = 0
+        self._lock = threading.Lock()
+        sink = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def reply(self, line: str) -> None:
+                self.wfile.write(line.encode('ascii') + b"\r\n")
+
+            def handle(self):
+                self.reply("220 sink ESMTP")
+                while line := self.rfile.readline():
+                    command = line.decode('ascii', 'replace').strip().upper()
+                    if command.startswith(("EHLO", "HELO")):
+                        self.reply("250 sink")
+                    elif command.startswith("RCPT"):
+                        with sink._lock:
+                            sink.recipients += 1
+                        self.reply("250 OK")
+                    elif command.startswith("DATA"):
+                        self.reply("354 End data with <CR><LF>.<CR><LF>")
+                        while (data := self.rfile.readline()) and data.rstrip(b"\r\n") != b".":
+                            pass
+                        with sink._lock:
+                            sink.messages += 1
+                        self.reply("250 OK")
+                    elif command.startswith("QUIT"):
+                        self.reply("221 Bye")
+                        return
+                    else:
+                        # MAIL, RSET, NOOP
+                        self.reply("250 OK")
+
+        class Server(socketserver.ThreadingTCPServer):
+            daemon_threads = True
+            allow_reuse_address = True
+
+        self.server = Server((host, 0), Handler)
+        self.host, self.port = self.server.server_address
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, name='smtp-sink', daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,172 @@
+"""Offline benchmark of the staged workflow, end to end against local stand-ins of every external service
+
+Run with `python -m benchmarks.workflow_bench --sizes 10 100 1000 --profile fast`.
+"""
+import argparse
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+import logging
+from typing import Dict, List, Optional
+from unittest import mock
+
+from benchmarks.fakes import PROFILES, CourtListenerStandIn, FakeChatModel, SMTPSink, make_opinions
+from media_agents import blob_store, graph_ops, http_client, llm_cache
+from media_agents.app_resources import preload_resources
+from media_agents.graph_description import build_workflow, compile_workflow
+from media_agents.llm_router import ProviderStats, Route
+from media_agents.metrics import metrics
+
+# Initialize logger
+logger = logging.getLogger(__name__)
+
+# Number of subscribers the newsletter is sent to
+SUBSCRIBERS = 50
+
+
+def bench_env(work_dir: str, stand_in: CourtListenerStandIn, sink: SMTPSink, opinions: int,
+              ingestion: str = "memory") -> Dict[str, str]:
+    """
+    Get the settings of a benchmark run: local services, scratch files and every cache disabled.
+
+    Deduplication is disabled too, the stand-in opinions being copies of a few recorded ones.
+    """
+    state_file = os.path.join(work_dir, "ingestion_state.json")
+    with open(state_file, 'w') as fh:
+        json.dump({"last_processed_id": 0}, fh)
+    recipients_file = os.path.join(work_dir, "recipients.txt")
+    with open(recipients_file, 'w') as fh:
+        fh.write("\n".join(f"reader{i}@example.com" for i in range(SUBSCRIBERS)))
+    return {"COURT_LISTENER_URL": stand_in.url, "FETCH_MODE": "incremental", "FETCH_RATE_LIMIT": "0",
+            "SMTP_SERVER": sink.host, "SMTP_PORT_SSL": str(sink.port), "SMTP_SECURITY": "plain",
+            "SMTP_USER": "bench@example.com", "SMTP_PASSWORD": "", "EMAIL_DELIVERY": "direct",
+            "FETCH_STATE_FILE": state_file, "OUTPUT_DIR": os.path.join(work_dir, "output"),
+            "SUBSCRIPTIONS_STORAGE": recipients_file, "SUBSCRIPTIONS_PREFERENCES": "",
+            "PREFILTER_TOP_K": str(opinions), "DEDUP_THRESHOLD": "0", "LLM_CACHE_BYPASS": "1", "LLM_MODE": "sync",
+            "STRUCTURED_OUTPUT": "json", "HTTP_CACHE_DIR": "",
+            "TEXT_STORE_DIR": os.path.join(work_dir, "texts"), "FETCH_INGESTION": ingestion,
+            "FETCH_SPOOL_DIR": os.path.join(work_dir, "spool")}
+
+
+def run_scale(opinions: int, profile: str = "fast", trace_memory: bool = True, ingestion: str = "memory") -> Dict:
+    """
+    Run the staged workflow once over a number of opinions.
+
+    :param opinions: The number of opinions served by the CourtListener stand-in.
+    :param profile: The fake LLM latency profile, see `benchmarks.fakes.PROFILES`.
+    :param trace_memory: Whether to measure the peak Python memory with tracemalloc, which slows the run.
+    :param ingestion: The FETCH_INGESTION setting, "memory" or "spool".
+    :return: The measurements: wall time, throughput, per-node timings, LLM calls and tokens, memory.
+    """
+    model = FakeChatModel(PROFILES[profile])
+    # routed like a provider model, so calls, tokens and cost are recorded
+    route = Route("benchmark", [("fake", model.model_name, model)], ProviderStats())
+    with tempfile.TemporaryDirectory() as work_dir, \
+            CourtListenerStandIn(make_opinions(opinions)) as stand_in, SMTPSink() as sink, \
+            mock.patch.dict(os.environ, {}), mock.patch.object(graph_ops, "client", route):
+        os.environ.update(bench_env(work_dir, stand_in, sink, opinions, ingestion))
+        http_client.set_cache(None)
+        http_client.configure(http_client.get_concurrency(), 0)
+        llm_cache.set_cache(None)
+        blob_store.set_store(None)
+        metrics.reset()
+        preload_resources()
+        graph = compile_workflow(build_workflow())
+
+        if trace_memory:
+            tracemalloc.start()
+        start = time.perf_counter()
+        state = graph.invoke({'last_processed_id': 0})
+        wall_seconds = time.perf_counter() - start
+        peak_bytes = tracemalloc.get_traced_memory()[1] if trace_memory else None
+        if trace_memory:
+            tracemalloc.stop()
+        blob_store.set_store(None)
+
+    snapshot = metrics.snapshot()
+    nodes = {}
+    for series, histogram in snapshot["histograms"].items():
+        if series.startswith("node_seconds{"):
+            node = series.split('node="', 1)[1].split('"', 1)[0]
+            nodes[node] = nodes.get(node, 0.0) + histogram["sum"]
+    tokens = {direction: sum(value for series, value in snapshot["counters"].items()
+                             if series.startswith("llm_tokens_total") and f'direction="{direction}"' in series)
+              for direction in ("input", "output")}
+    return {"opinions": opinions, "profile": profile, "wall_seconds": wall_seconds,
+            "opinions_per_second": opinions / wall_seconds if wall_seconds else 0.0,
+            "articles": state.get("news_num", 0), "llm_calls": model.calls, "llm_tokens": tokens,
+            "http_requests": stand_in.requests, "emails": sink.messages,
+            "peak_python_mb": peak_bytes / 2 ** 20 if peak_bytes is not None else None,
+            "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+            "nodes": dict(sorted(nodes.items(), key=lambda item: -item[1]))}
+
+
+def format_report(results: List[Dict]) -> str:
+    """
+    Format benchmark results as a plain text report.
+    """
+    lines = []
+    for result in results:
+        memory = f"{result['peak_python_mb']:.1f} MB" if result['peak_python_mb'] is not None else "n/a"
+        lines.append(f"{result['opinions']} opinions ({result['profile']}): {result['wall_seconds']:.2f}s, "
+                     f"{result['opinions_per_second']:.1f} opinions/s, {result['articles']} articles, "
+                     f"{result['llm_calls']} LLM calls, {result['http_requests']} HTTP requests, "
+                     f"{result['emails']} emails, peak Python memory {memory}, max RSS {result['max_rss_mb']:.0f} MB")
+        for node, seconds in result["nodes"].items():
+            lines.append(f"    {node:<24} {seconds:8.3f}s")
+    return "\n".join(lines)
+
+
+def find_regressions(results: List[Dict], baseline: List[Dict], tolerance: float) -> List[str]:
+    """
+    Compare results with a baseline of the same sizes and profiles.
+
+    :param results: The benchmark results.
+    :param baseline: The baseline results, e.g. of the main branch.
+    :param tolerance: The accepted slowdown, e.g. 0.2 for 20%.
+    :return: A description of every run slower than its baseline beyond the tolerance.
+    """
+    reference = {(r["opinions"], r["profile"]): r for r in baseline}
+    regressions = []
+    for result in results:
+        base = reference.get((result["opinions"], result["profile"]))
+        if base and result["wall_seconds"] > base["wall_seconds"] * (1 + tolerance):
+            regressions.append(f"{result['opinions']} opinions ({result['profile']}): {result['wall_seconds']:.2f}s "
+                               f"vs {base['wall_seconds']:.2f}s baseline")
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="benchmarks.workflow_bench",
+                                     description="Benchmark the workflow offline with a fake LLM, "
+                                                 "a local CourtListener stand-in and a local SMTP sink.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000], help="numbers of opinions")
+    parser.add_argument("--profile", choices=sorted(PROFILES), default="fast", help="fake LLM latency profile")
+    parser.add_argument("--ingestion", choices=["memory", "spool"], default="memory", help="fetched opinions ingestion")
+    parser.add_argument("--no-tracemalloc", action="store_true", help="skip the peak Python memory measurement")
+    parser.add_argument("--json", metavar="PATH", help="write the results as JSON")
+    parser.add_argument("--baseline", metavar="PATH", help="JSON results to compare with, fails on regressions")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="accepted slowdown vs the baseline")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.WARNING, format="%(levelname)s : %(module)s : %(funcName)s : %(message)s")
+
+    results = [run_scale(size, args.profile, not args.no_tracemalloc, args.ingestion) for size in args.sizes]
+    print(format_report(results))
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as fh:
+            json.dump(results, fh, indent=2)
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as fh:
+            regressions = find_regressions(results, json.load(fh), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
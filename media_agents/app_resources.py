@@ -1,8 +1,22 @@
 import os
+import threading
+import time
+import logging
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Optional, Sequence, Tuple
+import media_agents.config as config
 from media_agents.config import RESOURCES_ROOT_DIR
+
+# Initialize logger
+logger = logging.getLogger(__name__)
+
 # Default locale setting
 app_locale = 'en'  # Default locale
 
+# Locale of the current context, overriding the default locale
+context_locale: ContextVar[Optional[str]] = ContextVar('context_locale', default=None)
+
 def set_locale(locale_name):
     """
     Set the application locale.
@@ -16,20 +30,160 @@ def get_locale():
     """
     Get the current application locale.
 
-    :return: The current locale name
+    :return: The locale of the current context if set by `use_locale`, else the application locale
     """
-    global app_locale
-    return app_locale
+    return context_locale.get() or app_locale
+
+@contextmanager
+def use_locale(locale_name):
+    """
+    Use a locale in the current context only, e.g. to render newsletters in several locales concurrently.
+
+    :param locale_name: The locale name
+    """
+    token = context_locale.set(locale_name)
+    try:
+        yield
+    finally:
+        context_locale.reset(token)
+
 
-def get_resource_content(res_file_path):
+class ResourceRegistry:
+    """
+    In-memory cache of the resource files of every locale.
+
+    Each resource is read from disk once, then served from memory. When hot reload is enabled
+    the file modification time is checked at most every `reload_interval` seconds and the
+    resource is read again if it changed. Values derived from resources (composed system
+    messages, compiled templates) are cached until one of their resources changes.
+    """
+
+    def __init__(self, root_dir: str, reload_interval: Optional[float] = 0):
+        """
+        :param root_dir: Root directory of the resource files, one subdirectory per locale.
+        :param reload_interval: Seconds between two modification checks of a resource, 0 disables hot reload,
+            None reads the RESOURCES_RELOAD_INTERVAL setting on first use.
+        """
+        self.root_dir = root_dir
+        self.reload_interval = reload_interval
+        self.reads = 0
+        # (locale, path) -> [content, mtime, version, checked_at]
+        self._resources: Dict[Tuple[str, str], list] = {}
+        self._derived: Dict[Tuple, Any] = {}
+        self._lock = threading.RLock()
+
+    def _path(self, locale: str, res_file_path: str) -> str:
+        return os.path.join(self.root_dir, locale, res_file_path)
+
+    def _read(self, locale: str, res_file_path: str, version: int) -> list:
+        path = self._path(locale, res_file_path)
+        mtime = os.stat(path).st_mtime_ns
+        with open(path, 'r', encoding='utf8') as fh:
+            content = fh.read()
+        self.reads += 1
+        return [content, mtime, version, time.monotonic()]
+
+    def _entry(self, locale: str, res_file_path: str) -> list:
+        key = (locale, res_file_path)
+        if self.reload_interval is None:
+            self.reload_interval = float(os.getenv('RESOURCES_RELOAD_INTERVAL', config.RESOURCES_RELOAD_INTERVAL))
+        with self._lock:
+            entry = self._resources.get(key)
+            if entry is None:
+                entry = self._resources[key] = self._read(locale, res_file_path, 0)
+            elif self.reload_interval and time.monotonic() - entry[3] >= self.reload_interval:
+                entry[3] = time.monotonic()
+                if os.stat(self._path(locale, res_file_path)).st_mtime_ns != entry[1]:
+                    logger.info(f"reloading changed resource {locale}/{res_file_path}")
+                    entry = self._resources[key] = self._read(locale, res_file_path, entry[2] + 1)
+            return entry
+
+    def get(self, res_file_path: str, locale: Optional[str] = None) -> str:
+        """
+        Get the content of a resource file.
+
+        :param res_file_path: The path to the resource file, relative to the locale directory.
+        :param locale: The locale, defaults to the current locale.
+        :return: The content of the resource file.
+        """
+        return self._entry(locale or get_locale(), res_file_path)[0]
+
+    def get_derived(self, res_file_paths: Sequence[str], build: Callable[..., Any], locale: Optional[str] = None) -> Any:
+        """
+        Get a value built from the content of resource files, rebuilt only when one of them changes.
+
+        :param res_file_paths: The paths to the resource files.
+        :param build: Function called with the content of each resource file, in order.
+        :param locale: The locale, defaults to the current locale.
+        :return: The built value.
+        """
+        locale = locale or get_locale()
+        entries = [self._entry(locale, path) for path in res_file_paths]
+        key = (build, locale, tuple(res_file_paths))
+        versions = tuple(entry[2] for entry in entries)
+        with self._lock:
+            cached = self._derived.get(key)
+            if cached is not None and cached[0] == versions:
+                return cached[1]
+        value = build(*(entry[0] for entry in entries))
+        with self._lock:
+            self._derived[key] = (versions, value)
+        return value
+
+    def preload(self, locale: Optional[str] = None) -> int:
+        """
+        Load every resource file of a locale.
+
+        :param locale: The locale, defaults to the current locale.
+        :return: The number of loaded resource files.
+        """
+        locale = locale or get_locale()
+        locale_dir = os.path.join(self.root_dir, locale)
+        count = 0
+        for dir_path, _, file_names in os.walk(locale_dir):
+            for file_name in file_names:
+                self._entry(locale, os.path.relpath(os.path.join(dir_path, file_name), locale_dir))
+                count += 1
+        logger.info(f"preloaded {count} resources for locale {locale}")
+        return count
+
+    def clear(self) -> None:
+        """
+        Drop every cached resource and derived value.
+        """
+        with self._lock:
+            self._resources.clear()
+            self._derived.clear()
+
+
+registry = ResourceRegistry(RESOURCES_ROOT_DIR, reload_interval=None)
+
+def get_resource_content(res_file_path, locale=None):
     """
     Get the content of a resource file for the current locale.
 
     :param res_file_path: The path to the resource file, relative to the locale directory
+    :param locale: The locale, defaults to the current locale
     :return: The content of the resource file as a string
     """
-    global app_locale
-    path = os.path.join(RESOURCES_ROOT_DIR, app_locale, res_file_path)
-    with open(path, 'r', encoding='utf8') as fh:
-        content = fh.read()
-    return content
\ No newline at end of file
+    return registry.get(res_file_path, locale)
+
+def get_derived_content(res_file_paths, build, locale=None):
+    """
+    Get a value built from resource files, e.g. a composed system message or a compiled template.
+
+    :param res_file_paths: The paths to the resource files, relative to the locale directory
+    :param build: Function called with the content of each resource file
+    :param locale: The locale, defaults to the current locale
+    :return: The built value, cached until one of the resource files changes
+    """
+    return registry.get_derived(res_file_paths, build, locale)
+
+def preload_resources(locale=None):
+    """
+    Load every prompt, schema and template of a locale into memory.
+
+    :param locale: The locale, defaults to the current locale
+    :return: The number of loaded resource files
+    """
+    return registry.preload(locale)
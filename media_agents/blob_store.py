@@ -0,0 +1,199 @@
+"""Content-addressed on-disk store of opinion texts, so the graph state carries compact references instead of full texts
+"""
+import hashlib
+import os
+import tempfile
+import threading
+import time
+import logging
+from collections import OrderedDict
+from typing import Dict, Optional
+from typing_extensions import TypedDict
+
+import media_agents.config as config
+
+# Initialize logger
+logger = logging.getLogger(__name__)
+
+
+class TextRef(TypedDict):
+    """
+    Reference to a text in the blob store, stored in an opinion as `<field>_ref` in place of the text.
+
+    Attributes:
+        key (str): SHA-256 hex digest of the text, also its blob name.
+        chars (int): Length of the text in characters, known without loading it.
+    """
+    key: str
+    chars: int
+
+
+class TextStoreError(RuntimeError):
+    """
+    Raised when an opinion references a stored text while the blob store is disabled, e.g. a run
+    resumed with an empty TEXT_STORE_DIR.
+    """
+
+
+class BlobStore:
+    """
+    Texts stored once per content under `<directory>/<key[:2]>/<key>.txt`, with a small LRU cache of loaded texts.
+    """
+
+    def __init__(self, directory: str, cache_entries: int = 32):
+        """
+        :param directory: The store directory.
+        :param cache_entries: The max number of loaded texts kept in memory.
+        """
+        self.directory = directory
+        self.cache_entries = cache_entries
+        self._cache: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], key + '.txt')
+
+    def put(self, text: str) -> TextRef:
+        """
+        Store a text, unless the same text is already stored.
+
+        :param text: The text.
+        :return: The reference of the text.
+        """
+        data = text.encode('utf-8')
+        key = hashlib.sha256(data).hexdigest()
+        path = self.path(key)
+        if os.path.exists(path):
+            # keep blobs still in use out of `prune`
+            os.utime(path)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.' + key, suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'wb') as fh:
+                    fh.write(data)
+                os.replace(tmp_path, path)
+            except BaseException:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+        return TextRef(key=key, chars=len(text))
+
+    def get(self, ref: Dict) -> str:
+        """
+        Load a stored text.
+
+        :param ref: The reference of the text.
+        :return: The text.
+        """
+        key = ref["key"]
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return self._cache[key]
+        with open(self.path(key), 'r', encoding='utf-8') as fh:
+            text = fh.read()
+        with self._lock:
+            self._cache[key] = text
+            while len(self._cache) > self.cache_entries:
+                self._cache.popitem(last=False)
+        return text
+
+    def prune(self, max_age: float) -> int:
+        """
+        Delete the texts neither stored nor re-stored for `max_age` seconds.
+
+        :param max_age: The max age in seconds.
+        :return: The number of deleted texts.
+        """
+        deadline = time.time() - max_age
+        deleted = 0
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                path = os.path.join(root, name)
+                if os.path.getmtime(path) < deadline:
+                    os.remove(path)
+                    deleted += 1
+        return deleted
+
+
+_store = None
+_lock = threading.Lock()
+
+
+def get_store() -> Optional[BlobStore]:
+    """
+    Get the shared blob store, created from the TEXT_STORE_DIR and TEXT_STORE_CACHE_ENTRIES settings.
+
+    :return: The store, or None if TEXT_STORE_DIR is empty.
+    """
+    global _store
+    with _lock:
+        if _store is None:
+            directory = os.getenv("TEXT_STORE_DIR", config.TEXT_STORE_DIR)
+            if not directory:
+                return None
+            _store = BlobStore(directory, int(os.getenv("TEXT_STORE_CACHE_ENTRIES", config.TEXT_STORE_CACHE_ENTRIES)))
+            logger.info(f"text store: {directory}")
+        return _store
+
+
+def set_store(store: Optional[BlobStore]) -> None:
+    """
+    Replace the shared blob store. None recreates it from the settings on next use.
+
+    :param store: The store to use.
+    """
+    global _store
+    with _lock:
+        _store = store
+
+
+def offload_text(opinion: Dict, field: str = "plain_text") -> None:
+    """
+    Move a text field of an opinion to the blob store, leaving its reference in `<field>_ref`.
+    Does nothing if the store is disabled.
+
+    :param opinion: The opinion, updated in place.
+    :param field: The text field.
+    """
+    store = get_store()
+    if store is None or opinion.get(field) is None:
+        return
+    opinion[field + "_ref"] = store.put(opinion.pop(field))
+
+
+def has_text(opinion: Dict, field: str = "plain_text") -> bool:
+    return field in opinion or field + "_ref" in opinion
+
+
+def load_text(opinion: Dict, field: str = "plain_text") -> str:
+    """
+    Get a text field of an opinion, inline or loaded from the blob store.
+
+    :param opinion: The opinion.
+    :param field: The text field.
+    :return: The text, empty if the opinion has none.
+    :raises TextStoreError: If the text is stored but the store is disabled.
+    """
+    if field in opinion:
+        return opinion[field] or ""
+    ref = opinion.get(field + "_ref")
+    if ref is None:
+        return ""
+    store = get_store()
+    if store is None:
+        raise TextStoreError(f"{field} {ref['key']} is in the text store but TEXT_STORE_DIR is empty, "
+                             f"set it to the directory of the run")
+    return store.get(ref)
+
+
+def text_length(opinion: Dict, field: str = "plain_text") -> int:
+    """
+    Get the length of a text field of an opinion without loading it.
+    """
+    if field in opinion:
+        return len(opinion[field] or "")
+    ref = opinion.get(field + "_ref")
+    return ref["chars"] if ref else 0
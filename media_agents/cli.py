@@ -1,12 +1,138 @@
-from media_agents.graph_description import build_workfrlow, compile_workflow
+import argparse
+import logging
+import dotenv
+import os
+import time
+from contextlib import contextmanager
+from datetime import datetime, UTC
+from typing import Dict
 
-workflow = build_workfrlow()
-graph = compile_workflow(workflow)
+import media_agents.config as config
+from media_agents import llm_batch, llm_router
+from media_agents.app_resources import preload_resources
+from media_agents.metrics import log_summary, metrics, start_http_server, write_summary
+from media_agents.graph_description import (build_configured_workflow, compile_workflow, create_checkpointer,
+                                            delete_checkpoints, prune_checkpoints, record_checkpoint_activity)
 
-def main():  # pragma: no cover
+# Initialize logger
+logger = logging.getLogger(__name__)
+
+def parse_args(argv=None) -> argparse.Namespace:
+    """
+    Parse the command line arguments.
+
+    :param argv: The arguments, defaults to sys.argv.
+    :return: The parsed arguments.
+    """
+    parser = argparse.ArgumentParser(prog=config.NAME,
+                                     description="Find news leads in CourtListener court opinions and notify subscribers.")
+    parser.add_argument("--run-id", help="id of a new run, defaults to the current UTC time")
+    parser.add_argument("--resume", metavar="RUN_ID", help="resume a run from its last completed node")
+    parser.add_argument("--checkpoint-db", default=os.getenv("CHECKPOINT_DB", config.CHECKPOINT_DB),
+                        help="SQLite file storing run checkpoints (default: %(default)s)")
+    parser.add_argument("--no-checkpoint", action="store_true", help="run without checkpoints")
+    parser.add_argument("--batch", action="store_true",
+                        help="submit the LLM calls of each stage to the provider batch API (same as LLM_MODE=batch)")
+    parser.add_argument("--wait", action="store_true",
+                        help="in batch mode, poll pending batches until the run completes instead of exiting")
+    parser.add_argument("--metrics-port", type=int, default=os.getenv("METRICS_PORT") or None,
+                        help="serve Prometheus metrics on this port while the run is in progress")
+    return parser.parse_args(argv)
+
+# Exit status of a run stopped at a pending batch, to be resumed later
+BATCH_PENDING_EXIT_CODE = 75
+
+def run(args: argparse.Namespace) -> Dict:
+    """
+    Run the workflow, or resume an interrupted run.
+
+    In batch mode a run stops at the first stage whose batch is pending, exiting with
+    BATCH_PENDING_EXIT_CODE, unless `--wait` is given; resuming it later feeds the batch results to the next stage.
+    The metrics of the run are written to `run_summary_<run id>.json` in the output directory.
+    Checkpoints of a completed run are deleted, and those of runs unfinished for CHECKPOINT_TTL seconds.
+
+    :param args: The parsed command line arguments.
+    :return: The final workflow state.
+    """
+    if args.batch:
+        os.environ["LLM_MODE"] = "batch"
+    if args.metrics_port is not None:
+        start_http_server(args.metrics_port)
+    metrics.reset()
+    preload_resources()
+    workflow = build_configured_workflow()
+    if args.no_checkpoint:
+        if llm_batch.is_enabled():
+            raise SystemExit("batch mode needs checkpoints to resume runs, drop --no-checkpoint")
+        run_id = args.run_id or datetime.now(UTC).strftime("%Y%m%d%H%M%S")
+        graph = compile_workflow(workflow)
+        with run_summary(run_id):
+            return graph.invoke({'last_processed_id': 0})
+
+    graph = compile_workflow(workflow, create_checkpointer(args.checkpoint_db))
+    for expired in prune_checkpoints(args.checkpoint_db, float(os.getenv("CHECKPOINT_TTL", config.CHECKPOINT_TTL))):
+        logger.info(f"checkpoints of run {expired} expired, deleted")
+    if args.resume:
+        run_id = args.resume
+        run_config = {"configurable": {"thread_id": run_id}}
+        snapshot = graph.get_state(run_config)
+        if not snapshot.values:
+            raise SystemExit(f"run {run_id} not found in {args.checkpoint_db}, it completed or expired")
+        if not snapshot.next:
+            logger.info(f"run {run_id} already completed")
+            delete_checkpoints(args.checkpoint_db, run_id)
+            return snapshot.values
+        logger.info(f"resuming run {run_id} at {', '.join(snapshot.next)}")
+        input = None
+    else:
+        run_id = args.run_id or datetime.now(UTC).strftime("%Y%m%d%H%M%S")
+        run_config = {"configurable": {"thread_id": run_id}}
+        logger.info(f"starting run {run_id}, resume it with --resume {run_id}")
+        input = {'last_processed_id': 0}
+    record_checkpoint_activity(args.checkpoint_db, run_id)
+
+    poll_interval = float(os.getenv("LLM_BATCH_POLL_INTERVAL", config.LLM_BATCH_POLL_INTERVAL))
+    with run_summary(run_id):
+        while True:
+            try:
+                state = graph.invoke(input, run_config)
+                delete_checkpoints(args.checkpoint_db, run_id)
+                return state
+            except llm_batch.BatchPending as ex:
+                if not args.wait:
+                    logger.info(f"{ex}, resume the run with --resume {run_id}")
+                    raise SystemExit(BATCH_PENDING_EXIT_CODE)
+                logger.info(f"{ex}, polling again in {poll_interval:.0f}s")
+                time.sleep(poll_interval)
+                input = None
+
+@contextmanager
+def run_summary(run_id: str):
+    """
+    Write the run summary once the run completes or stops, whatever the reason.
+
+    :param run_id: The run id.
+    """
+    start = time.perf_counter()
+    status = "completed"
+    try:
+        yield
+    except BaseException as ex:
+        status = "pending" if isinstance(ex, SystemExit) and ex.code == BATCH_PENDING_EXIT_CODE else "failed"
+        raise
+    finally:
+        path = os.path.join(os.getenv('OUTPUT_DIR', 'output'), f"run_summary_{run_id}.json")
+        write_summary(path, run_id, {"status": status, "wall_seconds": time.perf_counter() - start,
+                                     "llm_providers": llm_router.get_stats()})
+
+def main(argv=None):  # pragma: no cover
     """
     The main function executes on commands:
     `python -m media_agents` and `$ media_agents `.
     """
-    print('it is working!')
-    #graph.invoke({'last_processed_id':0})
+    dotenv.load_dotenv()
+    try:
+        run(parse_args(argv))
+    finally:
+        log_summary()
+        llm_router.log_stats()
@@ -7,4 +7,135 @@ RESOURCES_ROOT_DIR = "media_agents/resources"
 # Url  court opinions open api
 COURT_LISTENER_OPINIONS_API_URL = "https://www.courtlistener.com/api/rest/v3/opinions/?"
 # Max attempts for re-writing article
-MAX_ATTEMPTS = 3
\ No newline at end of file
+MAX_ATTEMPTS = 3
+# Max number of CourtListener result pages walked per fetch
+FETCH_MAX_PAGES = 100
+# Max number of CourtListener page requests in flight (env FETCH_CONCURRENCY)
+FETCH_CONCURRENCY = 8
+# Max number of CourtListener requests per second per host, 0 disables the limit (env FETCH_RATE_LIMIT)
+FETCH_RATE_LIMIT = 5
+# CourtListener fetch mode (env FETCH_MODE): "full" walks every page, "incremental" stops at the last processed id
+FETCH_MODE = "full"
+# Workflow (env WORKFLOW_MODE): "staged" runs each stage over all opinions, "streaming" runs every opinion through its own pipeline
+WORKFLOW_MODE = "staged"
+# Fetched opinions ingestion (env FETCH_INGESTION): "memory" keeps them in the workflow state, "spool" stages them on disk as pages arrive
+FETCH_INGESTION = "memory"
+# Directory of the on-disk opinion spools, one per run, deleted after a successful run (env FETCH_SPOOL_DIR)
+FETCH_SPOOL_DIR = "state/spool"
+# Max number of CourtListener responses kept in memory (env HTTP_CACHE_MAX_ENTRIES)
+HTTP_CACHE_MAX_ENTRIES = 256
+# Number of seconds a cached CourtListener response is served without revalidation (env HTTP_CACHE_TTL)
+HTTP_CACHE_TTL = 300
+# Max number of CourtListener responses kept in HTTP_CACHE_DIR, 0 for no limit (env HTTP_CACHE_MAX_DISK_ENTRIES)
+HTTP_CACHE_MAX_DISK_ENTRIES = 2000
+# Max age in seconds of a response kept in HTTP_CACHE_DIR since it was stored or revalidated, 0 for no limit (env HTTP_CACHE_MAX_AGE)
+HTTP_CACHE_MAX_AGE = 7 * 24 * 3600
+# Max number of LLM calls in flight per provider (env LLM_MAX_CONCURRENCY or LLM_MAX_CONCURRENCY_<PROVIDER>)
+LLM_MAX_CONCURRENCY = 4
+# Pre-filter scorers applied before newsworthiness assessment, cheapest first (env PREFILTER_SCORERS, empty disables)
+PREFILTER_SCORERS = "length,keywords,metadata,terms"
+# Max number of opinions sent to newsworthiness assessment per run, 0 for no limit (env PREFILTER_TOP_K).
+# Opinions over the limit are never assessed: the ingestion checkpoint moves past them
+PREFILTER_TOP_K = 0
+# Min pre-filter score of an opinion sent to newsworthiness assessment, None for no minimum (env PREFILTER_MIN_SCORE).
+# Opinions under the minimum are never assessed, e.g. concurrences and dissents score below 0 without keyword hits.
+PREFILTER_MIN_SCORE = None
+# Min and max opinion text length in characters, 0 max for no limit (env PREFILTER_MIN_CHARS, PREFILTER_MAX_CHARS)
+PREFILTER_MIN_CHARS = 1000
+PREFILTER_MAX_CHARS = 0
+# Max number of tokens of opinion text in a prompt, longer opinions are cut for triage and condensed once newsworthy (env PROMPT_TOKEN_BUDGET)
+PROMPT_TOKEN_BUDGET = 16000
+# Number of tokens per chunk summarized when condensing long opinions (env SUMMARY_CHUNK_TOKENS)
+SUMMARY_CHUNK_TOKENS = 4000
+# Number of tokens shared by consecutive chunks (env SUMMARY_CHUNK_OVERLAP)
+SUMMARY_CHUNK_OVERLAP = 200
+# Max number of map-reduce rounds before a condensed opinion is truncated to the budget
+SUMMARY_MAX_ROUNDS = 3
+# SQLite file caching LLM results across runs, empty disables the cache (env LLM_CACHE_PATH, bypass with LLM_CACHE_BYPASS=1)
+LLM_CACHE_PATH = "state/llm_cache.sqlite"
+# Max number of cached LLM results (env LLM_CACHE_MAX_ENTRIES)
+LLM_CACHE_MAX_ENTRIES = 50000
+# Max age of a cached LLM result in seconds, 0 for no limit (env LLM_CACHE_TTL)
+LLM_CACHE_TTL = 30 * 24 * 3600
+# SQLite file storing per-node workflow checkpoints for resumable runs (env CHECKPOINT_DB)
+CHECKPOINT_DB = "state/checkpoints.sqlite"
+# Number of seconds the checkpoints of an unfinished run are kept after it was last started or resumed, 0 for no limit;
+# completed runs are deleted right away (env CHECKPOINT_TTL)
+CHECKPOINT_TTL = 7 * 24 * 3600
+# SMTP connection security (env SMTP_SECURITY): "ssl", "starttls" or "plain"
+SMTP_SECURITY = "ssl"
+# Number of parallel SMTP sessions delivering the newsletter (env SMTP_POOL_SIZE)
+SMTP_POOL_SIZE = 2
+# Number of reconnections per SMTP session before the remaining recipients fail (env SMTP_MAX_RECONNECTS)
+SMTP_MAX_RECONNECTS = 3
+# Newsletter delivery (env EMAIL_DELIVERY): "direct" sends from the workflow, "outbox" enqueues for the outbox worker
+EMAIL_DELIVERY = "direct"
+# Directory of the on-disk outbound email queue (env OUTBOX_DIR)
+OUTBOX_DIR = "state/outbox"
+# Max delivery attempts of a queued newsletter before it is dead-lettered (env OUTBOX_MAX_ATTEMPTS)
+OUTBOX_MAX_ATTEMPTS = 6
+# Delay in seconds before the first retry, doubled after every failed attempt (env OUTBOX_BACKOFF_BASE)
+OUTBOX_BACKOFF_BASE = 60
+# Max delay in seconds between two delivery attempts (env OUTBOX_BACKOFF_MAX)
+OUTBOX_BACKOFF_MAX = 3600
+# Max number of emails sent per second by the outbox worker, 0 disables the limit (env OUTBOX_RATE_LIMIT)
+OUTBOX_RATE_LIMIT = 10
+# Number of seconds the outbox worker sleeps when the queue is empty (env OUTBOX_POLL_INTERVAL)
+OUTBOX_POLL_INTERVAL = 30
+# Number of seconds after which a message claimed by a worker that did not deliver it is queued again (env OUTBOX_CLAIM_TIMEOUT)
+OUTBOX_CLAIM_TIMEOUT = 600
+# Number of recipients sent to between two refreshes of the claim of a message being delivered,
+# to deliver within OUTBOX_CLAIM_TIMEOUT at OUTBOX_RATE_LIMIT emails per second (env OUTBOX_BATCH_SIZE)
+OUTBOX_BATCH_SIZE = 500
+# Seconds between two modification checks of a cached resource file, 0 disables hot reload (env RESOURCES_RELOAD_INTERVAL)
+RESOURCES_RELOAD_INTERVAL = 5
+# Default LLM of every stage (env LLM_CLIENT, per stage LLM_CLIENT_<STAGE>), optionally prefixed by its provider, e.g. "groq:llama3-8b-8192"
+LLM_CLIENT = "gpt-4-turbo"
+# Timeout in seconds of an LLM call, a timed out call fails over to the fallback model (env LLM_TIMEOUT)
+LLM_TIMEOUT = 120
+# Price in USD per million input and output tokens, used to estimate the cost of a run
+LLM_PRICES = {
+    "gpt-4-turbo": (10.0, 30.0),
+    "gpt-4o": (5.0, 15.0),
+    "gpt-4o-mini": (0.15, 0.6),
+    "gpt-3.5-turbo": (0.5, 1.5),
+    "llama3-8b-8192": (0.05, 0.08),
+    "llama3-70b-8192": (0.59, 0.79),
+    "accounts/fireworks/models/llama-v3p1-8b-instruct": (0.2, 0.2),
+    "accounts/fireworks/models/llama-v3p1-70b-instruct": (0.9, 0.9),
+    "accounts/fireworks/models/llama-v3p1-405b-instruct": (3.0, 3.0),
+}
+# LLM output mode (env STRUCTURED_OUTPUT): "native" uses the provider structured output (tool calling), "json" parses the answer text
+STRUCTURED_OUTPUT = "native"
+# Max number of times an answer not matching its schema is sent back to the model for repair (env STRUCTURED_OUTPUT_REPAIRS)
+STRUCTURED_OUTPUT_REPAIRS = 1
+# LLM call mode (env LLM_MODE): "sync" calls the models directly, "batch" submits each stage to the provider batch API
+LLM_MODE = "sync"
+# Directory of the submitted LLM batches and their results (env LLM_BATCH_DIR)
+LLM_BATCH_DIR = "state/batches"
+# Time within which the provider processes a batch (env LLM_BATCH_COMPLETION_WINDOW)
+LLM_BATCH_COMPLETION_WINDOW = "24h"
+# Factor applied to LLM_PRICES for batched calls (env LLM_BATCH_PRICE_FACTOR)
+LLM_BATCH_PRICE_FACTOR = 0.5
+# Number of seconds between two polls of a pending batch with `--wait` (env LLM_BATCH_POLL_INTERVAL)
+LLM_BATCH_POLL_INTERVAL = 60
+# Min estimated Jaccard similarity of near-duplicate opinions, 0 disables deduplication (env DEDUP_THRESHOLD)
+DEDUP_THRESHOLD = 0.8
+# SQLite file of the LSH index of opinion signatures kept across runs, empty keeps it in memory (env DEDUP_INDEX_PATH)
+DEDUP_INDEX_PATH = "state/dedup_index.sqlite"
+# Number of MinHash permutations per signature (env DEDUP_NUM_PERM)
+DEDUP_NUM_PERM = 128
+# Number of LSH bands, a divisor of DEDUP_NUM_PERM; more bands find less similar candidates (env DEDUP_BANDS)
+DEDUP_BANDS = 16
+# Number of words per shingle (env DEDUP_SHINGLE_SIZE)
+DEDUP_SHINGLE_SIZE = 5
+# Number of seconds an opinion signature is kept in the dedup index, 0 for no limit (env DEDUP_INDEX_TTL)
+DEDUP_INDEX_TTL = 90 * 24 * 3600
+# Directory of the opinion texts referenced from the workflow state, empty keeps texts in the state (env TEXT_STORE_DIR)
+TEXT_STORE_DIR = "state/texts"
+# Max number of loaded opinion texts kept in memory (env TEXT_STORE_CACHE_ENTRIES)
+TEXT_STORE_CACHE_ENTRIES = 32
+# Number of seconds a stored opinion text is kept after its last use, checked after each successful run (env TEXT_STORE_TTL)
+TEXT_STORE_TTL = 30 * 24 * 3600
+# JSONL file of the subscriber preferences, subscribers without preferences get every article (env SUBSCRIPTIONS_PREFERENCES)
+SUBSCRIPTIONS_PREFERENCES = "subscriptions/preferences.jsonl"
@@ -0,0 +1,348 @@
+"""Near-duplicate detection of court opinions with MinHash signatures and a persistent LSH index
+"""
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+import zlib
+import logging
+from typing import Dict, List, Optional, Set, Tuple
+
+import numpy as np
+
+import media_agents.config as config
+from media_agents.blob_store import load_text
+from media_agents.spool import OpinionSpool
+
+# Initialize logger
+logger = logging.getLogger(__name__)
+
+WORD_PATTERN = re.compile(r"[a-z0-9]+")
+
+# Mersenne prime modulus of the MinHash permutations, as in the usual (a * x + b) mod p scheme
+MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+MAX_HASH = np.uint64((1 << 32) - 1)
+
+# Number of shingles hashed at once, bounds the memory of the permutation matrix
+SHINGLE_BLOCK = 4096
+
+
+def shingles(text: str, size: int) -> Set[int]:
+    """
+    Get the hashed word shingles of a text, i.e. its overlapping sequences of `size` words.
+
+    :param text: The text.
+    :param size: The number of words per shingle.
+    :return: The 32-bit hashes of the shingles, empty for texts without words.
+    """
+    words = WORD_PATTERN.findall(text.lower())
+    if len(words) < size:
+        return {zlib.crc32(" ".join(words).encode('utf-8'))} if words else set()
+    return {zlib.crc32(" ".join(words[i:i + size]).encode('utf-8')) for i in range(len(words) - size + 1)}
+
+
+class MinHasher:
+    """
+    MinHash signatures of texts: the share of equal values of two signatures estimates
+    the Jaccard similarity of the texts' shingle sets.
+    """
+
+    def __init__(self, num_perm: int, shingle_size: int, seed: int = 1):
+        """
+        :param num_perm: The number of hash permutations, i.e. the signature length.
+        :param shingle_size: The number of words per shingle.
+        :param seed: The seed of the permutations, signatures are comparable only with the same seed.
+        """
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        generator = np.random.RandomState(seed)
+        self.a = generator.randint(1, MERSENNE_PRIME, size=num_perm, dtype=np.uint64)
+        self.b = generator.randint(0, MERSENNE_PRIME, size=num_perm, dtype=np.uint64)
+
+    def signature(self, text: str) -> Optional[np.ndarray]:
+        """
+        Compute the MinHash signature of a text.
+
+        :param text: The text.
+        :return: The signature, `num_perm` 32-bit values, or None for texts without words.
+        """
+        hashes = np.fromiter(shingles(text, self.shingle_size), dtype=np.uint64)
+        if not len(hashes):
+            return None
+        signature = np.full(self.num_perm, MAX_HASH, dtype=np.uint64)
+        for start in range(0, len(hashes), SHINGLE_BLOCK):
+            block = hashes[start:start + SHINGLE_BLOCK, np.newaxis]
+            permuted = ((block * self.a + self.b) % MERSENNE_PRIME) & MAX_HASH
+            np.minimum(signature, permuted.min(axis=0), out=signature)
+        return signature.astype(np.uint32)
+
+
+def similarity(signature1: np.ndarray, signature2: np.ndarray) -> float:
+    """
+    Estimate the Jaccard similarity of two texts from their MinHash signatures.
+    """
+    return float(np.mean(signature1 == signature2))
+
+
+class LSHIndex:
+    """
+    SQLite-backed locality-sensitive hashing index of MinHash signatures.
+
+    Signatures are cut into `bands` bands; two signatures sharing the values of any band are
+    candidate near-duplicates, which finds pairs above about (1 / bands) ** (1 / rows) similarity
+    without comparing every pair.
+
+    Signatures added by a run are pending until `commit_pending`, so the opinions of a failed run
+    are not taken for already assessed stories by the next one.
+    """
+
+    def __init__(self, path: str, num_perm: int, bands: int):
+        """
+        :param path: Path of the SQLite database file, empty keeps the index in memory.
+        :param num_perm: The signature length.
+        :param bands: The number of bands, a divisor of `num_perm`.
+        """
+        if num_perm % bands:
+            raise ValueError(f"{bands} bands do not divide {num_perm} permutations")
+        self.path = path
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self._lock = threading.Lock()
+        if path:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path or ":memory:", check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS lsh_meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS lsh_signatures ("
+                           "id INTEGER PRIMARY KEY, resource_uri TEXT, signature BLOB NOT NULL, created_at REAL NOT NULL)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS lsh_buckets (band INTEGER NOT NULL, bucket TEXT NOT NULL, id INTEGER NOT NULL)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS lsh_buckets_key ON lsh_buckets (band, bucket)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS lsh_pending (id INTEGER PRIMARY KEY)")
+        layout = f"{num_perm}/{bands}"
+        row = self._conn.execute("SELECT value FROM lsh_meta WHERE key = 'layout'").fetchone()
+        if row is not None and row[0] != layout:
+            logger.warning(f"dedup index {path} built with {row[0]} permutations/bands, rebuilding it for {layout}")
+            self._conn.execute("DELETE FROM lsh_signatures")
+            self._conn.execute("DELETE FROM lsh_buckets")
+            self._conn.execute("DELETE FROM lsh_pending")
+        self._conn.execute("INSERT OR REPLACE INTO lsh_meta (key, value) VALUES ('layout', ?)", (layout,))
+        self._conn.commit()
+
+    def band_keys(self, signature: np.ndarray) -> List[Tuple[int, str]]:
+        return [(band, hashlib.blake2b(signature[band * self.rows:(band + 1) * self.rows].tobytes(),
+                                       digest_size=8).hexdigest())
+                for band in range(self.bands)]
+
+    def query(self, signature: np.ndarray) -> Dict[int, Tuple[np.ndarray, str]]:
+        """
+        Find the indexed signatures sharing a band with a signature.
+
+        :param signature: The signature.
+        :return: The candidate signatures and resource URIs, by opinion id.
+        """
+        with self._lock:
+            ids = set()
+            for band, bucket in self.band_keys(signature):
+                ids.update(row[0] for row in self._conn.execute(
+                    "SELECT id FROM lsh_buckets WHERE band = ? AND bucket = ?", (band, bucket)))
+            candidates = {}
+            for id in sorted(ids):
+                row = self._conn.execute("SELECT signature, resource_uri FROM lsh_signatures WHERE id = ?", (id,)).fetchone()
+                if row is not None:
+                    candidates[id] = (np.frombuffer(row[0], dtype=np.uint32), row[1])
+        return candidates
+
+    def add(self, id: int, signature: np.ndarray, resource_uri: str = "") -> None:
+        """
+        Index the signature of an opinion, replacing its previous signature, pending until `commit_pending`.
+
+        :param id: The opinion id.
+        :param signature: The signature.
+        :param resource_uri: The opinion resource URI.
+        """
+        with self._lock:
+            self._conn.execute("DELETE FROM lsh_buckets WHERE id = ?", (id,))
+            self._conn.execute("INSERT OR REPLACE INTO lsh_signatures (id, resource_uri, signature, created_at) "
+                               "VALUES (?, ?, ?, ?)", (id, resource_uri, signature.astype(np.uint32).tobytes(), time.time()))
+            self._conn.executemany("INSERT INTO lsh_buckets (band, bucket, id) VALUES (?, ?, ?)",
+                                   [(band, bucket, id) for band, bucket in self.band_keys(signature)])
+            self._conn.execute("INSERT OR IGNORE INTO lsh_pending (id) VALUES (?)", (id,))
+            self._conn.commit()
+
+    def commit_pending(self) -> int:
+        """
+        Keep the pending signatures, once the run adding them succeeded.
+
+        :return: The number of committed signatures.
+        """
+        with self._lock:
+            committed = self._conn.execute("UPDATE lsh_signatures SET created_at = ? WHERE id IN "
+                                           "(SELECT id FROM lsh_pending)", (time.time(),)).rowcount
+            self._conn.execute("DELETE FROM lsh_pending")
+            self._conn.commit()
+        return committed
+
+    def discard_pending(self) -> int:
+        """
+        Delete the pending signatures, added by a run that did not succeed.
+
+        :return: The number of deleted signatures.
+        """
+        with self._lock:
+            self._conn.execute("DELETE FROM lsh_buckets WHERE id IN (SELECT id FROM lsh_pending)")
+            discarded = self._conn.execute("DELETE FROM lsh_signatures WHERE id IN "
+                                           "(SELECT id FROM lsh_pending)").rowcount
+            self._conn.execute("DELETE FROM lsh_pending")
+            self._conn.commit()
+        return discarded
+
+    def prune(self, max_age: float) -> int:
+        """
+        Delete the committed signatures indexed more than `max_age` seconds ago.
+
+        :param max_age: The max age in seconds.
+        :return: The number of deleted signatures.
+        """
+        deadline = time.time() - max_age
+        with self._lock:
+            expired = "SELECT id FROM lsh_signatures WHERE created_at < ? AND id NOT IN (SELECT id FROM lsh_pending)"
+            self._conn.execute(f"DELETE FROM lsh_buckets WHERE id IN ({expired})", (deadline,))
+            deleted = self._conn.execute(f"DELETE FROM lsh_signatures WHERE id IN ({expired})", (deadline,)).rowcount
+            self._conn.commit()
+        return deleted
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM lsh_signatures").fetchone()[0]
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+def find_representative(opinion: Dict, index: LSHIndex, hasher: MinHasher, threshold: float) -> Optional[Dict]:
+    """
+    Find the indexed opinion an opinion is a near-duplicate of, or add the opinion to the index as a new representative.
+
+    :param opinion: The opinion.
+    :param index: The LSH index of representatives.
+    :param hasher: The MinHash signature builder, with the same number of permutations as the index.
+    :param threshold: The min estimated Jaccard similarity of near-duplicates.
+    :return: The link of a duplicate to its representative (`duplicate_of` and `similarity`), or None for a representative.
+    """
+    id = int(opinion["id"])
+    signature = hasher.signature(load_text(opinion))
+    if signature is None:
+        return None
+    best_id, best_similarity = None, threshold
+    indexed = False
+    for candidate_id, (candidate, _) in index.query(signature).items():
+        if candidate_id == id:
+            # the opinion itself, indexed by an earlier run or attempt of this run
+            indexed = True
+            continue
+        score = similarity(signature, candidate)
+        if score >= best_similarity:
+            best_id, best_similarity = candidate_id, score
+    if best_id is None:
+        if not indexed:
+            index.add(id, signature, opinion.get("resource_uri", ""))
+        return None
+    return {"id": id, "resource_uri": opinion.get("resource_uri"), "absolute_url": opinion.get("absolute_url"),
+            "duplicate_of": best_id, "similarity": round(best_similarity, 3)}
+
+
+def deduplicate(opinions: List[Dict], index: LSHIndex, hasher: MinHasher, threshold: float) -> Tuple[List[Dict], List[Dict]]:
+    """
+    Cluster near-duplicate opinions, e.g. re-uploads or concurring texts, and keep one representative per cluster.
+
+    Opinions are compared with each other and with the representatives indexed by previous runs.
+    The representative of a cluster is its first opinion by id; the others are listed in its
+    `duplicates`. Opinions duplicating a representative of a previous run are dropped, since
+    their story was already assessed. Kept opinions are added to the index, pending until the run succeeds.
+
+    :param opinions: The fetched opinions.
+    :param index: The LSH index of representatives.
+    :param hasher: The MinHash signature builder, with the same number of permutations as the index.
+    :param threshold: The min estimated Jaccard similarity of near-duplicates.
+    :return: The representatives in their fetch order, and the duplicates with the id and similarity of their representative.
+    """
+    in_batch = {}
+    duplicates = []
+    for opinion in sorted(opinions, key=lambda op: int(op["id"])):
+        link = find_representative(opinion, index, hasher, threshold)
+        if link is None:
+            in_batch[int(opinion["id"])] = opinion
+            continue
+        representative = in_batch.get(link["duplicate_of"])
+        if representative is not None:
+            representative.setdefault("duplicates", []).append(link)
+        duplicates.append(link)
+    duplicate_ids = {link["id"] for link in duplicates}
+    representatives = [opinion for opinion in opinions if int(opinion["id"]) not in duplicate_ids]
+    return representatives, duplicates
+
+
+def deduplicate_spool(spool: OpinionSpool, index: LSHIndex, hasher: MinHasher, threshold: float) -> List[Dict]:
+    """
+    Deduplicate the opinions of a staging spool in place, one opinion at a time, see `deduplicate`.
+
+    Duplicates are discarded from the spool and linked in the `duplicates` of their representative.
+
+    :param spool: The spool of fetched opinions.
+    :param index: The LSH index of representatives.
+    :param hasher: The MinHash signature builder, with the same number of permutations as the index.
+    :param threshold: The min estimated Jaccard similarity of near-duplicates.
+    :return: The duplicates with the id and similarity of their representative.
+    """
+    duplicates = []
+    for opinion in spool:
+        link = find_representative(opinion, index, hasher, threshold)
+        if link is None:
+            continue
+        spool.discard(link["id"])
+        representative = spool.get(link["duplicate_of"])
+        if representative is not None:
+            representative.setdefault("duplicates", []).append(link)
+            spool.update(representative)
+        duplicates.append(link)
+    return duplicates
+
+
+_index = None
+_hasher = None
+_lock = threading.Lock()
+
+
+def get_index() -> Tuple[LSHIndex, MinHasher]:
+    """
+    Get the shared LSH index and signature builder, created from the DEDUP_INDEX_PATH,
+    DEDUP_NUM_PERM, DEDUP_BANDS and DEDUP_SHINGLE_SIZE settings.
+
+    :return: The index and the signature builder.
+    """
+    global _index, _hasher
+    with _lock:
+        if _index is None:
+            path = os.getenv("DEDUP_INDEX_PATH", config.DEDUP_INDEX_PATH)
+            _index = LSHIndex(path, int(os.getenv("DEDUP_NUM_PERM", config.DEDUP_NUM_PERM)),
+                              int(os.getenv("DEDUP_BANDS", config.DEDUP_BANDS)))
+            logger.info(f"dedup index: {path or 'in memory'}, {len(_index)} opinions")
+        if _hasher is None:
+            _hasher = MinHasher(_index.num_perm, int(os.getenv("DEDUP_SHINGLE_SIZE", config.DEDUP_SHINGLE_SIZE)))
+        return _index, _hasher
+
+
+def set_index(index: Optional[LSHIndex], hasher: Optional[MinHasher] = None) -> None:
+    """
+    Replace the shared LSH index. None recreates it from the settings on next use.
+
+    :param index: The index to use.
+    :param hasher: The signature builder matching the index.
+    """
+    global _index, _hasher
+    with _lock:
+        _index, _hasher = index, hasher
@@ -0,0 +1,38 @@
+"""Helpers for durable file writes
+"""
+import json
+import os
+import tempfile
+from typing import Any
+
+
+def atomic_write_json(path: str, obj: Any) -> None:
+    """
+    Atomically replace a JSON file.
+
+    The content is written to a temporary file in the same directory, flushed to disk
+    and then renamed over the target, so readers only ever see the old or the new file.
+
+    :param path: Path of the JSON file to write.
+    :param obj: The JSON serializable object to store.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.' + os.path.basename(path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as fh:
+            json.dump(obj, fh)
+            fh.flush()
+            os.fsync(fh.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    # Persist the rename itself
+    if hasattr(os, 'O_DIRECTORY'):
+        dir_fd = os.open(directory, os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
@@ -1,9 +1,19 @@
+import os
+import operator
+import sqlite3
+import time
+from contextlib import closing
+from pathlib import Path
 from langchain.schema import Document
+from langgraph.checkpoint.sqlite import SqliteSaver
+from langgraph.constants import Send
 from langgraph.graph import END, StateGraph, START
-from typing import Dict
+from typing import Annotated, Dict
 from typing_extensions import TypedDict
 from typing import List
 from media_agents import graph_ops
+import media_agents.config as config
+from media_agents.metrics import timed_node
 
 ### State
 class GraphState(Dict):
@@ -22,6 +32,10 @@ class GraphState(Dict):
         notification (str): Notification status.
         attempts (int): Number of attempts made in the workflow.
         best_article_drafts (Dict): Dictionary of the best article drafts.
+        fetched_last_id (int): ID of the newest fetched item, persisted after a successful run.
+        duplicate_opinions (List[Dict]): Near-duplicate opinions dropped, linked to their representative.
+        opinions_spool (str): Path of the on-disk spool of fetched opinions, with FETCH_INGESTION "spool".
+        stream_file (str): Path of the article stream file of a streaming run.
     """
     last_processed_id: int
     opinions_to_check: List[Dict]
@@ -34,6 +48,21 @@ class GraphState(Dict):
     notification: str
     attempts: int
     best_article_drafts: Dict
+    fetched_last_id: int
+    duplicate_opinions: List[Dict]
+    opinions_spool: str
+    stream_file: str
+
+def add_timed_node(workflow, name, node):
+    """
+    Adds a node to a workflow graph, recording its wall time in the run metrics.
+
+    Args:
+        workflow (StateGraph): The workflow graph to extend.
+        name (str): The node name.
+        node (Callable): The node function.
+    """
+    workflow.add_node(name, timed_node(name, node))
 
 def build_workflow():
     """
@@ -42,14 +71,17 @@ def build_workflow():
     The workflow includes the following steps:
     1. Initialization
     2. Fetching updates
-    3. Finding news leads
-    4. Extracting keypoints
-    5. Writing article drafts
-    6. Editorial assessment
-    7. Rewriting articles (if necessary)
-    8. Generating headlines
-    9. Saving articles
-    10. Notifying subscribers
+    3. Dropping near-duplicate opinions
+    4. Pre-filtering opinions without LLM calls
+    5. Finding news leads
+    6. Extracting keypoints
+    7. Writing article drafts
+    8. Editorial assessment
+    9. Rewriting articles (if necessary)
+    10. Generating headlines
+    11. Saving articles
+    12. Notifying subscribers
+    13. Saving the ingestion checkpoint
 
     Returns:
         StateGraph: A compiled workflow graph ready for execution.
@@ -57,54 +89,258 @@ def build_workflow():
     workflow = StateGraph(GraphState)
     
     # Initialize the agent
-    workflow.add_node("init_agent", graph_ops.init_agent)
+    add_timed_node(workflow, "init_agent", graph_ops.init_agent)
     workflow.add_edge(START, "init_agent")
     
     # Fetch updates
-    workflow.add_node("fetch_update", graph_ops.fetch_update)
+    add_timed_node(workflow, "fetch_update", graph_ops.fetch_update)
     workflow.add_edge("init_agent", "fetch_update")
     
-    # Find news leads
-    workflow.add_node("find_news_leads", graph_ops.find_news_leads)
-    workflow.add_edge("fetch_update", "find_news_leads")
+    # Drop near-duplicate opinions
+    add_timed_node(workflow, "dedup_opinions", graph_ops.dedup_opinions)
+    workflow.add_edge("fetch_update", "dedup_opinions")
+
+    # Pre-filter opinions without LLM calls
+    add_timed_node(workflow, "prefilter_opinions", graph_ops.prefilter_opinions)
+    workflow.add_edge("dedup_opinions", "prefilter_opinions")
+
+    # Find news leads, extract keypoints, write, assess and rewrite drafts, generate headlines
+    add_editorial_nodes(workflow)
+    workflow.add_edge("prefilter_opinions", "find_news_leads")
+    
+    # Save articles
+    add_timed_node(workflow, "save_articles", graph_ops.save_articles)
+    workflow.add_edge("generate_headline", "save_articles")
+    
+    # Notify subscribers
+    add_timed_node(workflow, "notify_subscribers", graph_ops.notify_subscribers)
+    workflow.add_edge("save_articles", "notify_subscribers")
+
+    # Persist the ingestion checkpoint
+    add_timed_node(workflow, "save_fetch_state", graph_ops.save_fetch_state)
+    workflow.add_edge("notify_subscribers", "save_fetch_state")
+    workflow.add_edge("save_fetch_state", END)
     
+    return workflow
+
+class StreamingGraphState(TypedDict):
+    """
+    Defines the structure of the state used by the streaming workflow.
+
+    Attributes:
+        last_processed_id (int): ID of the last processed item.
+        opinions_to_check (List[Dict]): List of opinions to be evaluated.
+        fetched_last_id (int): ID of the newest fetched item, persisted after a successful run.
+        duplicate_opinions (List[Dict]): Near-duplicate opinions dropped, linked to their representative.
+        opinions_spool (str): Path of the on-disk spool of fetched opinions, with FETCH_INGESTION "spool".
+        stream_file (str): Path of the article stream file of the run.
+        articles (List[Dict]): List of finalized articles, appended to by each opinion branch.
+        news_file (str): Path to the file where news articles are saved.
+        news_num (int): Number of news articles.
+        notification (str): Notification status.
+    """
+    last_processed_id: int
+    opinions_to_check: List[Dict]
+    fetched_last_id: int
+    duplicate_opinions: List[Dict]
+    opinions_spool: str
+    stream_file: str
+    articles: Annotated[List[Dict], operator.add]
+    news_file: str
+    news_num: int
+    notification: str
+
+def add_editorial_nodes(workflow):
+    """
+    Adds the per-opinion editorial nodes, from finding news leads to generating headlines,
+    to a workflow graph and wires them together.
+
+    Args:
+        workflow (StateGraph): The workflow graph to extend.
+    """
+    # Find news leads
+    add_timed_node(workflow, "find_news_leads", graph_ops.find_news_leads)
+
     # Extract keypoints
-    workflow.add_node("extract_keypoints", graph_ops.extract_keypoints)
+    add_timed_node(workflow, "extract_keypoints", graph_ops.extract_keypoints)
     workflow.add_edge("find_news_leads", "extract_keypoints")
-    
+
     # Write article drafts
-    workflow.add_node("write_articles_draft", graph_ops.write_articles_draft)
+    add_timed_node(workflow, "write_articles_draft", graph_ops.write_articles_draft)
     workflow.add_edge("extract_keypoints", "write_articles_draft")
-    
+
     # Editorial assessment
-    workflow.add_node("editorial_assessment", graph_ops.editorial_assessment)
+    add_timed_node(workflow, "editorial_assessment", graph_ops.editorial_assessment)
     workflow.add_edge("write_articles_draft", "editorial_assessment")
-    
+
     # Rewrite articles if necessary
-    workflow.add_node("rewrite_articles_draft", graph_ops.rewrite_articles_draft)
-    workflow.add_node("generate_headline", graph_ops.generate_headline)
+    add_timed_node(workflow, "rewrite_articles_draft", graph_ops.rewrite_articles_draft)
+    add_timed_node(workflow, "generate_headline", graph_ops.generate_headline)
     workflow.add_conditional_edges("editorial_assessment", graph_ops.should_continue)
     workflow.add_edge("rewrite_articles_draft", "editorial_assessment")
-    
-    # Save articles
-    workflow.add_node("save_articles", graph_ops.save_articles)
-    workflow.add_edge("generate_headline", "save_articles")
-    
-    # Notify subscribers
-    workflow.add_node("notify_subscribers", graph_ops.notify_subscribers)
+
+def build_opinion_workflow():
+    """
+    Constructs the workflow graph taking a single opinion from news lead detection to a published article.
+
+    The opinion's drafts go through their own editorial assessment / rewrite loop,
+    so a slow or poorly rated draft never holds back other opinions.
+
+    Returns:
+        StateGraph: The per-opinion workflow graph.
+    """
+    workflow = StateGraph(GraphState)
+    add_editorial_nodes(workflow)
+    workflow.add_edge(START, "find_news_leads")
+
+    # Publish finished articles right away
+    add_timed_node(workflow, "publish_articles", graph_ops.publish_articles)
+    workflow.add_edge("generate_headline", "publish_articles")
+    workflow.add_edge("publish_articles", END)
+    return workflow
+
+def build_streaming_workflow():
+    """
+    Constructs the workflow graph processing each fetched opinion independently.
+
+    After fetching, deduplicating and pre-filtering updates, every opinion is sent to its own run of the per-opinion
+    workflow (see `build_opinion_workflow`). The branches run concurrently and each
+    publishes its articles to the stream file of the run as soon as it completes; the collected articles are then
+    saved and sent to subscribers as in the staged workflow.
+
+    Returns:
+        StateGraph: A workflow graph ready for compilation.
+    """
+    opinion_graph = build_opinion_workflow().compile()
+
+    def process_opinion(state: Dict) -> Dict:
+        result = opinion_graph.invoke({"opinions_to_check": state["opinions_to_check"], "stream_file": state["stream_file"],
+                                       "best_article_drafts": {}, "attempts": 1})
+        return {"articles": result.get("articles") or []}
+
+    def dispatch_opinions(state: Dict):
+        opinions = state["opinions_to_check"]
+        if not opinions:
+            return "save_articles"
+        return [Send("process_opinion", {"opinions_to_check": [opinion], "stream_file": state["stream_file"]})
+                for opinion in opinions]
+
+    workflow = StateGraph(StreamingGraphState)
+
+    add_timed_node(workflow, "init_agent", graph_ops.init_agent)
+    workflow.add_edge(START, "init_agent")
+    add_timed_node(workflow, "fetch_update", graph_ops.fetch_update)
+    workflow.add_edge("init_agent", "fetch_update")
+
+    add_timed_node(workflow, "dedup_opinions", graph_ops.dedup_opinions)
+    workflow.add_edge("fetch_update", "dedup_opinions")
+    add_timed_node(workflow, "prefilter_opinions", graph_ops.prefilter_opinions)
+    workflow.add_edge("dedup_opinions", "prefilter_opinions")
+    add_timed_node(workflow, "open_article_stream", graph_ops.open_article_stream)
+    workflow.add_edge("prefilter_opinions", "open_article_stream")
+
+    # Fan out one branch per opinion
+    add_timed_node(workflow, "process_opinion", process_opinion)
+    workflow.add_conditional_edges("open_article_stream", dispatch_opinions, ["process_opinion", "save_articles"])
+
+    add_timed_node(workflow, "save_articles", graph_ops.save_articles)
+    workflow.add_edge("process_opinion", "save_articles")
+    add_timed_node(workflow, "notify_subscribers", graph_ops.notify_subscribers)
     workflow.add_edge("save_articles", "notify_subscribers")
-    workflow.add_edge("notify_subscribers", END)
-    
+    add_timed_node(workflow, "save_fetch_state", graph_ops.save_fetch_state)
+    workflow.add_edge("notify_subscribers", "save_fetch_state")
+    workflow.add_edge("save_fetch_state", END)
     return workflow
 
-def compile_workflow(workflow):
+def build_configured_workflow():
+    """
+    Constructs the workflow graph selected by the WORKFLOW_MODE setting:
+    "staged" (default) processes the whole batch stage by stage, "streaming" processes opinions independently.
+
+    Returns:
+        StateGraph: A workflow graph ready for compilation.
+    """
+    if os.getenv("WORKFLOW_MODE", config.WORKFLOW_MODE) == "streaming":
+        return build_streaming_workflow()
+    return build_workflow()
+
+def create_checkpointer(db_path):
+    """
+    Creates a SQLite-backed checkpoint saver, storing the workflow state after every completed node.
+
+    Args:
+        db_path (str): Path of the SQLite database file.
+
+    Returns:
+        SqliteSaver: The checkpoint saver.
+    """
+    Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+    return SqliteSaver.from_conn_string(db_path)
+
+def record_checkpoint_activity(db_path, thread_id):
+    """
+    Records that a run is started or resumed, so its checkpoints are kept CHECKPOINT_TTL seconds from now.
+
+    Args:
+        db_path (str): Path of the SQLite checkpoint database file.
+        thread_id (str): The run id.
+    """
+    with closing(sqlite3.connect(db_path)) as conn, conn:
+        conn.execute("CREATE TABLE IF NOT EXISTS run_activity (thread_id TEXT PRIMARY KEY, updated_at REAL NOT NULL)")
+        conn.execute("INSERT OR REPLACE INTO run_activity (thread_id, updated_at) VALUES (?, ?)", (thread_id, time.time()))
+
+def delete_checkpoints(db_path, thread_id):
+    """
+    Deletes the checkpoints of a run, e.g. once it completed.
+
+    Args:
+        db_path (str): Path of the SQLite checkpoint database file.
+        thread_id (str): The run id.
+    """
+    with closing(sqlite3.connect(db_path)) as conn, conn:
+        if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'checkpoints'").fetchone():
+            conn.execute("DELETE FROM checkpoints WHERE thread_id = ?", (thread_id,))
+        conn.execute("CREATE TABLE IF NOT EXISTS run_activity (thread_id TEXT PRIMARY KEY, updated_at REAL NOT NULL)")
+        conn.execute("DELETE FROM run_activity WHERE thread_id = ?", (thread_id,))
+
+def prune_checkpoints(db_path, max_age):
+    """
+    Deletes the checkpoints of the runs neither started nor resumed for `max_age` seconds.
+
+    Runs checkpointed before their activity was recorded are kept `max_age` seconds from the first pruning.
+
+    Args:
+        db_path (str): Path of the SQLite checkpoint database file.
+        max_age (float): Maximum age in seconds of the last activity of a kept run, 0 keeps every run.
+
+    Returns:
+        List[str]: The ids of the deleted runs.
+    """
+    if not max_age or not os.path.exists(db_path):
+        return []
+    now = time.time()
+    with closing(sqlite3.connect(db_path)) as conn, conn:
+        conn.execute("CREATE TABLE IF NOT EXISTS run_activity (thread_id TEXT PRIMARY KEY, updated_at REAL NOT NULL)")
+        if not conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'checkpoints'").fetchone():
+            return []
+        conn.execute("INSERT OR IGNORE INTO run_activity (thread_id, updated_at) "
+                     "SELECT DISTINCT thread_id, ? FROM checkpoints", (now,))
+        expired = [row[0] for row in conn.execute("SELECT thread_id FROM run_activity WHERE updated_at < ?",
+                                                  (now - max_age,))]
+        for thread_id in expired:
+            conn.execute("DELETE FROM checkpoints WHERE thread_id = ?", (thread_id,))
+            conn.execute("DELETE FROM run_activity WHERE thread_id = ?", (thread_id,))
+    return expired
+
+def compile_workflow(workflow, checkpointer=None):
     """
     Compiles the given workflow graph.
     
     Args:
         workflow (StateGraph): The workflow graph to be compiled.
+        checkpointer (BaseCheckpointSaver): Optional saver making runs resumable from their last completed node.
     
     Returns:
         Compiled StateGraph: A compiled version of the input workflow graph.
     """
-    return workflow.compile()
+    return workflow.compile(checkpointer=checkpointer)
@@ -1,23 +1,25 @@
 import os
+import threading
 
-import requests
-from dotenv import load_dotenv
-from langchain_openai import ChatOpenAI
-from langchain_groq import ChatGroq
-from langchain_fireworks import ChatFireworks
-from langchain_core.output_parsers import JsonOutputParser
 from langchain.schema import HumanMessage, SystemMessage
-from media_agents.app_resources import get_resource_content
+from media_agents.app_resources import get_derived_content
 import json
-from functools import cache
+import re
 import logging
-from typing import Dict, Literal
+from typing import Dict, Iterator, List, Literal, Union
 from urllib3.util import parse_url
 from datetime import datetime, UTC
 import jsonlines
 from media_agents.notification_utils import send_email
-from media_agents.template_rendering import render_template
-from media_agents.subscriptions import get_recipients
+from media_agents.template_rendering import load_articles, render_templates
+from media_agents.subscriptions import SubscriptionIndex, get_preferences, get_recipients
+from media_agents import blob_store, dedup, http_client, llm_batch, llm_cache, llm_executor, llm_router, outbox
+from media_agents.file_utils import atomic_write_json
+from media_agents.metrics import metrics
+from media_agents.prefilter import prefilter
+from media_agents.spool import OpinionSpool
+from media_agents.structured_output import invoke_structured, load_schema
+from media_agents.text_prep import chunk_text, count_tokens, select_fields
 from pathlib import Path
 
 import media_agents.config as config
@@ -25,50 +27,37 @@ import media_agents.config as config
 # Initialize logger
 logger = logging.getLogger(__name__)
 
-# Load environment variables
-load_dotenv()
-
 def create_client():
-    llm_client = os.getenv("LLM_CLIENT", "gpt-4-turbo")
-    client = None
-    if 'llama' in llm_client:
-        client = (ChatFireworks(model=llm_client, temperature=0.7))
-        logger.info(f"init ChatFireworks:{llm_client}")
-    elif 'gpt' in llm_client:
-        client = ChatOpenAI(model=llm_client, temperature=0.7)
-        logger.info(f"init ChatOpenAI:{llm_client}")
-    else: # by default
-        client = ChatOpenAI(model=llm_client, temperature=0.7)
-        logger.info(f"init ChatOpenAI by default:{llm_client}")
+    """
+    Create the default LLM client configured by LLM_CLIENT, importing only the SDK of its provider.
 
-    return client
+    :return: The LangChain chat model.
+    """
+    return llm_router.create_model(os.getenv("LLM_CLIENT", config.LLM_CLIENT))
 
-# Initialize the LLM client
+# LLM client overriding the per-stage router for every stage when set
+client = None
+
+def get_client(stage: str = None):
+    """
+    Get the LLM client of a graph stage, created on first use.
 
-client = create_client()
+    :param stage: The stage name, see `llm_router.STAGES`.
+    :return: The `client` override if set, else the routed chat model of the stage.
+    """
+    if client is not None:
+        return client
+    return llm_router.get_router().route(stage)
 
-@cache
 def get_content(url: str) -> Dict:
     """
-    Fetch content from a URL using a GET request with custom headers.
+    Fetch content from a URL using a GET request over the shared keep-alive session.
+    Responses are served from the bounded response cache while fresh.
 
     :param url: The URL to fetch the content from.
     :return: The JSON content of the response if successful, otherwise None.
     """
-    # Define custom headers including a User-Agent
-    headers = {
-        'Content-Type': 'application/json',
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/58.0.3029.110 Safari/537.3'
-    }
-
-    # Send a GET request to the URL with custom headers
-    response = requests.get(url, headers=headers)
-
-    # Check if the request was successful (HTTP status code 200)
-    if response.status_code == 200:
-        return response.json()  # Return the JSON content of the response
-    else:
-        return None
+    return http_client.get_json(url)
 
 def compose_sys_content(message: str, schema: str) -> str:
     """
@@ -85,6 +74,88 @@ def compose_sys_content(message: str, schema: str) -> str:
     {schema}
     ```"""
 
+def get_sys_message(prompt_path: str, schema_path: str) -> str:
+    """
+    Get the system message of a graph node, composed once per locale and cached until the prompt or schema changes.
+
+    :param prompt_path: The path to the prompt resource.
+    :param schema_path: The path to the output schema resource.
+    :return: The composed system message.
+    """
+    return get_derived_content((prompt_path, schema_path), compose_sys_content)
+
+# Output schema of each stage, the answers are validated against it
+STAGE_SCHEMAS = {
+    "chunk_summary": 'schemas/chunk_summary_output.json',
+    "newsworthiness": 'schemas/newsworthiness_output.json',
+    "keypoints": 'schemas/keypoints_output.json',
+    "draft": 'schemas/draft_output.json',
+    "assessment": 'schemas/article_assessment.json',
+    "rewrite": 'schemas/rewritten_draft_output.json',
+    "headline": 'schemas/headline_output.json',
+}
+
+def invoke_stage(sys_message: str, user_contents: List[str], stage: str = None) -> List:
+    """
+    Run the LLM calls of a graph node concurrently, within the provider in-flight limit.
+
+    Answers are produced in structured output mode when the provider supports it, validated
+    against the stage schema and sent back for repair when invalid. With LLM_MODE=batch the
+    calls are submitted to the provider batch API instead, see `llm_batch.BatchRunner`, unless
+    the stage model is of a provider without batch API, e.g. Groq, whose calls are made directly.
+    Results are looked up in, and stored to, the persistent LLM result cache, keyed by
+    model, system message, user message and temperature. The model of a result is the one that
+    answered, e.g. the fallback model of a route, so results are looked up under each model of the route.
+
+    :param sys_message: The system message shared by every call.
+    :param user_contents: The user message of each call.
+    :param stage: The stage name, selecting the model of the calls.
+    :return: The parsed JSON output, or the exception raised, of each call in the order of `user_contents`.
+    :raises llm_batch.BatchPending: In batch mode, if the batch of the calls has not completed yet.
+    """
+    cache = llm_cache.get_cache()
+    client = get_client(stage)
+    model = getattr(client, "model_name", None) or getattr(client, "model", None) or type(client).__name__
+    temperature = getattr(client, "temperature", None)
+    route_models = [name for _, name, _ in getattr(client, "models", [])] or [model]
+
+    def lookup(user_content):
+        for name in route_models:
+            json_obj = cache.get(llm_cache.make_key(name, sys_message, user_content, temperature))
+            if json_obj is not None:
+                return json_obj
+        return None
+
+    json_objs = [lookup(user_content) if cache is not None else None for user_content in user_contents]
+    missing = [i for i, json_obj in enumerate(json_objs) if json_obj is None]
+
+    schema = load_schema(STAGE_SCHEMAS[stage]) if stage in STAGE_SCHEMAS else None
+    provider = getattr(client, 'provider', None) or llm_executor.provider_name(client)
+    batch = llm_batch.is_enabled()
+    if batch and missing and not llm_batch.get_runner().supports(provider):
+        logger.warning(f"{stage or 'output'}: no batch API for {provider} models, calling {model} directly")
+        batch = False
+    answered_by = []
+    if not missing:
+        outputs = []
+    elif batch:
+        outputs = llm_batch.get_runner().run(stage or "output", model, sys_message,
+                                             [user_contents[i] for i in missing], temperature, schema, provider)
+    else:
+        inputs = [[SystemMessage(content=sys_message), HumanMessage(content=user_contents[i])] for i in missing]
+        outputs = invoke_structured(client, inputs, schema, provider, stage or "output", answered_by)
+    answered_by += [None] * (len(outputs) - len(answered_by))
+    for i, json_obj, answered_model in zip(missing, outputs, answered_by):
+        json_objs[i] = json_obj
+        # Failures are not cached
+        if cache is not None and not isinstance(json_obj, Exception) and json_obj is not None:
+            cache.put(llm_cache.make_key(answered_model or model, sys_message, user_contents[i], temperature), json_obj)
+    metrics.inc("llm_stage_calls_total", len(user_contents), stage=stage or "output")
+    metrics.inc("llm_cache_hits_total", len(user_contents) - len(missing), stage=stage or "output")
+    if cache is not None and len(missing) < len(user_contents):
+        logger.info(f"llm cache: {len(user_contents) - len(missing)} of {len(user_contents)} results cached")
+    return json_objs
+
 def init_agent(state: Dict) -> Dict:
     logger.debug("<-----init_agent state----->")
     filepath = os.getenv("FETCH_STATE_FILE")
@@ -93,42 +164,328 @@ def init_agent(state: Dict) -> Dict:
     logger.debug("</-----init_agent state----->")
     return state_obj
 
-# URL for Court Listener API
+# URL for Court Listener API, overridden by the COURT_LISTENER_URL setting, e.g. to point to a local stand-in
 COURT_LISTENER_URL = 'https://www.courtlistener.com/api/rest/v3/opinions/?'
 
-def fetch_update(state: Dict) -> Dict:
+class PageFetchError(RuntimeError):
     """
-    Fetch the latest court opinions updates from Court Listener.
+    Raised when a Court Listener result page cannot be fetched, e.g. on HTTP 429 or 5xx, so the run
+    stops before `save_fetch_state` moves the checkpoint past opinions never fetched.
+    """
+    def __init__(self, url: str):
+        super().__init__(f"failed to fetch {url}")
+        self.url = url
 
-    :param state: The current state containing the last processed opinion ID.
-    :return: A dictionary with fetched opinions to check.
+def check_page(url: str, json_content: Dict) -> Dict:
+    """
+    Check that a result page was fetched.
+
+    :param url: The page URL.
+    :param json_content: The page content returned by `get_content`.
+    :return: The page content.
+    :raises PageFetchError: If the page was not fetched.
+    """
+    if json_content is None:
+        raise PageFetchError(url)
+    return json_content
+
+def page_url(page: int) -> str:
+    """
+    Build the Court Listener URL of a result page, newest opinions first.
+
+    :param page: The 1-based page number.
+    :return: The page URL.
+    """
+    return os.getenv("COURT_LISTENER_URL", COURT_LISTENER_URL) + f'order_by=-date_created&page={page}'
+
+def fetch_all_pages(last_id: int) -> List[Dict]:
+    """
+    Walk every result page, oldest page first, and collect opinions newer than the last processed one.
+    Texts are moved to the blob store as opinions are collected, but every page is held until merged.
+
+    :param last_id: ID of the last processed opinion.
+    :return: The fetched opinions.
     """
-    logger.debug("<-----fetch_update state----->")
-    logger.info(f"fetching last updates from {COURT_LISTENER_URL}")
-    
-    last_id = state["last_processed_id"]
     opinion_objects = []
 
-    for page in range(100, 0, -1):
-        url = COURT_LISTENER_URL + f'order_by=-date_created&page={page}'
-        json_content = get_content(url)
-        if not json_content:
-            continue
+    # Pages are requested concurrently, but merged oldest page first
+    urls = [page_url(page) for page in range(config.FETCH_MAX_PAGES, 0, -1)]
+    pages = http_client.fetch_all(urls, get_content, http_client.get_concurrency())
 
-        for res in reversed(json_content['results']):
+    for url, json_content in zip(urls, pages):
+        for res in reversed(check_page(url, json_content)['results']):
             id = int(res['id'])
-            if id < last_id:
+            if id <= last_id:
                 continue
+            blob_store.offload_text(res)
             opinion_objects.append(res)
-            last_id = int(res['id'])
+            last_id = id
+    return opinion_objects
+
+def walk_pages(last_id: int, incremental: bool) -> Iterator[List[Dict]]:
+    """
+    Walk result pages newest first, in windows of FETCH_CONCURRENCY pages, up to the first page
+    without results.
+
+    :param last_id: ID of the last processed opinion.
+    :param incremental: Whether to stop as soon as the last processed opinion is crossed, otherwise every page is walked.
+    :return: The opinions newer than `last_id` of each page, so only one window is held in memory.
+    :raises PageFetchError: If a page cannot be fetched.
+    """
+    window = http_client.get_concurrency()
+    page = 1
+    while page <= config.FETCH_MAX_PAGES:
+        last_page = min(page + window - 1, config.FETCH_MAX_PAGES)
+        urls = [page_url(p) for p in range(page, last_page + 1)]
+        pages = http_client.fetch_all(urls, get_content, window)
+        for number, url, json_content in zip(range(page, last_page + 1), urls, pages):
+            results = check_page(url, json_content)['results']
+            if not results:
+                # past the last page
+                logger.info(f"fetch stopped at empty page {number}")
+                return
+            new_results = [res for res in results if int(res['id']) > last_id]
+            yield new_results
+            if incremental and len(new_results) < len(results):
+                logger.info(f"fetch stopped at page {number}, last processed id crossed")
+                return
+        page = last_page + 1
+    logger.info(f"fetch stopped after page {page - 1}")
+
+def fetch_new_pages(last_id: int) -> List[Dict]:
+    """
+    Walk result pages newest first and stop as soon as the last processed opinion is crossed,
+    or at the first page without results, see `walk_pages`.
+
+    A small delta costs one window of FETCH_CONCURRENCY pages. Texts are moved to the blob store
+    as each window arrives, so only one window of texts is held in memory.
+
+    :param last_id: ID of the last processed opinion.
+    :return: The fetched opinions newer than `last_id`, sorted by ascending id.
+    """
+    opinions_by_id = {}
+    for results in walk_pages(last_id, incremental=True):
+        for res in results:
+            # the state carries references, texts are loaded by the nodes reading them
+            blob_store.offload_text(res)
+            opinions_by_id[int(res['id'])] = res
+    return [opinions_by_id[id] for id in sorted(opinions_by_id)]
+
+def spool_pages(spool: OpinionSpool, last_id: int, incremental: bool) -> None:
+    """
+    Stage the opinions newer than the last processed one as each window of result pages arrives,
+    see `walk_pages`.
+
+    :param spool: The staging spool.
+    :param last_id: ID of the last processed opinion.
+    :param incremental: Whether to stop as soon as the last processed opinion is crossed, otherwise every page is walked.
+    """
+    for results in walk_pages(last_id, incremental):
+        spool.add(results)
+
+def fetched_opinions(state: Dict) -> Union[OpinionSpool, List[Dict]]:
+    """
+    Get the fetched opinions of the state: the staging spool when FETCH_INGESTION is "spool", otherwise the opinions to check.
+
+    :param state: The current state.
+    :return: The opinions, iterable by ascending id and sized.
+    """
+    if state.get("opinions_spool"):
+        return OpinionSpool(state["opinions_spool"])
+    return state["opinions_to_check"]
+
+def fetch_update(state: Dict) -> Dict:
+    """
+    Fetch the latest court opinions updates from Court Listener.
+
+    The FETCH_MODE setting selects between walking every page ("full") and
+    stopping at the last processed opinion ("incremental"). With FETCH_INGESTION "spool" the
+    opinions are staged on disk as pages arrive and the state only carries the spool path.
+
+    :param state: The current state containing the last processed opinion ID.
+    :return: A dictionary with fetched opinions to check and the new last processed opinion ID.
+    :raises PageFetchError: If a result page cannot be fetched.
+    """
+    logger.debug("<-----fetch_update state----->")
+    logger.info(f"fetching last updates from {os.getenv('COURT_LISTENER_URL', COURT_LISTENER_URL)}")
+
+    last_id = state["last_processed_id"]
+    http_client.get_session()
+    incremental = os.getenv("FETCH_MODE", config.FETCH_MODE) == "incremental"
+    if os.getenv("FETCH_INGESTION", config.FETCH_INGESTION) == "spool":
+        spool = OpinionSpool.create(os.getenv("FETCH_SPOOL_DIR", config.FETCH_SPOOL_DIR))
+        try:
+            spool_pages(spool, last_id, incremental)
+        except BaseException:
+            spool.remove()
+            raise
+        fetched_last_id = spool.max_id() or last_id
+        logger.info(f"{len(spool)} court opinions fetched to {spool.path}")
+        spool.close()
+        logger.debug("</-----fetch_update state----->")
+        return {"opinions_spool": spool.path, "opinions_to_check": [], "fetched_last_id": fetched_last_id}
+    if incremental:
+        opinion_objects = fetch_new_pages(last_id)
+    else:
+        opinion_objects = fetch_all_pages(last_id)
+    fetched_last_id = max([int(res['id']) for res in opinion_objects], default=last_id)
 
     logger.info(f"{len(opinion_objects)} court opinions fetched ")
+    logger.info(f"http cache: {http_client.get_cache().stats()}")
     logger.debug("</-----fetch_update state----->")
-    return {"opinions_to_check": opinion_objects}
+    return {"opinions_to_check": opinion_objects, "fetched_last_id": fetched_last_id}
+
+def dedup_opinions(state: Dict) -> Dict:
+    """
+    Drop near-duplicate opinions (re-uploads, concurrences repeating the majority text) with MinHash
+    signatures and a persistent LSH index, so only one representative of each cluster reaches the LLM.
+
+    Duplicates are linked in the `duplicates` of their representative, or dropped if they duplicate
+    an opinion of a previous successful run. Representatives are indexed for later runs by `save_fetch_state`.
+
+    :param state: The current state containing opinions to check.
+    :return: A dictionary with the representative opinions to check and the dropped duplicates.
+    """
+    logger.debug("<-----dedup_opinions state----->")
+    opinions = fetched_opinions(state)
+    threshold = float(os.getenv("DEDUP_THRESHOLD", config.DEDUP_THRESHOLD))
+    if threshold <= 0:
+        return {"duplicate_opinions": []}
+    fetched_num = len(opinions)
+    index, hasher = dedup.get_index()
+    discarded = index.discard_pending()
+    if discarded:
+        logger.info(f"dedup index: {discarded} opinions of an unfinished run discarded")
+    if isinstance(opinions, OpinionSpool):
+        # duplicates are discarded from the spool in place
+        duplicates = dedup.deduplicate_spool(opinions, index, hasher, threshold)
+        representatives = opinions
+    else:
+        representatives, duplicates = dedup.deduplicate(opinions, index, hasher, threshold)
+    for duplicate in duplicates:
+        logger.info(f"opinion {duplicate['id']} duplicates opinion {duplicate['duplicate_of']} "
+                    f"(similarity {duplicate['similarity']})")
+    metrics.inc("opinions_deduplicated_total", len(duplicates))
+    logger.info(f"{fetched_num - len(duplicates)} of {fetched_num} court opinions kept by dedup")
+    logger.debug("</-----dedup_opinions state----->")
+    if isinstance(representatives, OpinionSpool):
+        representatives.close()
+        return {"duplicate_opinions": duplicates}
+    return {"opinions_to_check": representatives, "duplicate_opinions": duplicates}
+
+def prefilter_opinions(state: Dict) -> Dict:
+    """
+    Rank fetched opinions with cheap non-LLM scorers (length, keywords, CourtListener metadata,
+    hand-set term weights) and keep the best PREFILTER_TOP_K, if set, scoring at least
+    PREFILTER_MIN_SCORE, if set, for newsworthiness assessment.
+
+    Spooled opinions are streamed from the spool, only the kept ones are loaded into the state.
+
+    :param state: The current state containing opinions to check.
+    :return: A dictionary with the kept opinions to check.
+    """
+    logger.debug("<-----prefilter_opinions state----->")
+    fetched = fetched_opinions(state)
+    fetched_num = len(fetched)
+    scorers = [name.strip() for name in os.getenv("PREFILTER_SCORERS", config.PREFILTER_SCORERS).split(",") if name.strip()]
+    top_k = int(os.getenv("PREFILTER_TOP_K", config.PREFILTER_TOP_K))
+    min_score = os.getenv("PREFILTER_MIN_SCORE") or config.PREFILTER_MIN_SCORE
+    min_score = float(min_score) if min_score is not None else None
+    if scorers:
+        opinions = prefilter(fetched, scorers, top_k, min_score)
+    else:
+        opinions = list(fetched)
+    if isinstance(fetched, OpinionSpool):
+        fetched.close()
+    logger.info(f"{len(opinions)} of {fetched_num} court opinions kept by prefilter")
+    logger.debug("</-----prefilter_opinions state----->")
+    return {"opinions_to_check": opinions}
+
+def opinion_prompt_text(opinion: Dict) -> str:
+    """
+    Get the opinion text to put in a prompt: the condensed text of a long opinion, otherwise the plain text.
+
+    :param opinion: The opinion.
+    :return: The opinion text.
+    """
+    return blob_store.load_text(opinion, "condensed_text") or blob_store.load_text(opinion)
+
+def opinion_head_text(opinion: Dict) -> str:
+    """
+    Get the opinion text to put in a triage prompt: the prompt text cut to PROMPT_TOKEN_BUDGET tokens,
+    so long opinions are only condensed once found newsworthy.
+
+    :param opinion: The opinion.
+    :return: The head of the opinion text.
+    """
+    budget = int(os.getenv("PROMPT_TOKEN_BUDGET", config.PROMPT_TOKEN_BUDGET))
+    text = opinion_prompt_text(opinion)
+    if count_tokens(text) > budget:
+        text = chunk_text(text, budget)[0]
+    return text
+
+def condense_opinions(opinions: List[Dict]) -> None:
+    """
+    Condense opinions whose text exceeds PROMPT_TOKEN_BUDGET tokens into `condensed_text`.
+
+    The text is split into overlapping chunks which are summarized concurrently (map), then the
+    summaries are joined (reduce); rounds repeat until the result fits the budget. Text still
+    over budget after SUMMARY_MAX_ROUNDS rounds is truncated.
+
+    :param opinions: The opinions, updated in place.
+    """
+    budget = int(os.getenv("PROMPT_TOKEN_BUDGET", config.PROMPT_TOKEN_BUDGET))
+    chunk_tokens = int(os.getenv("SUMMARY_CHUNK_TOKENS", config.SUMMARY_CHUNK_TOKENS))
+    overlap_tokens = int(os.getenv("SUMMARY_CHUNK_OVERLAP", config.SUMMARY_CHUNK_OVERLAP))
+    oversized = [opinion for opinion in opinions
+                 if not blob_store.has_text(opinion, "condensed_text") and count_tokens(blob_store.load_text(opinion)) > budget]
+    if not oversized:
+        return
+    logger.info(f"condensing {len(oversized)} court opinions over {budget} tokens")
+    sys_message = get_sys_message('prompts/chunk_summary_prompt.txt', 'schemas/chunk_summary_output.json')
+
+    texts = [blob_store.load_text(opinion) for opinion in oversized]
+    for _ in range(config.SUMMARY_MAX_ROUNDS):
+        chunked = [(i, chunk_text(text, chunk_tokens, overlap_tokens)) for i, text in enumerate(texts) if count_tokens(text) > budget]
+        if not chunked:
+            break
+        user_contents = []
+        for i, chunks in chunked:
+            id = oversized[i]["id"]
+            for n, chunk in enumerate(chunks):
+                user_contents.append(f"Here is part {n + 1} of {len(chunks)} of a court opinion id#{id}:\n" + chunk)
+
+        json_objs = iter(invoke_stage(sys_message, user_contents, 'chunk_summary'))
+        for i, chunks in chunked:
+            summaries = []
+            for chunk in chunks:
+                json_obj = next(json_objs)
+                if isinstance(json_obj, Exception) or 'summary' not in json_obj:
+                    # keep the chunk text, it is summarized again in the next round
+                    logger.error(f"Error: summarizing opinion {oversized[i]['resource_uri']}")
+                    logger.error(json_obj)
+                    summaries.append(chunk)
+                else:
+                    summaries.append(json_obj["summary"])
+            texts[i] = "\n\n".join(summaries)
+
+    for opinion, text in zip(oversized, texts):
+        if count_tokens(text) > budget:
+            logger.warning(f"condensed opinion {opinion['id']} still over {budget} tokens, truncated")
+            text = chunk_text(text, budget)[0]
+        opinion["condensed_text"] = text
+        blob_store.offload_text(opinion, "condensed_text")
+
+# Opinion texts, inline or as blob store references, carried from the fetched opinion to its news lead
+OPINION_TEXT_FIELDS = ["plain_text", "plain_text_ref", "condensed_text", "condensed_text_ref"]
+
+# Opinions not mentioning a supreme court are never news leads
+SUPREME_COURT_PATTERN = re.compile('supreme court', re.IGNORECASE)
 
 def find_news_leads(state: Dict) -> Dict:
     """
-    Identify newsworthy court opinions from the fetched updates.
+    Identify newsworthy court opinions from the fetched updates, from the head of long opinions,
+    see `opinion_head_text`.
 
     :param state: The current state containing opinions to check.
     :return: A dictionary with newsworthy opinions.
@@ -136,37 +493,41 @@ def find_news_leads(state: Dict) -> Dict:
     logger.debug("<-----find_news_leads state----->")
     opinions_to_check = state["opinions_to_check"]
     newsworthy_opinions = []
-    parser = JsonOutputParser()
-    sys_intro = get_resource_content('prompts/newsworthiness_prompt.txt')
-    sys_schema = get_resource_content('schemas/newsworthiness_output.json')
-    sys_message = compose_sys_content(sys_intro, sys_schema)
+    sys_message = get_sys_message('prompts/newsworthiness_prompt.txt', 'schemas/newsworthiness_output.json')
 
+    items = []
+    user_contents = []
     for opinion in opinions_to_check:
-        id = opinion["id"]
-        user_content = f"Here is a court opinion id#{id}:\n" + opinion["plain_text"]
-        if 'supreme court' not in str.lower(user_content):
+        if not SUPREME_COURT_PATTERN.search(blob_store.load_text(opinion)):
             continue
+        items.append(opinion)
 
+    for opinion in items:
+        id = opinion["id"]
+        user_content = f"Here is a court opinion id#{id}:\n" + opinion_head_text(opinion)
+        user_contents.append(user_content)
+
+    json_objs = invoke_stage(sys_message, user_contents, 'newsworthiness')
+    for opinion, json_obj in zip(items, json_objs):
         try:
-            pipeline = client | parser
-            json_obj = pipeline.invoke([
-                    SystemMessage(content=sys_message),
-                    HumanMessage(content=user_content)
-                ]
-            )
-
-            if 'properties' not in json_obj:
-                if json_obj["newsworthy"] == "True" and json_obj["influence"] == "Global":
-                    json_obj["id"] = opinion["id"]
-                    json_obj["resource_uri"] = opinion["resource_uri"]
-                    json_obj["absolute_url"] = opinion["absolute_url"]
-                    json_obj["plain_text"] = opinion["plain_text"]
-                    json_obj["download_url"] = opinion["download_url"]
-                    json_obj["local_path"] = opinion["local_path"]
-                    json_obj["date_created"] = opinion["date_created"]
-                    json_obj["date_modified"] = opinion["date_modified"]
-                    json_obj["opinions_cited"] = json_obj.get("opinions_cited", [])
-                    newsworthy_opinions.append(json_obj)
+            if isinstance(json_obj, Exception):
+                raise json_obj
+
+            if json_obj["newsworthy"] == "True" and json_obj["influence"] == "Global":
+                json_obj["id"] = opinion["id"]
+                json_obj["resource_uri"] = opinion["resource_uri"]
+                json_obj["absolute_url"] = opinion["absolute_url"]
+                for field in OPINION_TEXT_FIELDS:
+                    if field in opinion:
+                        json_obj[field] = opinion[field]
+                if "duplicates" in opinion:
+                    json_obj["duplicates"] = opinion["duplicates"]
+                json_obj["download_url"] = opinion["download_url"]
+                json_obj["local_path"] = opinion["local_path"]
+                json_obj["date_created"] = opinion["date_created"]
+                json_obj["date_modified"] = opinion["date_modified"]
+                json_obj["opinions_cited"] = json_obj.get("opinions_cited", [])
+                newsworthy_opinions.append(json_obj)
         except Exception as e:
             logger.error(f"Error: processing opinion {opinion['resource_uri']}")
             logger.error(e)
@@ -176,7 +537,7 @@ def find_news_leads(state: Dict) -> Dict:
 
 def extract_keypoints(state: Dict) -> Dict:
     """
-    Extract key points from the newsworthy opinions.
+    Extract key points from the newsworthy opinions, condensing long opinions first, see `condense_opinions`.
 
     :param state: The current state containing newsworthy opinions.
     :return: A dictionary with opinions and their key points.
@@ -185,31 +546,33 @@ def extract_keypoints(state: Dict) -> Dict:
     opinions = state["newsworthy_opinions"]
     logger.info(f"extract keypoints: {len(opinions)} opinions")
     res_opinions = []
-    parser = JsonOutputParser()
-    sys_intro = get_resource_content('prompts/keypoints_prompt.txt')
-    sys_schema = get_resource_content('schemas/keypoints_output.json')
-    sys_message = compose_sys_content(sys_intro, sys_schema)
+    sys_message = get_sys_message('prompts/keypoints_prompt.txt', 'schemas/keypoints_output.json')
 
+    condense_opinions(opinions)
+    user_contents = []
     for opinion in opinions:
         id = opinion["id"]
-        user_content = f"Here is a court opinion id#{id}:\n" + opinion["plain_text"]
+        user_content = f"Here is a court opinion id#{id}:\n" + opinion_prompt_text(opinion)
+        user_contents.append(user_content)
+
+    json_objs = invoke_stage(sys_message, user_contents, 'keypoints')
+    for opinion, json_obj in zip(opinions, json_objs):
         try:
-            pipeline = client | parser
-            json_obj = pipeline.invoke([
-                    SystemMessage(content=sys_message),
-                    HumanMessage(content=user_content)
-                ]
-            )
-
-            if 'properties' not in json_obj:
-                opinion["keypoints"] = json_obj
-                res_opinions.append(opinion)
+            if isinstance(json_obj, Exception):
+                raise json_obj
+
+            opinion["keypoints"] = json_obj
+            res_opinions.append(opinion)
         except Exception as e:
             logger.error(f"Error: processing opinion {opinion['resource_uri']}")
             logger.error(e)
     logger.debug("</-----extract_keypoints state----->")
     return {"opinions_with_keypoints": res_opinions}
 
+# Opinion fields the draft prompt needs, the opinion text is represented by its key points
+DRAFT_PROMPT_FIELDS = ["id", "reason", "influence", "country", "city", "events", "people", "organizations",
+                       "labels", "date_created", "keypoints"]
+
 def write_articles_draft(state: Dict) -> Dict:
     """
     Write draft articles based on the opinions with key points.
@@ -221,76 +584,90 @@ def write_articles_draft(state: Dict) -> Dict:
     opinions = state["opinions_with_keypoints"]
     logger.info(f"write articles: {len(opinions)} court opinions")
     res_article_drafts = []
-    parser = JsonOutputParser()
-    sys_intro = get_resource_content('prompts/draft_prompt.txt')
-    sys_schema = get_resource_content('schemas/draft_output.json')
-    sys_message = compose_sys_content(sys_intro, sys_schema)
+    sys_message = get_sys_message('prompts/draft_prompt.txt', 'schemas/draft_output.json')
 
+    user_contents = []
     for opinion in opinions:
         id = opinion["id"]
-        user_content = f"Here is a court opinion id#{id}:\n" + json.dumps(opinion)
+        user_content = f"Here is a court opinion id#{id}:\n" + json.dumps(select_fields(opinion, DRAFT_PROMPT_FIELDS))
+        user_contents.append(user_content)
+
+    json_objs = invoke_stage(sys_message, user_contents, 'draft')
+    for opinion, json_obj in zip(opinions, json_objs):
         try:
-            pipeline = client | parser
-            json_obj = pipeline.invoke([
-                    SystemMessage(content=sys_message),
-                    HumanMessage(content=user_content)
-                ]
-            )
-
-            if 'properties' not in json_obj:
-                opinion["news_article"] = json_obj["news_article"]
-                opinion["keywords"] = json_obj["keywords"]
-                res_article_drafts.append(opinion)
-            else:
-                raise Exception("Illegal format of the json output")
+            if isinstance(json_obj, Exception):
+                raise json_obj
+
+            opinion["news_article"] = json_obj["news_article"]
+            opinion["keywords"] = json_obj["keywords"]
+            res_article_drafts.append(opinion)
         except Exception as e:
             logger.error(f"Error: processing opinion {opinion['resource_uri']}")
             logger.error(e)
     logger.debug("</-----write_articles_draft state----->")
     return {"article_drafts": res_article_drafts}
 
+def draft_passed(article_draft: Dict) -> bool:
+    """
+    Check whether an assessed article draft scores above 8 on every editorial criterion.
+
+    :param article_draft: The article draft with editor feedback.
+    :return: True if the draft needs no rewrite.
+    """
+    assessment = article_draft['editor_feedback']
+    for k in assessment:
+        criteria = assessment[k]
+        if int(criteria["score"]) <= 8:
+            return False
+    return True
+
 def editorial_assessment(state: Dict) -> Dict:
+    """
+    Assess article drafts which have no editor feedback yet, i.e. new and rewritten drafts.
+
+    Drafts assessed in a previous round, and not rewritten since, are carried forward untouched.
+
+    :param state: The current state containing article drafts.
+    :return: A dictionary with assessed article drafts and the best draft of each article.
+    """
     article_drafts = state["article_drafts"]
     best_article_drafts = state["best_article_drafts"]
     if best_article_drafts is None:
         best_article_drafts = {}
-    logger.info(f"editorial assessment: {len(article_drafts)} drafts")
+    pending_drafts = [article_draft for article_draft in article_drafts if "editor_feedback" not in article_draft]
+    logger.info(f"editorial assessment: {len(pending_drafts)} of {len(article_drafts)} drafts")
     attempts = state.get("attempts")
     if attempts is None:
         attempts = 1
-    res_article_drafts = []
-    parser = JsonOutputParser()
-    sys_intro = get_resource_content('prompts/article_assessment_prompt.txt')
-    sys_schema = get_resource_content('schemas/article_assessment.json')
-    sys_message = compose_sys_content(sys_intro, sys_schema)
-    for article_draft in article_drafts:
+    sys_message = get_sys_message('prompts/article_assessment_prompt.txt', 'schemas/article_assessment.json')
+    user_contents = []
+    for article_draft in pending_drafts:
         user_content = f"News article draft:\n\n" + article_draft["news_article"]
+        user_contents.append(user_content)
+
+    json_objs = invoke_stage(sys_message, user_contents, 'assessment')
+    for article_draft, json_obj in zip(pending_drafts, json_objs):
         try:
-            pipeline = client | parser
-            json_obj = pipeline.invoke([
-                    SystemMessage(content=sys_message),
-                    HumanMessage(content=user_content)
-                ]
-            )
-
-            if 'properties' not in json_obj:
-                article_draft["editor_feedback"] = json_obj
-                res_article_drafts.append(article_draft)
-                # best article estimation
-                score_avg = sum([float(article_draft["editor_feedback"][crit]["score"]) for crit in article_draft["editor_feedback"]]) / len(article_draft["editor_feedback"])
-                id = article_draft['id']
-                if id not in best_article_drafts:
-                    best_article_drafts[id] = {'news_article': article_draft['news_article'], 'keywords':  article_draft['keywords'], 'score': score_avg}
-                elif best_article_drafts[id]['score'] < score_avg:
-                    logger.info(f'Article draft {str(id)} was improved after revise')
-                    best_article_drafts[id]['news_article'] = article_draft['news_article']
-                    best_article_drafts[id]['keywords'] = article_draft['keywords']
-                    best_article_drafts[id]['score'] = score_avg
-            else:
-                raise Exception("Illegal format of json output")
+            if isinstance(json_obj, Exception):
+                raise json_obj
+
+            article_draft["editor_feedback"] = json_obj
+            # best article estimation
+            score_avg = sum([float(article_draft["editor_feedback"][crit]["score"]) for crit in article_draft["editor_feedback"]]) / len(article_draft["editor_feedback"])
+            id = article_draft['id']
+            if id not in best_article_drafts:
+                best_article_drafts[id] = {'news_article': article_draft['news_article'], 'keywords':  article_draft['keywords'], 'score': score_avg}
+            elif best_article_drafts[id]['score'] < score_avg:
+                logger.info(f'Article draft {str(id)} was improved after revise')
+                best_article_drafts[id]['news_article'] = article_draft['news_article']
+                best_article_drafts[id]['keywords'] = article_draft['keywords']
+                best_article_drafts[id]['score'] = score_avg
+            logger.info(f"Article draft {str(id)} {'passed' if draft_passed(article_draft) else 'failed'} assessment")
         except Exception as e:
             logger.error(f"Error: processing opinion {article_draft['resource_uri']}")
             logger.error(e)
+    # Drafts whose assessment failed are dropped
+    res_article_drafts = [article_draft for article_draft in article_drafts if "editor_feedback" in article_draft]
     return {"article_drafts": res_article_drafts, "best_article_drafts": best_article_drafts, "attempts": attempts}
 
 # Define the function that determines whether to continue or not
@@ -300,54 +677,53 @@ def should_continue(state: Dict) -> Literal["generate_headline", "rewrite_articl
     logger.info(f"should continue? {attempts} attempts, {len(articles)} articles")
     if attempts < config.MAX_ATTEMPTS:
         for article in articles:
-            assessment = article['editor_feedback']
-            for k in assessment:
-                criteria = assessment[k]
-                if int(criteria["score"]) <= 8:
-                    return "rewrite_articles_draft"
+            if not draft_passed(article):
+                return "rewrite_articles_draft"
     return "generate_headline"
 
+# Draft fields the rewrite prompt needs
+REWRITE_PROMPT_FIELDS = ["id", "reason", "keypoints", "news_article", "keywords", "editor_feedback"]
+
 def rewrite_articles_draft(state: Dict) -> Dict:
     """
-    Write draft articles based on the opinions with key points.
+    Re-write the article drafts which failed editorial assessment, taking editor feedback into account.
 
-    :param state: The current state containing opinions with key points.
+    Drafts which passed are carried forward untouched. Rewritten drafts lose their editor feedback,
+    so only they are assessed again.
+
+    :param state: The current state containing assessed article drafts.
     :return: A dictionary with article drafts.
     """
     logger.info(f"re-write article")
     logger.debug("<-----re-write_articles_draft state----->")
     opinions = state["article_drafts"]
+    failed_opinions = [opinion for opinion in opinions if not draft_passed(opinion)]
+    logger.info(f"re-write {len(failed_opinions)} of {len(opinions)} drafts")
     attempts = state.get("attempts", 1)
-    res_article_drafts = []
-    parser = JsonOutputParser()
-    sys_intro = get_resource_content('prompts/rewrite_draft_prompt.txt')
-    sys_schema = get_resource_content('schemas/rewritten_draft_output.json')
-    sys_message = compose_sys_content(sys_intro, sys_schema)
+    sys_message = get_sys_message('prompts/rewrite_draft_prompt.txt', 'schemas/rewritten_draft_output.json')
 
-    for opinion in opinions:
+    user_contents = []
+    for opinion in failed_opinions:
         id = opinion["id"]
-        user_content = f"Here is a court opinion id#{id}:\n" + json.dumps(opinion)
+        user_content = f"Here is a court opinion id#{id}:\n" + json.dumps(select_fields(opinion, REWRITE_PROMPT_FIELDS))
+        user_contents.append(user_content)
+
+    json_objs = invoke_stage(sys_message, user_contents, 'rewrite')
+    for opinion, json_obj in zip(failed_opinions, json_objs):
         try:
-            pipeline = client | parser
-            json_obj = pipeline.invoke([
-                    SystemMessage(content=sys_message),
-                    HumanMessage(content=user_content)
-                ]
-            )
-
-            if 'properties' not in json_obj:
-                opinion["news_article"] = json_obj["rewritten_news_article"]
-                opinion["keywords"] = json_obj["keywords"]
-                res_article_drafts.append(opinion)
-            else:
-                raise Exception("Illegal format of the json output")
+            if isinstance(json_obj, Exception):
+                raise json_obj
+
+            opinion["news_article"] = json_obj["rewritten_news_article"]
+            opinion["keywords"] = json_obj["keywords"]
+            del opinion["editor_feedback"]
         except Exception as e:
+            # The previous draft, with its feedback, is kept
             logger.error(f"Error: processing opinion {opinion['resource_uri']}")
             logger.error(e)
     logger.debug("</-----re-write_articles_draft state----->")
     attempts += 1
-    return {"article_drafts": res_article_drafts, "attempts": attempts, "best_article_drafts": state["best_article_drafts"]}
-
+    return {"article_drafts": opinions, "attempts": attempts, "best_article_drafts": state["best_article_drafts"]}
 
 def generate_headline(state: Dict) -> Dict:
     """
@@ -360,48 +736,119 @@ def generate_headline(state: Dict) -> Dict:
     article_drafts = state["article_drafts"]
     logger.info(f"generate headlines: {article_drafts} drafts")
     res_articles = []
-    parser = JsonOutputParser()
-    sys_intro = get_resource_content('prompts/headline_prompt.txt')
-    sys_schema = get_resource_content('schemas/headline_output.json')
-    sys_message = compose_sys_content(sys_intro, sys_schema)
+    sys_message = get_sys_message('prompts/headline_prompt.txt', 'schemas/headline_output.json')
 
+    user_contents = []
     for article_draft in article_drafts:
         user_content = f"Keywords:\n" + ",".join([kw["keyword"] for kw in article_draft["keywords"]]) + \
                        f"\n\nNews article:\n:" + json.dumps(article_draft["news_article"])
+        user_contents.append(user_content)
+
+    json_objs = invoke_stage(sys_message, user_contents, 'headline')
+    for article_draft, json_obj in zip(article_drafts, json_objs):
         try:
-            pipeline = client | parser
-            json_obj = pipeline.invoke([
-                    SystemMessage(content=sys_message),
-                    HumanMessage(content=user_content)
-                ]
-            )
-
-            if 'properties' not in json_obj:
-                article  = {"source_date_created": article_draft["date_created"], "source_date_modified": article_draft["date_modified"],
-                            "keypoints": article_draft["keypoints"], "headline": json_obj["headline"], "news_article": article_draft["news_article"]}
-                article["keywords"] = [kw["keyword"] for kw in article_draft["keywords"]]
-                article["date_created"] = datetime.now(UTC).isoformat()
-                parsed = parse_url(article_draft["resource_uri"])
-                source_url = parsed.scheme + "://" + parsed.host + article_draft["absolute_url"]
-                article["source_url"] = source_url
-                article["why_newsworthy"] = article_draft["reason"]
-                if "people" in article_draft:
-                    article["people"] = article_draft["people"]
-                if "events" in article_draft:
-                    article["events"] = article_draft["events"]
-                if "organizations" in article_draft:
-                    article["organizations"] = article_draft["organizations"]
-                if "labels" in article_draft:
-                    article["categories"] = article_draft["labels"]
-                res_articles.append(article)
-            else:
-                raise Exception("Illegal format of json output")
+            if isinstance(json_obj, Exception):
+                raise json_obj
+
+            article  = {"source_date_created": article_draft["date_created"], "source_date_modified": article_draft["date_modified"],
+                        "keypoints": article_draft["keypoints"], "headline": json_obj["headline"], "news_article": article_draft["news_article"]}
+            article["keywords"] = [kw["keyword"] for kw in article_draft["keywords"]]
+            article["date_created"] = datetime.now(UTC).isoformat()
+            parsed = parse_url(article_draft["resource_uri"])
+            source_url = parsed.scheme + "://" + parsed.host + article_draft["absolute_url"]
+            article["source_url"] = source_url
+            if article_draft.get("duplicates"):
+                article["related_source_urls"] = [parsed.scheme + "://" + parsed.host + duplicate["absolute_url"]
+                                                  for duplicate in article_draft["duplicates"]]
+            article["why_newsworthy"] = article_draft["reason"]
+            if "people" in article_draft:
+                article["people"] = article_draft["people"]
+            if "events" in article_draft:
+                article["events"] = article_draft["events"]
+            if "organizations" in article_draft:
+                article["organizations"] = article_draft["organizations"]
+            if "labels" in article_draft:
+                article["categories"] = article_draft["labels"]
+            res_articles.append(article)
         except Exception as e:
             logger.error(f"Error: processing opinion {article_draft['resource_uri']}")
             logger.error(e)
     logger.debug("</-----generate_headline state----->")
     return {"articles": res_articles}
 
+# Guards appends to the article stream file from concurrent per-opinion branches
+_stream_lock = threading.Lock()
+# Source URLs of the articles in each stream file, loaded on first publication to the file
+_published_urls: Dict[str, set] = {}
+
+def open_article_stream(state: Dict) -> Dict:
+    """
+    Start the article stream file of a run: `legal_news_stream_<timestamp>.jsonl` in the output folder,
+    or the ARTICLE_STREAM_FILE file, truncated.
+
+    The file is kept in the state, so a resumed run appends to the file it started.
+
+    :param state: The current state.
+    :return: A dictionary with the path of the stream file.
+    """
+    logger.debug("<-----open_article_stream state----->")
+    output_dir = os.getenv('OUTPUT_DIR', 'output')
+    Path(output_dir).mkdir(parents=True, exist_ok=True)
+    dtstamp = datetime.now(UTC).strftime("%Y%m%d%H%M%S")
+    filepath = os.getenv('ARTICLE_STREAM_FILE') or os.path.join(output_dir, f'legal_news_stream_{dtstamp}.jsonl')
+    with _stream_lock:
+        open(filepath, 'w').close()
+        _published_urls[filepath] = set()
+    logger.info(f"publishing articles to {filepath}")
+    logger.debug("</-----open_article_stream state----->")
+    return {"stream_file": filepath}
+
+def published_urls(filepath: str) -> set:
+    """
+    Get the source URLs of the articles already in a stream file, e.g. published before a run was interrupted.
+    To be called with `_stream_lock` held.
+
+    :param filepath: The stream file.
+    :return: The source URLs, updated by the caller on publication.
+    """
+    if filepath not in _published_urls:
+        urls = set()
+        if os.path.exists(filepath):
+            with jsonlines.open(filepath, mode='r') as reader:
+                urls = {article.get("source_url") for article in reader}
+        _published_urls[filepath] = urls
+    return _published_urls[filepath]
+
+def publish_articles(state: Dict) -> Dict:
+    """
+    Append finished news articles to the article stream file of the run as soon as their opinion is processed,
+    skipping articles already published, e.g. by the branches of a resumed run completed before the interruption.
+
+    Used by the streaming workflow, so articles are available before the whole batch completes.
+
+    :param state: The current per-opinion state containing news articles and the stream file, see `open_article_stream`.
+    :return: A dictionary with the news articles.
+    """
+    logger.debug("<-----publish_articles state----->")
+    articles = state.get("articles") or []
+    if articles:
+        filepath = state.get("stream_file") or os.getenv('ARTICLE_STREAM_FILE') or \
+            os.path.join(os.getenv('OUTPUT_DIR', 'output'), 'legal_news_stream.jsonl')
+        Path(filepath).parent.mkdir(parents=True, exist_ok=True)
+        with _stream_lock:
+            published = published_urls(filepath)
+            new_articles = [article for article in articles if article.get("source_url") not in published]
+            with jsonlines.open(filepath, mode='a') as writer:
+                writer.write_all(new_articles)
+            published.update(article.get("source_url") for article in new_articles)
+        for article in articles:
+            if article in new_articles:
+                logger.info(f"article published: {article['headline']}")
+            else:
+                logger.info(f"article already published: {article['headline']}")
+    logger.debug("</-----publish_articles state----->")
+    return {"articles": articles}
+
 def save_articles(state: Dict) -> Dict:
     """
     Store generated news articles in the output folder
@@ -423,7 +870,18 @@ def save_articles(state: Dict) -> Dict:
     logger.debug("</-----save_articles state----->")
     return {"news_file": filepath, "news_num": len(article_drafts)}
 
+EMAIL_HTML_TEMPLATE = 'templates/email_html.jinja'
+EMAIL_TXT_TEMPLATE = 'templates/email_txt.jinja'
+
 def notify_subscribers(state: Dict) -> Dict:
+    """
+    Send every subscriber a digest of the articles matching their preferences.
+
+    Subscribers receiving the same selection of articles share one rendered digest.
+
+    :param state: The current state containing the news file.
+    :return: A dictionary with the notification status.
+    """
     news_num = state["news_num"]
     if news_num == 0:
         return {"notification": "skipped"}
@@ -432,7 +890,62 @@ def notify_subscribers(state: Dict) -> Dict:
     logger.info(f"news letter for {len(recipients)} subscribers")
     current_date = datetime.now(UTC).strftime('%B %d, %Y')
     subject = f'AI Assistant - Legal News Update - {current_date}'
-    html_body = render_template('templates/email_html.jinja', news_file)
-    txt_body = render_template('templates/email_txt.jinja', news_file)
-    send_email(subject, html_body, txt_body, recipients)
+    articles = load_articles(news_file)
+    digests = SubscriptionIndex(recipients, get_preferences()).group_digests(articles)
+    use_outbox = os.getenv('EMAIL_DELIVERY', config.EMAIL_DELIVERY) == 'outbox'
+    failed = {}
+    for selection, digest_recipients in digests.items():
+        bodies = render_templates([EMAIL_HTML_TEMPLATE, EMAIL_TXT_TEMPLATE],
+                                  articles=[articles[i] for i in selection])
+        html_body, txt_body = bodies[EMAIL_HTML_TEMPLATE], bodies[EMAIL_TXT_TEMPLATE]
+        if use_outbox:
+            outbox.get_outbox().enqueue(subject, html_body, txt_body, digest_recipients)
+            continue
+        report = send_email(subject, html_body, txt_body, digest_recipients)
+        if report:
+            failed.update(report["failed"])
+    if use_outbox:
+        return {"notification": "queued"}
+    if failed:
+        logger.warning(f"news letter not delivered to {len(failed)} subscribers: {', '.join(failed)}")
     return {"notification": "done"}
+
+def save_fetch_state(state: Dict) -> Dict:
+    """
+    Persist the new last processed opinion ID after a successful run, index the run's representative
+    opinions for dedup, and delete the run's opinion spool, the opinion texts unused for TEXT_STORE_TTL
+    seconds and the dedup signatures older than DEDUP_INDEX_TTL seconds.
+
+    The ingestion state file is replaced atomically, so a crash never leaves a truncated checkpoint.
+
+    :param state: The current state containing the fetched last processed opinion ID.
+    :return: A dictionary with the persisted last processed opinion ID.
+    """
+    logger.debug("<-----save_fetch_state state----->")
+    filepath = os.getenv("FETCH_STATE_FILE")
+    last_id = state.get("fetched_last_id")
+    if last_id is None:
+        last_id = state["last_processed_id"]
+    state_obj = {}
+    if os.path.exists(filepath):
+        with open(filepath, 'r') as sf:
+            state_obj = json.load(sf)
+    state_obj["last_processed_id"] = last_id
+    atomic_write_json(filepath, state_obj)
+    logger.info(f"checkpoint saved: last processed id {last_id}")
+    if state.get("opinions_spool") and os.path.exists(state["opinions_spool"]):
+        OpinionSpool(state["opinions_spool"]).remove()
+    if float(os.getenv("DEDUP_THRESHOLD", config.DEDUP_THRESHOLD)) > 0:
+        index, _ = dedup.get_index()
+        logger.info(f"dedup index: {index.commit_pending()} opinions indexed")
+        max_age = float(os.getenv("DEDUP_INDEX_TTL", config.DEDUP_INDEX_TTL))
+        pruned = index.prune(max_age) if max_age > 0 else 0
+        if pruned:
+            logger.info(f"dedup index: {pruned} opinions older than {max_age:.0f}s deleted")
+    store = blob_store.get_store()
+    if store is not None:
+        pruned = store.prune(float(os.getenv("TEXT_STORE_TTL", config.TEXT_STORE_TTL)))
+        if pruned:
+            logger.info(f"text store: {pruned} unused opinion texts deleted")
+    logger.debug("</-----save_fetch_state state----->")
+    return {"last_processed_id": last_id}
@@ -0,0 +1,219 @@
+"""Bounded HTTP response cache with optional on-disk persistence and revalidation
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+import logging
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+from typing_extensions import TypedDict
+
+from media_agents.file_utils import atomic_write_json
+
+# Initialize logger
+logger = logging.getLogger(__name__)
+
+
+class CacheEntry(TypedDict):
+    """
+    Cached response of a URL.
+
+    Attributes:
+        url (str): The requested URL.
+        body (str): The response body.
+        etag (str): Value of the ETag response header, if any.
+        last_modified (str): Value of the Last-Modified response header, if any.
+        stored_at (float): Unix time the response was fetched or last revalidated.
+    """
+    url: str
+    body: str
+    etag: Optional[str]
+    last_modified: Optional[str]
+    stored_at: float
+
+
+class ResponseCache:
+    """
+    LRU response cache bounded by number of entries and entry age.
+
+    Entries older than `ttl` are not served directly, but are kept (in memory and on disk)
+    so they can be revalidated with a conditional request instead of downloaded again.
+    On disk, entries not stored or revalidated for `max_age` seconds are deleted, and the
+    oldest entries over `max_disk_entries`.
+    """
+
+    # Number of stored entries between two prunings of the cache directory
+    PRUNE_EVERY = 20
+
+    def __init__(self, max_entries: int, ttl: float, cache_dir: Optional[str] = None,
+                 max_disk_entries: int = 0, max_age: float = 0):
+        """
+        :param max_entries: Maximum number of entries kept in memory.
+        :param ttl: Number of seconds a response is served without revalidation.
+        :param cache_dir: Optional directory persisting entries across processes.
+        :param max_disk_entries: Maximum number of entries kept on disk, 0 for no limit.
+        :param max_age: Maximum age in seconds of an entry kept on disk, 0 for no limit.
+        """
+        self.max_entries = max(1, max_entries)
+        self.ttl = ttl
+        self.cache_dir = cache_dir
+        self.max_disk_entries = max_disk_entries
+        self.max_age = max_age
+        self._writes = 0
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.revalidations = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def _entry_path(self, url: str) -> str:
+        return os.path.join(self.cache_dir, hashlib.sha256(url.encode('utf-8')).hexdigest() + '.json')
+
+    def _load(self, url: str) -> Optional[CacheEntry]:
+        if not self.cache_dir:
+            return None
+        path = self._entry_path(url)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, 'r', encoding='utf-8') as fh:
+                entry = CacheEntry(json.load(fh))
+        except (OSError, ValueError) as ex:
+            logger.warning(f"Ignoring unreadable cache entry {path}: {ex}")
+            return None
+        return entry if entry.get('url') == url else None
+
+    def _remember(self, entry: CacheEntry) -> None:
+        self._entries[entry['url']] = entry
+        self._entries.move_to_end(entry['url'])
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def lookup(self, url: str) -> Tuple[Optional[CacheEntry], bool]:
+        """
+        Look up the cached response of a URL.
+
+        :param url: The requested URL.
+        :return: A tuple of the cached entry (or None) and whether it is fresh enough to be served.
+        """
+        with self._lock:
+            entry = self._entries.get(url)
+            if entry is None:
+                entry = self._load(url)
+                if entry is not None:
+                    self._remember(entry)
+            else:
+                self._entries.move_to_end(url)
+            if entry is None:
+                self.misses += 1
+                return None, False
+            fresh = time.time() - entry['stored_at'] < self.ttl
+            if fresh:
+                self.hits += 1
+            else:
+                self.stale += 1
+            return entry, fresh
+
+    def store(self, url: str, body: str, etag: Optional[str], last_modified: Optional[str]) -> None:
+        """
+        Store a fetched response.
+
+        :param url: The requested URL.
+        :param body: The response body.
+        :param etag: Value of the ETag response header, if any.
+        :param last_modified: Value of the Last-Modified response header, if any.
+        """
+        entry = CacheEntry(url=url, body=body, etag=etag, last_modified=last_modified, stored_at=time.time())
+        with self._lock:
+            self._remember(entry)
+            self._writes += 1
+            prune = self._writes % self.PRUNE_EVERY == 0
+        if self.cache_dir:
+            atomic_write_json(self._entry_path(url), entry)
+            if prune:
+                self.prune()
+
+    def prune(self) -> int:
+        """
+        Delete the on-disk entries older than `max_age`, then the oldest entries over `max_disk_entries`.
+
+        :return: The number of deleted entries.
+        """
+        if not self.cache_dir or not (self.max_age or self.max_disk_entries):
+            return 0
+        entries = []
+        for item in os.scandir(self.cache_dir):
+            if item.is_file() and item.name.endswith('.json'):
+                try:
+                    entries.append((item.stat().st_mtime, item.path))
+                except OSError:
+                    # deleted by a concurrent pruning
+                    continue
+        entries.sort(reverse=True)
+        deadline = time.time() - self.max_age
+        expired = [path for i, (mtime, path) in enumerate(entries)
+                   if (self.max_age and mtime < deadline) or (self.max_disk_entries and i >= self.max_disk_entries)]
+        for path in expired:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        if expired:
+            logger.info(f"http cache: {len(expired)} entries deleted from {self.cache_dir}")
+        return len(expired)
+
+    def revalidated(self, url: str) -> None:
+        """
+        Mark a cached response as confirmed unchanged by the server (HTTP 304).
+
+        :param url: The requested URL.
+        """
+        with self._lock:
+            entry = self._entries.get(url)
+            if entry is None:
+                return
+            entry['stored_at'] = time.time()
+            self.revalidations += 1
+        if self.cache_dir:
+            atomic_write_json(self._entry_path(url), entry)
+
+    def clear(self) -> None:
+        """
+        Drop all in-memory entries and reset the counters.
+        """
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = self.stale = self.revalidations = 0
+
+    def stats(self) -> Dict:
+        """
+        Get the cache counters.
+
+        :return: A dictionary with the number of hits, misses, stale lookups, successful
+            revalidations and in-memory entries.
+        """
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "stale": self.stale,
+                    "revalidations": self.revalidations, "entries": len(self._entries)}
+
+
+def conditional_headers(entry: Optional[CacheEntry]) -> Dict:
+    """
+    Build the revalidation headers of a cached response.
+
+    :param entry: The cached entry, if any.
+    :return: A dictionary with If-None-Match / If-Modified-Since headers.
+    """
+    headers = {}
+    if entry is None:
+        return headers
+    if entry.get('etag'):
+        headers['If-None-Match'] = entry['etag']
+    if entry.get('last_modified'):
+        headers['If-Modified-Since'] = entry['last_modified']
+    return headers
@@ -0,0 +1,190 @@
+"""Shared HTTP session and concurrent page fetching for CourtListener requests
+"""
+import os
+import json
+import threading
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, List, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util import parse_url
+
+import media_agents.config as config
+from media_agents.http_cache import ResponseCache, conditional_headers
+from media_agents.metrics import metrics
+
+# Initialize logger
+logger = logging.getLogger(__name__)
+
+# Define custom headers including a User-Agent
+DEFAULT_HEADERS = {
+    'Content-Type': 'application/json',
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/58.0.3029.110 Safari/537.3'
+}
+
+
+class RateLimiter:
+    """
+    Thread-safe per-host rate limiter.
+
+    Requests to the same host are spaced at least `1 / rate` seconds apart,
+    regardless of how many worker threads are issuing them.
+    """
+
+    def __init__(self, rate: float):
+        """
+        :param rate: Maximum number of requests per second per host. 0 or less disables limiting.
+        """
+        self.interval = 1.0 / rate if rate and rate > 0 else 0.0
+        self._lock = threading.Lock()
+        self._next_slot = {}
+
+    def wait(self, host: str) -> None:
+        """
+        Block until the next request slot for the given host is available.
+
+        :param host: The host name the request is sent to.
+        """
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot.get(host, now))
+            self._next_slot[host] = slot + self.interval
+        delay = slot - now
+        if delay > 0:
+            time.sleep(delay)
+
+
+_session = None
+_rate_limiter = None
+_response_cache = None
+_lock = threading.Lock()
+
+
+def configure(pool_size: int, rate: float) -> None:
+    """
+    (Re)create the shared keep-alive session and the per-host rate limiter.
+
+    :param pool_size: Maximum number of pooled connections per host.
+    :param rate: Maximum number of requests per second per host.
+    """
+    global _session, _rate_limiter
+    session = requests.Session()
+    session.headers.update(DEFAULT_HEADERS)
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(1, pool_size))
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    with _lock:
+        old_session = _session
+        _session = session
+        _rate_limiter = RateLimiter(rate)
+    if old_session is not None:
+        old_session.close()
+    logger.info(f"http session configured: pool size {pool_size}, rate limit {rate}/s per host")
+
+
+def get_session() -> requests.Session:
+    """
+    Get the shared keep-alive session, creating it from the FETCH_CONCURRENCY and
+    FETCH_RATE_LIMIT settings if not configured yet.
+
+    :return: The shared requests session.
+    """
+    if _session is None:
+        configure(get_concurrency(), float(os.getenv("FETCH_RATE_LIMIT", config.FETCH_RATE_LIMIT)))
+    return _session
+
+
+def get_concurrency() -> int:
+    """
+    Get the configured maximum number of CourtListener requests in flight.
+
+    :return: The concurrency limit.
+    """
+    return max(1, int(os.getenv("FETCH_CONCURRENCY", config.FETCH_CONCURRENCY)))
+
+
+def get_cache() -> ResponseCache:
+    """
+    Get the shared response cache, creating it from the HTTP_CACHE_MAX_ENTRIES, HTTP_CACHE_TTL,
+    HTTP_CACHE_DIR, HTTP_CACHE_MAX_DISK_ENTRIES and HTTP_CACHE_MAX_AGE settings if not created yet.
+
+    :return: The shared response cache.
+    """
+    global _response_cache
+    with _lock:
+        if _response_cache is None:
+            _response_cache = ResponseCache(
+                int(os.getenv("HTTP_CACHE_MAX_ENTRIES", config.HTTP_CACHE_MAX_ENTRIES)),
+                float(os.getenv("HTTP_CACHE_TTL", config.HTTP_CACHE_TTL)),
+                os.getenv("HTTP_CACHE_DIR") or None,
+                int(os.getenv("HTTP_CACHE_MAX_DISK_ENTRIES", config.HTTP_CACHE_MAX_DISK_ENTRIES)),
+                float(os.getenv("HTTP_CACHE_MAX_AGE", config.HTTP_CACHE_MAX_AGE)))
+        return _response_cache
+
+
+def set_cache(cache: Optional[ResponseCache]) -> None:
+    """
+    Replace the shared response cache, e.g. to change its bounds. None recreates it from the settings on next use.
+
+    :param cache: The response cache to use.
+    """
+    global _response_cache
+    with _lock:
+        _response_cache = cache
+
+
+def get_json(url: str, timeout: float = 30) -> Optional[Dict]:
+    """
+    Fetch JSON content from a URL through the shared session, honouring the per-host rate limit.
+
+    Fresh cached responses are served without a request; stale ones are revalidated
+    with their ETag / Last-Modified validators.
+
+    :param url: The URL to fetch the content from.
+    :param timeout: Request timeout in seconds.
+    :return: The JSON content of the response if successful, otherwise None.
+    """
+    cache = get_cache()
+    entry, fresh = cache.lookup(url)
+    if fresh:
+        metrics.inc("http_cache_total", result="fresh")
+        return json.loads(entry['body'])
+
+    session = get_session()
+    host = parse_url(url).host
+    _rate_limiter.wait(host)
+    with metrics.timer("http_request_seconds", host=host):
+        response = session.get(url, headers=conditional_headers(entry), timeout=timeout)
+
+    if response.status_code == 304 and entry is not None:
+        metrics.inc("http_cache_total", result="revalidated")
+        cache.revalidated(url)
+        return json.loads(entry['body'])
+    metrics.inc("http_cache_total", result="miss")
+    # Check if the request was successful (HTTP status code 200)
+    if response.status_code == 200:
+        cache.store(url, response.text, response.headers.get('ETag'), response.headers.get('Last-Modified'))
+        return response.json()
+    logger.warning(f"GET {url} returned HTTP {response.status_code}")
+    return None
+
+
+def fetch_all(urls: Iterable[str], fetch: Callable[[str], Optional[Dict]], max_workers: int) -> List[Optional[Dict]]:
+    """
+    Fetch several URLs concurrently.
+
+    :param urls: The URLs to fetch.
+    :param fetch: The function used to fetch a single URL.
+    :param max_workers: Maximum number of requests in flight.
+    :return: The fetched contents, in the same order as `urls`.
+    """
+    urls = list(urls)
+    if max_workers <= 1 or len(urls) <= 1:
+        return [fetch(url) for url in urls]
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='fetch') as executor:
+        return list(executor.map(fetch, urls))
@@ -0,0 +1,386 @@
+"""Offline execution of graph stages through provider batch APIs
+"""
+import hashlib
+import json
+import os
+import threading
+import logging
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from typing_extensions import TypedDict
+
+from langchain_core.output_parsers import JsonOutputParser
+
+import media_agents.config as config
+from media_agents import llm_router
+from media_agents.file_utils import atomic_write_json
+from media_agents.structured_output import StructuredOutputError, validate
+
+# Initialize logger
+logger = logging.getLogger(__name__)
+
+# Batch states of the provider batch APIs
+COMPLETED = "completed"
+FAILED_STATES = {"failed", "expired", "cancelled", "cancelling"}
+
+
+class BatchPending(Exception):
+    """
+    Raised by a graph node whose LLM calls were submitted as a batch which has not completed yet.
+
+    The workflow stops at that node; resuming the run from its checkpoint polls the batch again.
+    """
+
+    def __init__(self, stage: str, batch_id: str, status: str):
+        super().__init__(f"{stage}: batch {batch_id} is {status}")
+        self.stage = stage
+        self.batch_id = batch_id
+        self.status = status
+
+
+class BatchFailed(RuntimeError):
+    """
+    Raised when the provider reports a batch as failed, expired or cancelled.
+    The batch is forgotten, so resuming the run submits it again.
+    """
+
+
+class BatchRecord(TypedDict):
+    """
+    Submitted batch of a stage, persisted in the batch directory.
+
+    Attributes:
+        key (str): Hash of the batched calls, also the file name.
+        stage (str): The stage name.
+        model (str): The model name.
+        batch_id (str): The batch id given by the backend.
+        status (str): The last polled batch status.
+        size (int): The number of calls.
+    """
+    key: str
+    stage: str
+    model: str
+    batch_id: str
+    status: str
+    size: int
+
+
+def is_enabled() -> bool:
+    """
+    Check whether LLM calls are run through the provider batch API.
+
+    :return: True if LLM_MODE is "batch".
+    """
+    return os.getenv("LLM_MODE", config.LLM_MODE) == "batch"
+
+
+def batch_key(stage: str, model: str, sys_message: str, user_contents: List[str], temperature: Optional[float]) -> str:
+    """
+    Build the key identifying the batch of a stage, the same calls always map to the same batch.
+
+    :return: The hex digest of the calls.
+    """
+    digest = hashlib.sha256(json.dumps([stage, model, sys_message, temperature]).encode('utf-8'))
+    for user_content in user_contents:
+        digest.update(hashlib.sha256(user_content.encode('utf-8')).digest())
+    return digest.hexdigest()
+
+
+def build_requests(model: str, sys_message: str, user_contents: List[str], temperature: Optional[float],
+                   schema: Optional[Dict] = None) -> List[Dict]:
+    """
+    Build the chat completion requests of a batch, in the OpenAI batch input format.
+
+    :param model: The model name.
+    :param sys_message: The system message shared by every call.
+    :param user_contents: The user message of each call.
+    :param temperature: The sampling temperature.
+    :param schema: The JSON schema of the answers, object answers are requested in JSON mode.
+    :return: One request per call, identified by its index as `custom_id`.
+    """
+    requests = []
+    for i, user_content in enumerate(user_contents):
+        body = {"model": model,
+                "messages": [{"role": "system", "content": sys_message}, {"role": "user", "content": user_content}]}
+        if temperature is not None:
+            body["temperature"] = temperature
+        # JSON mode only produces objects
+        if schema is not None and schema.get("type") == "object":
+            body["response_format"] = {"type": "json_object"}
+        requests.append({"custom_id": str(i), "method": "POST", "url": "/v1/chat/completions", "body": body})
+    return requests
+
+
+def write_jsonl(path: str, records: List[Dict]) -> None:
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as fh:
+        for record in records:
+            fh.write(json.dumps(record) + '\n')
+    os.replace(tmp_path, path)
+
+
+def read_jsonl(path: str) -> List[Dict]:
+    with open(path, 'r', encoding='utf-8') as fh:
+        return [json.loads(line) for line in fh if line.strip()]
+
+
+class OpenAIBatchBackend:
+    """
+    OpenAI Batch API: the requests file is uploaded, then processed by OpenAI within the completion window
+    at a discounted price.
+    """
+
+    name = "openai"
+    # Providers of the models the backend runs
+    providers = ("openai",)
+
+    def __init__(self, completion_window: Optional[str] = None):
+        """
+        :param completion_window: The batch completion window, defaults to LLM_BATCH_COMPLETION_WINDOW.
+        """
+        self.completion_window = completion_window or os.getenv("LLM_BATCH_COMPLETION_WINDOW",
+                                                                config.LLM_BATCH_COMPLETION_WINDOW)
+        self._client = None
+
+    @property
+    def client(self) -> Any:
+        if self._client is None:
+            from openai import OpenAI
+            self._client = OpenAI()
+        return self._client
+
+    def submit(self, requests_path: str) -> str:
+        """
+        Submit a batch.
+
+        :param requests_path: Path of the JSONL requests file.
+        :return: The batch id.
+        """
+        with open(requests_path, 'rb') as fh:
+            input_file = self.client.files.create(file=fh, purpose="batch")
+        batch = self.client.batches.create(input_file_id=input_file.id, endpoint="/v1/chat/completions",
+                                           completion_window=self.completion_window)
+        return batch.id
+
+    def status(self, batch_id: str) -> str:
+        """
+        Get the status of a batch, e.g. "validating", "in_progress", "completed" or "failed".
+
+        :param batch_id: The batch id.
+        :return: The batch status.
+        """
+        return self.client.batches.retrieve(batch_id).status
+
+    def results(self, batch_id: str) -> List[Dict]:
+        """
+        Download the results of a completed batch.
+
+        :param batch_id: The batch id.
+        :return: The result records, in the OpenAI batch output format.
+        """
+        batch = self.client.batches.retrieve(batch_id)
+        records = []
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if file_id:
+                content = self.client.files.content(file_id).text
+                records.extend(json.loads(line) for line in content.splitlines() if line.strip())
+        return records
+
+
+class LocalBatchBackend:
+    """
+    In-process stand-in of a provider batch API, answering every request with a function.
+
+    A batch completes after being polled `polls` times, so tests can exercise pending batches.
+    """
+
+    name = "local"
+
+    def __init__(self, respond: Callable[[Dict], str], polls: int = 1, providers: Optional[Tuple[str, ...]] = None):
+        """
+        :param respond: Function called with the body of a request, returning the answer text.
+        :param polls: Number of status polls a batch stays in progress.
+        :param providers: Providers of the models the backend runs, None for any.
+        """
+        self.respond = respond
+        self.polls = polls
+        self.providers = providers
+        self.batches: Dict[str, Dict] = {}
+        self._lock = threading.Lock()
+
+    def submit(self, requests_path: str) -> str:
+        with self._lock:
+            batch_id = f"local-batch-{len(self.batches) + 1}"
+            self.batches[batch_id] = {"requests": read_jsonl(requests_path), "polls": 0}
+        return batch_id
+
+    def status(self, batch_id: str) -> str:
+        with self._lock:
+            batch = self.batches[batch_id]
+            batch["polls"] += 1
+            return COMPLETED if batch["polls"] > self.polls else "in_progress"
+
+    def results(self, batch_id: str) -> List[Dict]:
+        records = []
+        for request in self.batches[batch_id]["requests"]:
+            content = self.respond(request["body"])
+            records.append({"custom_id": request["custom_id"], "error": None,
+                            "response": {"status_code": 200, "body": {
+                                "model": request["body"]["model"],
+                                "choices": [{"index": 0, "message": {"role": "assistant", "content": content}}],
+                                "usage": {"prompt_tokens": 0, "completion_tokens": 0}}}})
+        return records
+
+
+def parse_result(record: Optional[Dict], schema: Optional[Dict], name: str) -> Any:
+    """
+    Get the parsed answer of a batch result record.
+
+    :param record: The result record, None if the batch has no result for the call.
+    :param schema: The JSON schema of the answer, None to skip validation.
+    :param name: The name of the output, used in error messages.
+    :return: The valid answer, or the exception describing why it is unusable.
+    """
+    if record is None:
+        return StructuredOutputError(f"no {name} result in batch")
+    response = record.get("response") or {}
+    if record.get("error") or response.get("status_code") != 200:
+        error = record.get("error") or (response.get("body") or {}).get("error")
+        return RuntimeError(f"{name} batch request failed: {error}")
+    try:
+        content = response["body"]["choices"][0]["message"]["content"]
+        output = JsonOutputParser().parse(content)
+    except Exception as ex:
+        return ex
+    errors = validate(output, schema) if schema is not None else []
+    if errors:
+        return StructuredOutputError(f"invalid {name} output: {'; '.join(errors[:5])}")
+    return output
+
+
+def usage(records: List[Dict]) -> Tuple[int, int]:
+    input_tokens = output_tokens = 0
+    for record in records:
+        tokens = (((record.get("response") or {}).get("body") or {}).get("usage")) or {}
+        input_tokens += tokens.get("prompt_tokens", 0)
+        output_tokens += tokens.get("completion_tokens", 0)
+    return input_tokens, output_tokens
+
+
+class BatchRunner:
+    """
+    Runs the LLM calls of graph stages as provider batches, one batch per stage invocation.
+
+    The first invocation of a stage writes its requests file, submits it and raises `BatchPending`.
+    Later invocations with the same calls, e.g. when the run is resumed from its checkpoint,
+    poll the batch and return its parsed results once completed. Submitted batches and their
+    downloaded results are kept in `directory`, so no batch is submitted or downloaded twice.
+    """
+
+    def __init__(self, directory: str, backend: Any):
+        """
+        :param directory: Directory of the requests, records and results files.
+        :param backend: The batch backend, e.g. `OpenAIBatchBackend` or `LocalBatchBackend`.
+        """
+        self.directory = directory
+        self.backend = backend
+        os.makedirs(directory, exist_ok=True)
+
+    def supports(self, provider: str) -> bool:
+        """
+        Check whether the backend runs the models of a provider.
+
+        :param provider: The provider name.
+        :return: True if the calls of the provider can be batched.
+        """
+        providers = getattr(self.backend, "providers", None)
+        return providers is None or provider in providers
+
+    def _path(self, key: str, suffix: str) -> str:
+        return os.path.join(self.directory, key + suffix)
+
+    def run(self, stage: str, model: str, sys_message: str, user_contents: List[str], temperature: Optional[float],
+            schema: Optional[Dict], provider: Optional[str] = None) -> List[Any]:
+        """
+        Get the answers of the calls of a stage from their batch, submitting it on first use.
+
+        :param stage: The stage name.
+        :param model: The model name.
+        :param sys_message: The system message shared by every call.
+        :param user_contents: The user message of each call.
+        :param temperature: The sampling temperature.
+        :param schema: The JSON schema of the answers, None to skip validation.
+        :param provider: The provider name the token usage is accounted to.
+        :return: The valid answers, or the exceptions describing unusable ones, in the order of `user_contents`.
+        :raises BatchPending: If the batch has not completed yet.
+        :raises BatchFailed: If the provider failed the batch.
+        """
+        key = batch_key(stage, model, sys_message, user_contents, temperature)
+        results_path = self._path(key, '.results.jsonl')
+        if not os.path.exists(results_path):
+            self._poll(key, stage, model, sys_message, user_contents, temperature, schema, results_path, provider)
+        by_id = {record["custom_id"]: record for record in read_jsonl(results_path)}
+        return [parse_result(by_id.get(str(i)), schema, stage) for i in range(len(user_contents))]
+
+    def _poll(self, key: str, stage: str, model: str, sys_message: str, user_contents: List[str],
+              temperature: Optional[float], schema: Optional[Dict], results_path: str, provider: Optional[str]) -> None:
+        record_path = self._path(key, '.json')
+        if not os.path.exists(record_path):
+            requests_path = self._path(key, '.requests.jsonl')
+            write_jsonl(requests_path, build_requests(model, sys_message, user_contents, temperature, schema))
+            batch_id = self.backend.submit(requests_path)
+            record = BatchRecord(key=key, stage=stage, model=model, batch_id=batch_id, status="submitted",
+                                 size=len(user_contents))
+            atomic_write_json(record_path, record)
+            logger.info(f"{stage}: submitted batch {batch_id} of {len(user_contents)} requests")
+            raise BatchPending(stage, batch_id, record["status"])
+
+        with open(record_path, 'r', encoding='utf-8') as fh:
+            record = BatchRecord(json.load(fh))
+        status = self.backend.status(record["batch_id"])
+        if status in FAILED_STATES:
+            os.remove(record_path)
+            raise BatchFailed(f"{stage}: batch {record['batch_id']} {status}, it is submitted again on resume")
+        if status != COMPLETED:
+            if status != record["status"]:
+                record["status"] = status
+                atomic_write_json(record_path, record)
+            raise BatchPending(stage, record["batch_id"], status)
+
+        records = self.backend.results(record["batch_id"])
+        write_jsonl(results_path, records)
+        record["status"] = status
+        atomic_write_json(record_path, record)
+        input_tokens, output_tokens = usage(records)
+        if provider:
+            llm_router.get_router().stats.record(provider, model, 0.0, input_tokens, output_tokens,
+                                                 price_factor=float(os.getenv("LLM_BATCH_PRICE_FACTOR",
+                                                                              config.LLM_BATCH_PRICE_FACTOR)))
+        logger.info(f"{stage}: batch {record['batch_id']} completed with {len(records)} results")
+
+
+_runner = None
+_lock = threading.Lock()
+
+
+def get_runner() -> BatchRunner:
+    """
+    Get the shared batch runner, using the OpenAI Batch API and the LLM_BATCH_DIR directory.
+
+    :return: The runner.
+    """
+    global _runner
+    with _lock:
+        if _runner is None:
+            _runner = BatchRunner(os.getenv("LLM_BATCH_DIR", config.LLM_BATCH_DIR), OpenAIBatchBackend())
+        return _runner
+
+
+def set_runner(runner: Optional[BatchRunner]) -> None:
+    """
+    Replace the shared batch runner, e.g. by one using `LocalBatchBackend`. None recreates it on next use.
+
+    :param runner: The runner to use.
+    """
+    global _runner
+    with _lock:
+        _runner = runner
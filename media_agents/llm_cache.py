@@ -0,0 +1,167 @@
+"""Persistent content-addressed cache of LLM results
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import logging
+from typing import Any, Dict, Optional
+
+import media_agents.config as config
+
+# Initialize logger
+logger = logging.getLogger(__name__)
+
+
+def sha256(text: str) -> str:
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def make_key(model: str, sys_message: str, user_content: str, temperature: Optional[float]) -> str:
+    """
+    Build the cache key of an LLM call.
+
+    :param model: The model name.
+    :param sys_message: The system message.
+    :param user_content: The user message.
+    :param temperature: The sampling temperature.
+    :return: The hex digest identifying the call.
+    """
+    return sha256(json.dumps([model, sha256(sys_message), sha256(user_content), temperature]))
+
+
+class LLMCache:
+    """
+    SQLite-backed cache of parsed LLM outputs, keyed by `make_key`.
+
+    The cache keeps at most `max_entries` entries, evicting the least recently used ones,
+    and drops entries older than `ttl` seconds.
+    """
+
+    # Number of writes between two evictions
+    EVICT_EVERY = 100
+
+    def __init__(self, path: str, max_entries: int, ttl: float = 0):
+        """
+        :param path: Path of the SQLite database file.
+        :param max_entries: Maximum number of cached results.
+        :param ttl: Maximum age of a cached result in seconds, 0 for no limit.
+        """
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._writes = 0
+        self._lock = threading.Lock()
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS llm_results ("
+                           "key TEXT PRIMARY KEY, value TEXT NOT NULL, created_at REAL NOT NULL, used_at REAL NOT NULL)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS llm_results_used_at ON llm_results (used_at)")
+        self._conn.commit()
+
+    def get(self, key: str) -> Optional[Any]:
+        """
+        Get a cached result.
+
+        :param key: The cache key.
+        :return: The cached result, or None on a miss.
+        """
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT value, created_at FROM llm_results WHERE key = ?", (key,)).fetchone()
+            if row is None or (self.ttl and now - row[1] > self.ttl):
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE llm_results SET used_at = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, key: str, value: Any) -> None:
+        """
+        Store a result.
+
+        :param key: The cache key.
+        :param value: The JSON serializable result.
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO llm_results (key, value, created_at, used_at) VALUES (?, ?, ?, ?)",
+                               (key, json.dumps(value), now, now))
+            self._writes += 1
+            if self._writes % self.EVICT_EVERY == 0:
+                self._evict(now)
+            self._conn.commit()
+
+    def evict(self) -> None:
+        """
+        Drop expired entries and the least recently used entries over `max_entries`.
+        """
+        with self._lock:
+            self._evict(time.time())
+            self._conn.commit()
+
+    def _evict(self, now: float) -> None:
+        if self.ttl:
+            self._conn.execute("DELETE FROM llm_results WHERE created_at < ?", (now - self.ttl,))
+        self._conn.execute("DELETE FROM llm_results WHERE key NOT IN "
+                           "(SELECT key FROM llm_results ORDER BY used_at DESC LIMIT ?)", (self.max_entries,))
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM llm_results").fetchone()[0]
+
+    def stats(self) -> Dict:
+        """
+        Get the cache counters.
+
+        :return: A dictionary with the number of hits and misses.
+        """
+        return {"hits": self.hits, "misses": self.misses}
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+_cache = None
+_lock = threading.Lock()
+
+
+def get_cache() -> Optional[LLMCache]:
+    """
+    Get the shared LLM result cache, created from the LLM_CACHE_PATH, LLM_CACHE_MAX_ENTRIES
+    and LLM_CACHE_TTL settings.
+
+    :return: The cache, or None if LLM_CACHE_BYPASS is set or LLM_CACHE_PATH is empty.
+    """
+    global _cache
+    if os.getenv("LLM_CACHE_BYPASS", "0").lower() in ("1", "true", "yes"):
+        return None
+    with _lock:
+        if _cache is None:
+            path = os.getenv("LLM_CACHE_PATH", config.LLM_CACHE_PATH)
+            if not path:
+                return None
+            _cache = LLMCache(path,
+                              int(os.getenv("LLM_CACHE_MAX_ENTRIES", config.LLM_CACHE_MAX_ENTRIES)),
+                              float(os.getenv("LLM_CACHE_TTL", config.LLM_CACHE_TTL)))
+            logger.info(f"llm cache: {path}")
+        return _cache
+
+
+def set_cache(cache: Optional[LLMCache]) -> None:
+    """
+    Replace the shared LLM result cache. None recreates it from the settings on next use.
+
+    :param cache: The cache to use.
+    """
+    global _cache
+    with _lock:
+        _cache = cache
@@ -0,0 +1,106 @@
+"""Bounded concurrent execution of LLM calls
+"""
+import os
+import threading
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from typing import Any, List, Optional
+
+import media_agents.config as config
+from media_agents.metrics import metrics
+
+# Initialize logger
+logger = logging.getLogger(__name__)
+
+_provider_semaphores = {}
+_lock = threading.Lock()
+# Model answering the call in progress on the current thread, see `record_answering_model`
+_call = threading.local()
+
+
+def provider_name(client: Any) -> str:
+    """
+    Get the provider name of a LangChain chat model, e.g. "openai" for ChatOpenAI.
+
+    :param client: The chat model.
+    :return: The lower case provider name.
+    """
+    name = type(client).__name__
+    if name.startswith('Chat'):
+        name = name[len('Chat'):]
+    return name.lower()
+
+
+def get_provider_limit(provider: str) -> int:
+    """
+    Get the maximum number of in-flight LLM calls for a provider.
+
+    LLM_MAX_CONCURRENCY_<PROVIDER> (e.g. LLM_MAX_CONCURRENCY_OPENAI) takes precedence over LLM_MAX_CONCURRENCY.
+
+    :param provider: The provider name.
+    :return: The concurrency limit.
+    """
+    limit = os.getenv(f"LLM_MAX_CONCURRENCY_{provider.upper()}", os.getenv("LLM_MAX_CONCURRENCY", config.LLM_MAX_CONCURRENCY))
+    return max(1, int(limit))
+
+
+def get_provider_semaphore(provider: str) -> threading.BoundedSemaphore:
+    """
+    Get the semaphore shared by every call to a provider, whichever node issues it.
+
+    :param provider: The provider name.
+    :return: The provider semaphore.
+    """
+    with _lock:
+        if provider not in _provider_semaphores:
+            _provider_semaphores[provider] = threading.BoundedSemaphore(get_provider_limit(provider))
+        return _provider_semaphores[provider]
+
+
+def record_answering_model(model: str) -> None:
+    """
+    Record the model answering the call in progress on the current thread, e.g. the fallback model of a route,
+    to be reported by `invoke_all`.
+
+    :param model: The model name.
+    """
+    _call.model = model
+
+
+def invoke_all(pipeline: Any, inputs: List[Any], provider: str, limit: bool = True,
+               models: Optional[List[Optional[str]]] = None) -> List[Any]:
+    """
+    Invoke a runnable on several inputs concurrently, within the provider in-flight limit.
+
+    Failures are isolated per input: the exception raised by an input is returned in its place.
+
+    :param pipeline: The runnable to invoke.
+    :param inputs: The runnable inputs.
+    :param provider: The provider name the calls are accounted to.
+    :param limit: Whether each call holds a slot of the provider limit, False for runnables holding
+        the slots of the providers they call themselves, e.g. `llm_router.Route`.
+    :param models: List filled with the model recorded by `record_answering_model` for each input, None if none was.
+    :return: The outputs or raised exceptions, in the same order as `inputs`.
+    """
+    semaphore = get_provider_semaphore(provider) if limit else nullcontext()
+
+    def invoke(input):
+        _call.model = None
+        with semaphore:
+            try:
+                with metrics.timer("llm_call_seconds", provider=provider):
+                    output = pipeline.invoke(input)
+            except Exception as ex:
+                output = ex
+        return output, _call.model
+
+    max_workers = min(get_provider_limit(provider), len(inputs))
+    if max_workers <= 1:
+        results = [invoke(input) for input in inputs]
+    else:
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f'llm-{provider}') as executor:
+            results = list(executor.map(invoke, inputs))
+    if models is not None:
+        models[:] = [model for _, model in results]
+    return [output for output, _ in results]
@@ -0,0 +1,287 @@
+"""Per-stage LLM model selection with provider fallback and per-provider latency and cost tracking
+"""
+import os
+import threading
+import time
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+
+from langchain_core.runnables import Runnable
+
+import media_agents.config as config
+from media_agents import llm_executor
+from media_agents.metrics import metrics
+
+# Initialize logger
+logger = logging.getLogger(__name__)
+
+# Graph stages, each can be routed to its own model with LLM_CLIENT_<STAGE>
+STAGES = ["newsworthiness", "keypoints", "draft", "assessment", "rewrite", "headline", "chunk_summary"]
+
+# Exception class names of rate limits, timeouts and transient server errors, across provider SDKs
+RETRYABLE_ERRORS = {"RateLimitError", "APITimeoutError", "APIConnectionError", "InternalServerError",
+                    "ServiceUnavailableError", "Timeout", "ReadTimeout", "ConnectTimeout", "TimeoutError"}
+RETRYABLE_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+
+def parse_model(model: str) -> Tuple[str, str]:
+    """
+    Get the provider and model name of a model setting.
+
+    The provider is either given as a prefix, e.g. `groq:llama3-8b-8192`, or guessed from the
+    model name: Llama models run on Fireworks, anything else on OpenAI.
+
+    :param model: The model setting.
+    :return: A tuple of the provider name and the model name.
+    """
+    provider, sep, name = model.partition(':')
+    if sep and provider in ('openai', 'groq', 'fireworks'):
+        return provider, name
+    if 'llama' in model:
+        return 'fireworks', model
+    return 'openai', model
+
+
+def create_model(model: str, temperature: float = 0.7) -> Any:
+    """
+    Create a chat model, importing only the SDK of its provider.
+
+    :param model: The model setting, see `parse_model`.
+    :param temperature: The sampling temperature.
+    :return: The LangChain chat model.
+    """
+    provider, name = parse_model(model)
+    timeout = float(os.getenv("LLM_TIMEOUT", config.LLM_TIMEOUT))
+    if provider == 'fireworks':
+        from langchain_fireworks import ChatFireworks
+        client = ChatFireworks(model=name, temperature=temperature, timeout=timeout)
+    elif provider == 'groq':
+        from langchain_groq import ChatGroq
+        client = ChatGroq(model=name, temperature=temperature, timeout=timeout)
+    else:
+        from langchain_openai import ChatOpenAI
+        client = ChatOpenAI(model=name, temperature=temperature, timeout=timeout)
+    logger.info(f"init {type(client).__name__}:{name}")
+    return client
+
+
+def is_retryable(ex: Exception) -> bool:
+    """
+    Check whether a failed call should be retried on the next provider.
+
+    :param ex: The exception raised by the call.
+    :return: True for rate limits, timeouts and transient server errors.
+    """
+    if isinstance(ex, TimeoutError) or type(ex).__name__ in RETRYABLE_ERRORS:
+        return True
+    return getattr(ex, 'status_code', None) in RETRYABLE_STATUS_CODES
+
+
+def token_usage(message: Any) -> Tuple[int, int]:
+    """
+    Get the token usage reported with a chat model answer.
+
+    :param message: The AI message, or the structured output including it as `raw`.
+    :return: A tuple of the number of input and output tokens, zeros if not reported.
+    """
+    if isinstance(message, dict):
+        message = message.get('raw')
+    usage = getattr(message, 'usage_metadata', None)
+    if usage:
+        return usage.get('input_tokens', 0), usage.get('output_tokens', 0)
+    usage = (getattr(message, 'response_metadata', None) or {}).get('token_usage') or {}
+    return usage.get('prompt_tokens', 0), usage.get('completion_tokens', 0)
+
+
+class ProviderStats:
+    """
+    Thread-safe call counters of the models of each provider.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats: Dict[str, Dict] = {}
+
+    def record(self, provider: str, model: str, latency: float, input_tokens: int = 0, output_tokens: int = 0,
+               failed: bool = False, fallback: bool = False, price_factor: float = 1.0) -> None:
+        """
+        Record a call.
+
+        :param provider: The provider name.
+        :param model: The model name.
+        :param latency: The call duration in seconds.
+        :param input_tokens: The number of input tokens.
+        :param output_tokens: The number of output tokens.
+        :param failed: Whether the call failed.
+        :param fallback: Whether the call was a fallback after another provider failed.
+        :param price_factor: Factor applied to the model prices, e.g. the batch API discount.
+        """
+        price_in, price_out = config.LLM_PRICES.get(model, (0.0, 0.0))
+        cost = (input_tokens * price_in + output_tokens * price_out) * price_factor / 1e6
+        metrics.inc("llm_requests_total", provider=provider, model=model,
+                    outcome="failed" if failed else "fallback" if fallback else "ok")
+        metrics.inc("llm_tokens_total", input_tokens, provider=provider, model=model, direction="input")
+        metrics.inc("llm_tokens_total", output_tokens, provider=provider, model=model, direction="output")
+        metrics.inc("llm_cost_usd_total", cost, provider=provider, model=model)
+        with self._lock:
+            stats = self._stats.setdefault(provider, {"calls": 0, "failures": 0, "fallbacks": 0,
+                                                      "latency_total": 0.0, "latency_max": 0.0,
+                                                      "input_tokens": 0, "output_tokens": 0, "cost": 0.0})
+            stats["calls"] += 1
+            stats["failures"] += int(failed)
+            stats["fallbacks"] += int(fallback)
+            stats["latency_total"] += latency
+            stats["latency_max"] = max(stats["latency_max"], latency)
+            stats["input_tokens"] += input_tokens
+            stats["output_tokens"] += output_tokens
+            stats["cost"] += cost
+
+    def snapshot(self) -> Dict[str, Dict]:
+        """
+        Get the counters of every provider.
+
+        :return: A dictionary mapping provider names to their calls, failures, fallbacks, mean and max
+            latency in seconds, tokens and estimated cost in USD.
+        """
+        with self._lock:
+            return {provider: dict(stats, latency_mean=stats["latency_total"] / stats["calls"])
+                    for provider, stats in self._stats.items()}
+
+
+class Route(Runnable):
+    """
+    Chat model of a stage, failing over to the next model on rate limits and timeouts.
+
+    Every attempt holds a slot of the in-flight limit of its own provider, and the model answering
+    is recorded with `llm_executor.record_answering_model`.
+    """
+
+    # Calls hold the provider slots themselves, see `llm_executor.invoke_all`
+    limits_concurrency = True
+
+    def __init__(self, stage: str, models: List[Tuple[str, str, Any]], stats: ProviderStats):
+        """
+        :param stage: The stage name.
+        :param models: The (provider, model name, chat model) candidates, primary first.
+        :param stats: The counters updated by every call.
+        """
+        self.stage = stage
+        self.models = models
+        self.stats = stats
+        self.provider, self.model_name, primary = models[0]
+        self.temperature = getattr(primary, 'temperature', None)
+
+    def with_structured_output(self, schema: Dict, **kwargs: Any) -> 'Route':
+        """
+        Get the route answering in the provider structured output mode.
+
+        :param schema: The output schema.
+        :return: A route of the same models in structured output mode.
+        """
+        route = Route(self.stage, [(provider, name, model.with_structured_output(schema, **kwargs))
+                                   for provider, name, model in self.models], self.stats)
+        route.temperature = self.temperature
+        return route
+
+    def invoke(self, input: Any, config: Optional[Any] = None, **kwargs: Any) -> Any:
+        for i, (provider, name, model) in enumerate(self.models):
+            start = time.perf_counter()
+            try:
+                with llm_executor.get_provider_semaphore(provider):
+                    message = model.invoke(input, config, **kwargs)
+            except Exception as ex:
+                self.stats.record(provider, name, time.perf_counter() - start, failed=True, fallback=i > 0)
+                if i + 1 < len(self.models) and is_retryable(ex):
+                    logger.warning(f"{self.stage}: {provider}:{name} failed ({type(ex).__name__}), "
+                                   f"falling back to {self.models[i + 1][0]}:{self.models[i + 1][1]}")
+                    continue
+                raise
+            self.stats.record(provider, name, time.perf_counter() - start, *token_usage(message), fallback=i > 0)
+            llm_executor.record_answering_model(name)
+            return message
+
+
+class LLMRouter:
+    """
+    Assigns a model, and fallback models, to every graph stage.
+
+    The model of a stage is LLM_CLIENT_<STAGE> (e.g. LLM_CLIENT_NEWSWORTHINESS), or LLM_CLIENT;
+    its fallbacks are the comma separated LLM_FALLBACK_<STAGE>, or LLM_FALLBACK.
+    Chat models are shared by the stages using the same model.
+    """
+
+    def __init__(self):
+        self.stats = ProviderStats()
+        self._models: Dict[str, Any] = {}
+        self._routes: Dict[str, Route] = {}
+        self._lock = threading.Lock()
+
+    def models_for_stage(self, stage: Optional[str]) -> List[str]:
+        """
+        Get the model settings of a stage.
+
+        :param stage: The stage name, None for the default model.
+        :return: The primary model followed by the fallback models.
+        """
+        suffix = f"_{stage.upper()}" if stage else ""
+        primary = os.getenv(f"LLM_CLIENT{suffix}") or os.getenv("LLM_CLIENT", config.LLM_CLIENT)
+        fallbacks = os.getenv(f"LLM_FALLBACK{suffix}") or os.getenv("LLM_FALLBACK", "")
+        return [primary] + [m.strip() for m in fallbacks.split(',') if m.strip() and m.strip() != primary]
+
+    def _model(self, model: str) -> Tuple[str, str, Any]:
+        if model not in self._models:
+            self._models[model] = create_model(model)
+        provider, name = parse_model(model)
+        return provider, name, self._models[model]
+
+    def route(self, stage: Optional[str] = None) -> Route:
+        """
+        Get the route of a stage.
+
+        :param stage: The stage name, None for the default model.
+        :return: The route.
+        """
+        with self._lock:
+            if stage not in self._routes:
+                self._routes[stage] = Route(stage or "default",
+                                            [self._model(m) for m in self.models_for_stage(stage)], self.stats)
+            return self._routes[stage]
+
+
+_router = None
+_lock = threading.Lock()
+
+
+def get_router() -> LLMRouter:
+    """
+    Get the shared LLM router, created on first use.
+
+    :return: The router.
+    """
+    global _router
+    with _lock:
+        if _router is None:
+            _router = LLMRouter()
+        return _router
+
+
+def get_stats() -> Dict[str, Dict]:
+    """
+    Get the counters of every provider used so far.
+
+    :return: The counters by provider, see `ProviderStats.snapshot`, empty if no model was used.
+    """
+    return _router.stats.snapshot() if _router is not None else {}
+
+
+def log_stats() -> None:
+    """
+    Log the latency and cost counters of every provider used so far.
+    """
+    if _router is None:
+        return
+    for provider, stats in _router.stats.snapshot().items():
+        logger.info(f"llm {provider}: {stats['calls']} calls, {stats['failures']} failures, "
+                    f"{stats['fallbacks']} fallbacks, latency mean {stats['latency_mean']:.2f}s "
+                    f"max {stats['latency_max']:.2f}s, tokens {stats['input_tokens']} in "
+                    f"{stats['output_tokens']} out, cost ${stats['cost']:.4f}")
@@ -0,0 +1,246 @@
+"""Run metrics: per-node wall time, call latency histograms, token usage and cache hits
+"""
+import functools
+import os
+import threading
+import time
+import logging
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from media_agents.file_utils import atomic_write_json
+
+# Initialize logger
+logger = logging.getLogger(__name__)
+
+# Upper bounds in seconds of the latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+
+def series_name(name: str, labels: Dict[str, Any]) -> str:
+    """
+    Get the Prometheus series name of a metric, e.g. `node_seconds{node="fetch_update"}`.
+
+    :param name: The metric name.
+    :param labels: The metric labels.
+    :return: The series name.
+    """
+    if not labels:
+        return name
+    return name + "{" + ",".join(f'{key}="{value}"' for key, value in sorted(labels.items())) + "}"
+
+
+class Histogram:
+    """
+    Cumulative latency histogram with fixed buckets.
+    """
+
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float) -> None:
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q: float) -> float:
+        """
+        Estimate a quantile as the upper bound of the bucket it falls in.
+
+        :param q: The quantile, between 0 and 1.
+        :return: The estimated value, capped by the max observed value.
+        """
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def summary(self) -> Dict:
+        return {"count": self.count, "sum": self.sum, "mean": self.sum / self.count if self.count else 0.0,
+                "max": self.max, "p50": self.quantile(0.5), "p95": self.quantile(0.95)}
+
+
+class Metrics:
+    """
+    Thread-safe registry of counters and histograms, keyed by metric name and labels.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[Tuple[str, Tuple], float] = {}
+        self._histograms: Dict[Tuple[str, Tuple], Histogram] = {}
+
+    def inc(self, name: str, value: float = 1, **labels: Any) -> None:
+        """
+        Increment a counter.
+
+        :param name: The metric name.
+        :param value: The increment.
+        :param labels: The metric labels.
+        """
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels: Any) -> None:
+        """
+        Record a value, e.g. a latency in seconds, in a histogram.
+
+        :param name: The metric name.
+        :param value: The observed value.
+        :param labels: The metric labels.
+        """
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(value)
+
+    @contextmanager
+    def timer(self, name: str, **labels: Any):
+        """
+        Record the duration of a block in a histogram, with an `outcome` label of "ok" or the exception name.
+
+        :param name: The metric name.
+        :param labels: The metric labels.
+        """
+        start = time.perf_counter()
+        outcome = "ok"
+        try:
+            yield
+        except BaseException as ex:
+            outcome = type(ex).__name__
+            raise
+        finally:
+            self.observe(name, time.perf_counter() - start, outcome=outcome, **labels)
+
+    def snapshot(self) -> Dict:
+        """
+        Get the current value of every metric.
+
+        :return: A dictionary with the `counters` and `histograms` summaries, by series name.
+        """
+        with self._lock:
+            return {"counters": {series_name(name, dict(labels)): value
+                                 for (name, labels), value in sorted(self._counters.items())},
+                    "histograms": {series_name(name, dict(labels)): histogram.summary()
+                                   for (name, labels), histogram in sorted(self._histograms.items())}}
+
+    def to_prometheus(self) -> str:
+        """
+        Render every metric in the Prometheus text exposition format.
+
+        :return: The metrics text.
+        """
+        lines = []
+        with self._lock:
+            for (name, labels), value in sorted(self._counters.items()):
+                lines.append(f"{series_name(name, dict(labels))} {value}")
+            for (name, labels), histogram in sorted(self._histograms.items()):
+                labels = dict(labels)
+                cumulative = 0
+                for bound, count in zip(histogram.buckets + (float("inf"),), histogram.counts):
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    lines.append(f"{series_name(name + '_bucket', dict(labels, le=le))} {cumulative}")
+                lines.append(f"{series_name(name + '_sum', labels)} {histogram.sum}")
+                lines.append(f"{series_name(name + '_count', labels)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def reset(self) -> None:
+        """
+        Drop every metric.
+        """
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+
+metrics = Metrics()
+
+
+def timed_node(name: str, node: Callable[[Dict], Dict]) -> Callable[[Dict], Dict]:
+    """
+    Wrap a graph node so its wall time is recorded as `node_seconds{node=...}`.
+
+    :param name: The node name.
+    :param node: The node function.
+    :return: The wrapped node function.
+    """
+    @functools.wraps(node)
+    def timed(state: Dict) -> Dict:
+        with metrics.timer("node_seconds", node=name):
+            return node(state)
+    return timed
+
+
+def write_summary(path: str, run_id: str, extra: Optional[Dict] = None) -> Dict:
+    """
+    Write the metrics of a run as a JSON summary.
+
+    :param path: The summary file path.
+    :param run_id: The run id.
+    :param extra: Other values to include, e.g. the per-provider LLM stats.
+    :return: The summary.
+    """
+    summary = dict(run_id=run_id, **metrics.snapshot(), **(extra or {}))
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    atomic_write_json(path, summary)
+    logger.info(f"run summary written to {path}")
+    return summary
+
+
+def log_summary() -> None:
+    """
+    Log the wall time of every node, slowest first.
+    """
+    histograms = metrics.snapshot()["histograms"]
+    nodes = [(series, h) for series, h in histograms.items() if series.startswith("node_seconds")]
+    for series, h in sorted(nodes, key=lambda item: -item[1]["sum"]):
+        logger.info(f"{series}: {h['sum']:.2f}s over {h['count']} runs")
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = metrics.to_prometheus().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+
+def start_http_server(port: int, host: str = "") -> ThreadingHTTPServer:
+    """
+    Serve the metrics in the Prometheus text format on `/metrics` from a daemon thread.
+
+    :param port: The port, 0 picks a free port.
+    :param host: The interface to listen on, all interfaces by default.
+    :return: The running server.
+    """
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name='metrics-http', daemon=True).start()
+    logger.info(f"serving metrics on port {server.server_address[1]}")
+    return server
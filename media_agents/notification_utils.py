@@ -1,27 +1,138 @@
 import smtplib
 import os
-import dotenv
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
+from typing import Dict, List
+from typing_extensions import TypedDict
 import logging
-import logging_init
+
+import media_agents.config as config
+from media_agents.metrics import metrics
 
 # Initialize logger
 logger = logging.getLogger(__name__)
 
-# Load env vars
-dotenv.load_dotenv()
+# Default SMTP port of each connection security
+DEFAULT_SMTP_PORTS = {"ssl": 465, "starttls": 587, "plain": 25}
+
+
+def get_smtp_settings() -> Dict:
+    """
+    Read the SMTP settings from the environment, at send time rather than import time.
+
+    :return: A dictionary with the SMTP `host`, `port`, `user`, `password` and `security`.
+    """
+    security = os.getenv('SMTP_SECURITY', config.SMTP_SECURITY).lower()
+    return {"host": os.getenv('SMTP_SERVER', 'localhost'),
+            "port": int(os.getenv('SMTP_PORT_SSL', DEFAULT_SMTP_PORTS.get(security, 465))),
+            "user": os.getenv('SMTP_USER', ''),
+            "password": os.getenv('SMTP_PASSWORD', ''),
+            "security": security}
+
+
+class DeliveryReport(TypedDict):
+    """
+    Per-recipient outcome of a newsletter delivery.
+
+    Attributes:
+        sent (List[str]): Recipients the message was delivered to.
+        failed (Dict[str, str]): Recipients the message was not delivered to, with the error.
+    """
+    sent: List[str]
+    failed: Dict[str, str]
+
+
+class SMTPSession:
+    """
+    Authenticated SMTP session, opened on first use and reopened once the server drops it.
+    """
+
+    def __init__(self, host: str, port: int, user: str, password: str, security: str = "ssl", timeout: float = 60):
+        """
+        :param host: The SMTP server host.
+        :param port: The SMTP server port.
+        :param user: The SMTP user, also used as sender address.
+        :param password: The SMTP password.
+        :param security: "ssl", "starttls" or "plain".
+        :param timeout: Socket timeout in seconds.
+        """
+        self.host = host
+        self.port = port
+        self.user = user
+        self.password = password
+        self.security = security
+        self.timeout = timeout
+        self.connections = 0
+        self._server = None
+
+    def connect(self) -> smtplib.SMTP:
+        """
+        Open and authenticate the SMTP connection.
+
+        :return: The connected SMTP client.
+        """
+        self.close()
+        self.connections += 1
+        if self.security == "ssl":
+            server = smtplib.SMTP_SSL(self.host, self.port, timeout=self.timeout)
+        else:
+            server = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+            if self.security == "starttls":
+                server.starttls()
+        if self.password:
+            server.login(self.user, self.password)
+        self._server = server
+        return server
+
+    def sendmail(self, recipient: str, payload: bytes) -> None:
+        """
+        Send a serialized message to one recipient, reconnecting if the connection was lost.
 
-# Init smtp params
-smtp_host = str(os.getenv('SMTP_SERVER'))
-smtp_port = int(os.getenv('SMTP_PORT_SSL'))
-smtp_user = str(os.getenv('SMTP_USER'))
-smtp_password = str(os.getenv('SMTP_PASSWORD'))
-def send_email(subject, html_body, txt_body, recipients):
+        :param recipient: The recipient address.
+        :param payload: The serialized MIME message.
+        """
+        server = self._server or self.connect()
+        try:
+            server.sendmail(self.user, recipient, payload)
+        except (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused, smtplib.SMTPDataError):
+            # the server answered, the session is still usable
+            raise
+        except OSError as ex:
+            logger.warning(f"SMTP connection lost ({ex}), reconnecting")
+            self.connect().sendmail(self.user, recipient, payload)
+
+    def close(self) -> None:
+        if self._server is None:
+            return
+        try:
+            self._server.quit()
+        except (smtplib.SMTPException, OSError):
+            self._server.close()
+        self._server = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def build_message(subject: str, html_body: str, txt_body: str, recipients: List[str], sender: str) -> bytes:
+    """
+    Build and serialize the newsletter MIME message once for all recipients.
 
+    :param subject: The email subject.
+    :param html_body: The HTML body.
+    :param txt_body: The plain text body.
+    :param recipients: The recipient addresses.
+    :param sender: The sender address.
+    :return: The serialized message.
+    """
     msg = MIMEMultipart('alternative')
     msg['Subject'] = subject
-    msg['From'] = smtp_user
+    msg['From'] = sender
     msg['To'] = ', '.join(recipients)
 
     # Record the MIME types of both parts - text/plain and text/html.
@@ -33,13 +144,66 @@ def send_email(subject, html_body, txt_body, recipients):
     # the HTML message, is best and preferred.
     msg.attach(part1)
     msg.attach(part2)
-    for recipient in recipients:
-        try:
-            with smtplib.SMTP_SSL(smtp_host, smtp_port) as smtp_server:
-               smtp_server.login(smtp_user, smtp_password)
-               smtp_server.sendmail(smtp_user, recipient, msg.as_string())
-        except Exception as ex:
-            logger.error('Error: sending email')
-            logger.error(ex)
-        logger.info("Message with subject")
+    return msg.as_bytes()
+
+
+def deliver(payload: bytes, recipients: List[str], report: DeliveryReport, lock: threading.Lock,
+            rate_limiter=None) -> None:
+    """
+    Deliver a serialized message to recipients over one SMTP session.
+
+    :param payload: The serialized MIME message.
+    :param recipients: The recipient addresses.
+    :param report: The delivery report to update.
+    :param lock: Lock guarding the report.
+    :param rate_limiter: Optional rate limiter shared by all sessions.
+    """
+    max_reconnects = int(os.getenv('SMTP_MAX_RECONNECTS', config.SMTP_MAX_RECONNECTS))
+    settings = get_smtp_settings()
+    with SMTPSession(**settings) as session:
+        for recipient in recipients:
+            if session.connections > max_reconnects + 1:
+                error = "too many SMTP reconnections"
+            else:
+                if rate_limiter is not None:
+                    rate_limiter.wait(settings['host'])
+                try:
+                    with metrics.timer("smtp_send_seconds"):
+                        session.sendmail(recipient, payload)
+                    error = None
+                except Exception as ex:
+                    error = str(ex) or type(ex).__name__
+            metrics.inc("emails_total", outcome="sent" if error is None else "failed")
+            with lock:
+                if error is None:
+                    report["sent"].append(recipient)
+                else:
+                    logger.error(f"Error: sending email to {recipient}: {error}")
+                    report["failed"][recipient] = error
+
+
+def send_email(subject, html_body, txt_body, recipients, pool_size=None, rate_limiter=None) -> DeliveryReport:
+    """
+    Send the newsletter to every recipient, reusing authenticated SMTP sessions.
 
+    :param subject: The email subject.
+    :param html_body: The HTML body.
+    :param txt_body: The plain text body.
+    :param recipients: The recipient addresses.
+    :param pool_size: Number of parallel SMTP sessions, defaults to the SMTP_POOL_SIZE setting.
+    :param rate_limiter: Optional limiter spacing the emails sent, e.g. `http_client.RateLimiter`.
+    :return: The delivery report.
+    """
+    payload = build_message(subject, html_body, txt_body, recipients, get_smtp_settings()['user'])
+    report = DeliveryReport(sent=[], failed={})
+    lock = threading.Lock()
+    pool_size = max(1, min(pool_size or int(os.getenv('SMTP_POOL_SIZE', config.SMTP_POOL_SIZE)), len(recipients)))
+    batches = [recipients[i::pool_size] for i in range(pool_size)]
+    if pool_size == 1:
+        deliver(payload, recipients, report, lock, rate_limiter)
+    else:
+        with ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix='smtp') as executor:
+            for future in [executor.submit(deliver, payload, batch, report, lock, rate_limiter) for batch in batches]:
+                future.result()
+    logger.info(f"Message with subject '{subject}' sent to {len(report['sent'])} of {len(recipients)} recipients")
+    return report
@@ -0,0 +1,288 @@
+"""Durable on-disk queue of outbound newsletters and the worker delivering them
+"""
+import argparse
+import json
+import os
+import time
+import uuid
+import logging
+import dotenv
+from typing import Dict, List, Optional
+from typing_extensions import TypedDict
+
+import media_agents.config as config
+from media_agents import notification_utils
+from media_agents.file_utils import atomic_write_json
+from media_agents.http_client import RateLimiter
+
+# Initialize logger
+logger = logging.getLogger(__name__)
+
+
+class OutboxMessage(TypedDict):
+    """
+    Queued newsletter.
+
+    Attributes:
+        id (str): The message id, also its file name.
+        subject (str): The email subject.
+        html_body (str): The HTML body.
+        txt_body (str): The plain text body.
+        recipients (List[str]): Recipients the newsletter is still to be delivered to.
+        attempts (int): Number of delivery attempts so far.
+        next_attempt_at (float): Unix time of the next delivery attempt.
+        errors (Dict[str, str]): Last delivery error per recipient.
+        created_at (float): Unix time the message was enqueued.
+    """
+    id: str
+    subject: str
+    html_body: str
+    txt_body: str
+    recipients: List[str]
+    attempts: int
+    next_attempt_at: float
+    errors: Dict[str, str]
+    created_at: float
+
+
+class Outbox:
+    """
+    Directory-backed FIFO queue of newsletters.
+
+    Messages are JSON files moving between the `pending`, `processing` and `dead` subdirectories.
+    A message is claimed by renaming it to `processing`, so a crashed worker leaves it there
+    to be recovered once the claim is stale instead of losing it. The worker delivering a message
+    refreshes its claim with `touch` while in flight.
+    """
+
+    def __init__(self, directory: str):
+        """
+        :param directory: Root directory of the queue.
+        """
+        self.directory = directory
+        self.pending_dir = os.path.join(directory, 'pending')
+        self.processing_dir = os.path.join(directory, 'processing')
+        self.dead_dir = os.path.join(directory, 'dead')
+        for path in (self.pending_dir, self.processing_dir, self.dead_dir):
+            os.makedirs(path, exist_ok=True)
+
+    def enqueue(self, subject: str, html_body: str, txt_body: str, recipients: List[str]) -> str:
+        """
+        Add a newsletter to the queue.
+
+        :param subject: The email subject.
+        :param html_body: The HTML body.
+        :param txt_body: The plain text body.
+        :param recipients: The recipient addresses.
+        :return: The message id.
+        """
+        now = time.time()
+        message_id = f"{int(now * 1000):013d}-{uuid.uuid4().hex}"
+        message = OutboxMessage(id=message_id, subject=subject, html_body=html_body, txt_body=txt_body,
+                                recipients=list(recipients), attempts=0, next_attempt_at=now, errors={},
+                                created_at=now)
+        atomic_write_json(os.path.join(self.pending_dir, message_id + '.json'), message)
+        logger.info(f"outbox: enqueued {message_id} for {len(recipients)} recipients")
+        return message_id
+
+    def recover(self, timeout: float, now: Optional[float] = None) -> int:
+        """
+        Move messages left in `processing` by a crashed worker back to `pending`.
+        Messages claimed less than `timeout` seconds ago may still be delivered by a live worker, and are kept.
+
+        :param timeout: The age in seconds of a stale claim.
+        :param now: The current Unix time.
+        :return: The number of recovered messages.
+        """
+        deadline = (time.time() if now is None else now) - timeout
+        recovered = 0
+        for name in os.listdir(self.processing_dir):
+            path = os.path.join(self.processing_dir, name)
+            try:
+                if os.path.getmtime(path) > deadline:
+                    continue
+                os.replace(path, os.path.join(self.pending_dir, name))
+            except FileNotFoundError:
+                # acked, retried or recovered by another worker
+                continue
+            recovered += 1
+        if recovered:
+            logger.warning(f"outbox: recovered {recovered} interrupted messages")
+        return recovered
+
+    def claim(self, now: Optional[float] = None) -> Optional[OutboxMessage]:
+        """
+        Claim the oldest message due for delivery.
+
+        :param now: The current Unix time.
+        :return: The claimed message, or None if no message is due.
+        """
+        now = time.time() if now is None else now
+        for name in sorted(os.listdir(self.pending_dir)):
+            if not name.endswith('.json'):
+                continue
+            path = os.path.join(self.pending_dir, name)
+            try:
+                with open(path, 'r', encoding='utf-8') as fh:
+                    message = OutboxMessage(json.load(fh))
+            except (OSError, ValueError) as ex:
+                logger.warning(f"outbox: skipping unreadable message {path}: {ex}")
+                continue
+            if message['next_attempt_at'] > now:
+                continue
+            processing_path = os.path.join(self.processing_dir, name)
+            try:
+                os.replace(path, processing_path)
+                # the claim time, read by `recover`
+                os.utime(processing_path)
+            except FileNotFoundError:
+                # claimed by another worker
+                continue
+            return message
+        return None
+
+    def touch(self, message: OutboxMessage) -> bool:
+        """
+        Refresh the claim time of a message still being delivered, so `recover` leaves it alone.
+
+        :param message: The claimed message.
+        :return: False if the claim was lost, i.e. the message was recovered by another worker.
+        """
+        try:
+            os.utime(os.path.join(self.processing_dir, message['id'] + '.json'))
+        except FileNotFoundError:
+            return False
+        return True
+
+    def ack(self, message: OutboxMessage) -> None:
+        """
+        Remove a delivered message.
+
+        :param message: The claimed message.
+        """
+        os.remove(os.path.join(self.processing_dir, message['id'] + '.json'))
+
+    def retry(self, message: OutboxMessage, errors: Dict[str, str], max_attempts: int,
+              backoff_base: float, backoff_max: float) -> bool:
+        """
+        Requeue a message for its failed recipients with exponential backoff, or dead-letter it.
+
+        :param message: The claimed message.
+        :param errors: Delivery error per failed recipient.
+        :param max_attempts: Max number of delivery attempts.
+        :param backoff_base: Delay in seconds before the first retry.
+        :param backoff_max: Max delay in seconds between two attempts.
+        :return: True if the message was requeued, False if it was dead-lettered.
+        """
+        message['attempts'] += 1
+        message['recipients'] = [r for r in message['recipients'] if r in errors]
+        message['errors'] = errors
+        processing_path = os.path.join(self.processing_dir, message['id'] + '.json')
+        if message['attempts'] >= max_attempts:
+            atomic_write_json(os.path.join(self.dead_dir, message['id'] + '.json'), message)
+            os.remove(processing_path)
+            logger.error(f"outbox: dead-lettered {message['id']} after {message['attempts']} attempts, "
+                         f"{len(errors)} recipients not delivered")
+            return False
+        delay = min(backoff_max, backoff_base * 2 ** (message['attempts'] - 1))
+        message['next_attempt_at'] = time.time() + delay
+        atomic_write_json(os.path.join(self.pending_dir, message['id'] + '.json'), message)
+        os.remove(processing_path)
+        logger.warning(f"outbox: {message['id']} failed for {len(errors)} recipients, retrying in {delay:.0f}s")
+        return True
+
+    def size(self) -> Dict:
+        """
+        Get the number of messages per state.
+
+        :return: A dictionary with the number of pending, processing and dead messages.
+        """
+        return {"pending": len(os.listdir(self.pending_dir)), "processing": len(os.listdir(self.processing_dir)),
+                "dead": len(os.listdir(self.dead_dir))}
+
+
+def get_outbox() -> Outbox:
+    """
+    Get the outbox configured by the OUTBOX_DIR setting.
+
+    :return: The outbox.
+    """
+    return Outbox(os.getenv('OUTBOX_DIR', config.OUTBOX_DIR))
+
+
+def drain(outbox: Outbox, rate_limiter: Optional[RateLimiter] = None) -> int:
+    """
+    Deliver every message due, requeueing or dead-lettering failed deliveries.
+
+    Recipients are sent to in batches of OUTBOX_BATCH_SIZE, and the message claim is refreshed after
+    each batch, so a long delivery is not recovered by another worker while in flight.
+
+    :param outbox: The outbox.
+    :param rate_limiter: Optional limiter spacing the emails sent.
+    :return: The number of processed messages.
+    """
+    max_attempts = int(os.getenv('OUTBOX_MAX_ATTEMPTS', config.OUTBOX_MAX_ATTEMPTS))
+    backoff_base = float(os.getenv('OUTBOX_BACKOFF_BASE', config.OUTBOX_BACKOFF_BASE))
+    backoff_max = float(os.getenv('OUTBOX_BACKOFF_MAX', config.OUTBOX_BACKOFF_MAX))
+    batch_size = max(1, int(os.getenv('OUTBOX_BATCH_SIZE', config.OUTBOX_BATCH_SIZE)))
+    processed = 0
+    while (message := outbox.claim()) is not None:
+        processed += 1
+        errors = {}
+        claimed = True
+        recipients = message['recipients']
+        for start in range(0, len(recipients), batch_size):
+            batch = recipients[start:start + batch_size]
+            try:
+                report = notification_utils.send_email(message['subject'], message['html_body'], message['txt_body'],
+                                                       batch, rate_limiter=rate_limiter)
+                errors.update(report['failed'])
+            except Exception as ex:
+                errors.update({recipient: str(ex) or type(ex).__name__ for recipient in batch})
+            claimed = outbox.touch(message)
+            if not claimed:
+                break
+        if not claimed:
+            logger.warning(f"outbox: claim of {message['id']} lost to another worker, delivery stopped")
+        elif errors:
+            outbox.retry(message, errors, max_attempts, backoff_base, backoff_max)
+        else:
+            outbox.ack(message)
+            logger.info(f"outbox: delivered {message['id']}")
+    return processed
+
+
+def run_worker(outbox: Outbox, once: bool = False) -> None:
+    """
+    Drain the outbox, polling for new messages until interrupted.
+
+    :param outbox: The outbox.
+    :param once: Stop once no message is due.
+    """
+    rate_limiter = RateLimiter(float(os.getenv('OUTBOX_RATE_LIMIT', config.OUTBOX_RATE_LIMIT)))
+    poll_interval = float(os.getenv('OUTBOX_POLL_INTERVAL', config.OUTBOX_POLL_INTERVAL))
+    claim_timeout = float(os.getenv('OUTBOX_CLAIM_TIMEOUT', config.OUTBOX_CLAIM_TIMEOUT))
+    while True:
+        outbox.recover(claim_timeout)
+        drain(outbox, rate_limiter)
+        if once:
+            return
+        time.sleep(poll_interval)
+
+
+def main(argv=None):  # pragma: no cover
+    """
+    Run the outbox worker: `python -m media_agents.outbox`.
+    """
+    parser = argparse.ArgumentParser(prog=f"{config.NAME}.outbox", description="Deliver queued newsletters.")
+    parser.add_argument("--once", action="store_true", help="exit once no message is due")
+    args = parser.parse_args(argv)
+    dotenv.load_dotenv()
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s : %(module)s : %(funcName)s : %(message)s")
+    outbox = get_outbox()
+    logger.info(f"outbox worker on {outbox.directory}: {outbox.size()}")
+    run_worker(outbox, once=args.once)
+
+
+if __name__ == "__main__":  # pragma: no cover
+    main()
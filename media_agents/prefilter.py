@@ -0,0 +1,169 @@
+"""Cheap, non-LLM pre-filtering of court opinions ahead of newsworthiness assessment
+"""
+import heapq
+import json
+import math
+import os
+import re
+import logging
+from collections import Counter
+from typing import Callable, Dict, Iterable, List, Optional
+
+import media_agents.config as config
+from media_agents.app_resources import get_derived_content
+from media_agents.blob_store import load_text, text_length
+
+# Initialize logger
+logger = logging.getLogger(__name__)
+
+# A scorer returns a score added to the opinion rank, or None to drop the opinion
+Scorer = Callable[[Dict], Optional[float]]
+
+SCORERS: Dict[str, Scorer] = {}
+
+WORD_PATTERN = re.compile(r"[a-z]+")
+
+
+def register_scorer(name: str, scorer: Scorer) -> None:
+    """
+    Register a pre-filter scorer, to be enabled by name in the PREFILTER_SCORERS setting.
+
+    :param name: The scorer name.
+    :param scorer: Function taking an opinion and returning a score, or None to drop the opinion.
+    """
+    SCORERS[name] = scorer
+
+
+def compile_keywords(content: str) -> Dict:
+    """
+    Compile the keyword patterns of a locale.
+
+    :param content: The content of the keywords resource.
+    :return: A dictionary with compiled `required` patterns and weighted `patterns`.
+    """
+    spec = json.loads(content)
+    return {"required": [re.compile(p, re.IGNORECASE) for p in spec["required"]],
+            "patterns": [(re.compile(p, re.IGNORECASE), w) for p, w in spec["patterns"].items()]}
+
+
+def load_keywords() -> Dict:
+    """
+    Get the compiled keyword patterns of the current locale.
+
+    :return: A dictionary with compiled `required` patterns and weighted `patterns`.
+    """
+    return get_derived_content(('prefilter/keywords.json',), compile_keywords)
+
+
+def load_term_weights() -> Dict:
+    """
+    Get the hand-set news lead term weights of the current locale.
+
+    :return: A dictionary with the `bias` and term `weights`.
+    """
+    return get_derived_content(('prefilter/term_weights.json',), json.loads)
+
+
+def length_score(opinion: Dict) -> Optional[float]:
+    """
+    Drop opinions whose text is too short to be a ruling or too long to be worth the LLM budget.
+    """
+    length = text_length(opinion)
+    min_chars = int(os.getenv("PREFILTER_MIN_CHARS", config.PREFILTER_MIN_CHARS))
+    max_chars = int(os.getenv("PREFILTER_MAX_CHARS", config.PREFILTER_MAX_CHARS))
+    if length < min_chars or (max_chars and length > max_chars):
+        return None
+    return 0.0
+
+
+def keyword_score(opinion: Dict) -> Optional[float]:
+    """
+    Drop opinions matching no required pattern and add the weight of every matched keyword pattern.
+    """
+    keywords = load_keywords()
+    text = load_text(opinion)
+    if not any(p.search(text) for p in keywords["required"]):
+        return None
+    return sum(w for p, w in keywords["patterns"] if p.search(text))
+
+
+def metadata_score(opinion: Dict) -> Optional[float]:
+    """
+    Score the CourtListener record metadata: opinion type, per curiam, citations and source court.
+    """
+    score = 0.0
+    opinion_type = opinion.get("type") or ""
+    # lead and combined opinions carry the holding, concurrences and dissents rarely make the news alone
+    if opinion_type.startswith(("010", "020")):
+        score += 1.0
+    elif opinion_type.startswith(("030", "040", "050", "060", "070")):
+        score -= 1.0
+    if opinion.get("per_curiam"):
+        score += 0.5
+    score += math.log1p(len(opinion.get("opinions_cited") or [])) / 2
+    if "supremecourt.gov" in (opinion.get("download_url") or ""):
+        score += 2.0
+    return score
+
+
+def term_score(opinion: Dict) -> Optional[float]:
+    """
+    Score the news lead terms of the text with hand-set weights, a heuristic rather than a trained
+    classifier, through a logistic function scaled to 0..5.
+    """
+    term_weights = load_term_weights()
+    weights = term_weights["weights"]
+    counts = Counter(w for w in WORD_PATTERN.findall(load_text(opinion).lower()) if w in weights)
+    logit = term_weights["bias"] + sum(weights[w] * math.log1p(n) for w, n in counts.items())
+    return 5.0 / (1.0 + math.exp(-logit))
+
+
+register_scorer("length", length_score)
+register_scorer("keywords", keyword_score)
+register_scorer("metadata", metadata_score)
+register_scorer("terms", term_score)
+
+
+def score_opinion(opinion: Dict, scorers: List[str]) -> Optional[float]:
+    """
+    Compute the pre-filter score of an opinion.
+
+    :param opinion: The CourtListener opinion record.
+    :param scorers: Names of the scorers to apply, cheapest first.
+    :return: The sum of the scores, or None if a scorer dropped the opinion.
+    """
+    total = 0.0
+    for name in scorers:
+        score = SCORERS[name](opinion)
+        if score is None:
+            return None
+        total += score
+    return total
+
+
+def prefilter(opinions: Iterable[Dict], scorers: List[str], top_k: int, min_score: Optional[float] = None) -> List[Dict]:
+    """
+    Rank opinions with the given scorers and keep the best ones.
+
+    Opinions are consumed one at a time and at most `top_k` of them are held, so they can be
+    streamed, e.g. from an `OpinionSpool`.
+
+    :param opinions: The CourtListener opinion records.
+    :param scorers: Names of the scorers to apply.
+    :param top_k: Maximum number of opinions kept, 0 for no limit.
+    :param min_score: Minimum score of a kept opinion, None keeps every opinion not dropped by a scorer.
+    :return: The kept opinions, in their original order.
+    """
+    # min-heap of (score, -index, opinion): the worst kept opinion, lowest score then latest, is on top
+    kept = []
+    for index, opinion in enumerate(opinions):
+        score = score_opinion(opinion, scorers)
+        if score is None or (min_score is not None and score < min_score):
+            continue
+        heapq.heappush(kept, (score, -index, opinion))
+        if top_k and len(kept) > top_k:
+            heapq.heappop(kept)
+    kept.sort(key=lambda item: -item[1])
+    for score, _, opinion in kept:
+        logger.debug(f"prefilter: opinion {opinion['id']} scored {score:.2f}")
+    return [opinion for _, _, opinion in kept]
@@ -0,0 +1,133 @@
+"""On-disk staging area of fetched opinions, iterated by id without holding them all in memory
+"""
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import logging
+from typing import Dict, Iterable, Iterator, Optional
+
+from media_agents import blob_store
+
+# Initialize logger
+logger = logging.getLogger(__name__)
+
+# Bulky CourtListener fields no node reads, e.g. the HTML rendering of the opinion text
+BULK_FIELDS = ("html", "html_lawbox", "html_columbia", "html_anon_2020", "xml_harvard", "html_with_citations")
+
+
+def compact_opinion(opinion: Dict) -> Dict:
+    """
+    Drop the unused bulky fields of an opinion and move its text to the blob store.
+
+    :param opinion: The CourtListener opinion record, updated in place.
+    :return: The opinion.
+    """
+    for field in BULK_FIELDS:
+        opinion.pop(field, None)
+    blob_store.offload_text(opinion)
+    return opinion
+
+
+class OpinionSpool:
+    """
+    SQLite staging table of fetched opinions, keyed by id.
+
+    Iteration reads the opinions by ascending id a few at a time, and tolerates
+    opinions being updated or discarded while it runs.
+    """
+
+    # Number of opinions read per query while iterating
+    READ_BATCH = 100
+
+    def __init__(self, path: str):
+        """
+        :param path: Path of the SQLite database file, created if missing.
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS opinions (id INTEGER PRIMARY KEY, record TEXT NOT NULL)")
+        self._conn.commit()
+
+    @classmethod
+    def create(cls, directory: str) -> "OpinionSpool":
+        """
+        Create an empty spool with a unique file name in a directory.
+
+        :param directory: The spool directory.
+        :return: The spool.
+        """
+        os.makedirs(directory, exist_ok=True)
+        fd, path = tempfile.mkstemp(dir=directory, prefix='opinions_', suffix='.sqlite')
+        os.close(fd)
+        return cls(path)
+
+    def add(self, opinions: Iterable[Dict]) -> int:
+        """
+        Stage opinions, compacted with `compact_opinion`. An opinion already staged is replaced.
+
+        :param opinions: The opinions.
+        :return: The number of staged opinions.
+        """
+        rows = [(int(opinion["id"]), json.dumps(compact_opinion(opinion))) for opinion in opinions]
+        with self._lock:
+            self._conn.executemany("INSERT OR REPLACE INTO opinions (id, record) VALUES (?, ?)", rows)
+            self._conn.commit()
+        return len(rows)
+
+    def get(self, id: int) -> Optional[Dict]:
+        with self._lock:
+            row = self._conn.execute("SELECT record FROM opinions WHERE id = ?", (id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def update(self, opinion: Dict) -> None:
+        """
+        Replace a staged opinion, e.g. to add fields to it.
+        """
+        with self._lock:
+            self._conn.execute("UPDATE opinions SET record = ? WHERE id = ?", (json.dumps(opinion), int(opinion["id"])))
+            self._conn.commit()
+
+    def discard(self, id: int) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM opinions WHERE id = ?", (id,))
+            self._conn.commit()
+
+    def max_id(self) -> Optional[int]:
+        with self._lock:
+            return self._conn.execute("SELECT MAX(id) FROM opinions").fetchone()[0]
+
+    def __iter__(self) -> Iterator[Dict]:
+        last_id = None
+        while True:
+            with self._lock:
+                if last_id is None:
+                    rows = self._conn.execute("SELECT id, record FROM opinions ORDER BY id LIMIT ?",
+                                              (self.READ_BATCH,)).fetchall()
+                else:
+                    rows = self._conn.execute("SELECT id, record FROM opinions WHERE id > ? ORDER BY id LIMIT ?",
+                                              (last_id, self.READ_BATCH)).fetchall()
+            if not rows:
+                return
+            for id, record in rows:
+                yield json.loads(record)
+            last_id = rows[-1][0]
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM opinions").fetchone()[0]
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    def remove(self) -> None:
+        """
+        Close the spool and delete its file.
+        """
+        self.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
@@ -0,0 +1,228 @@
+"""Structured LLM output: schema normalization, validation and bounded repair of malformed answers
+"""
+import json
+import os
+import logging
+from typing import Any, Dict, List, Optional
+
+from langchain_core.exceptions import OutputParserException
+from langchain_core.messages import AIMessage, HumanMessage
+from langchain_core.output_parsers import JsonOutputParser
+from langchain_core.runnables import RunnableLambda
+
+import media_agents.config as config
+from media_agents import llm_executor
+from media_agents.app_resources import get_derived_content
+
+# Initialize logger
+logger = logging.getLogger(__name__)
+
+# Non-standard type names used by the schema resources
+TYPE_ALIASES = {"id": ["integer", "string"], "int": "integer", "float": "number", "bool": "boolean"}
+
+# Python types of the JSON schema types
+JSON_TYPES = {"object": dict, "array": list, "string": str, "integer": int, "number": (int, float),
+              "boolean": bool, "null": type(None)}
+
+# Property wrapping array outputs, function calling only accepts object parameters
+ARRAY_WRAPPER = "items"
+
+REPAIR_MESSAGE = ("Your answer does not match the schema: {errors}. "
+                  "Answer again with only the corrected JSON, following the schema.")
+
+
+class StructuredOutputError(ValueError):
+    """
+    Raised when an LLM answer is still malformed or invalid after the repair attempts.
+    """
+
+
+def normalize_schema(schema: Dict) -> Dict:
+    """
+    Turn a schema resource into a standard JSON schema.
+
+    The resources wrap the object schema in an extra `properties` level, use type names like
+    `int` or `id`, and `"required": "all"`; these are normalized recursively.
+
+    :param schema: The schema resource.
+    :return: The JSON schema.
+    """
+    schema = dict(schema)
+    properties = schema.get("properties")
+    if isinstance(properties, dict) and properties.get("type") == "object" and "properties" in properties:
+        schema.pop("properties")
+        schema.update({k: v for k, v in properties.items() if k != "description"})
+    if isinstance(schema.get("type"), str) and schema["type"] in TYPE_ALIASES:
+        schema["type"] = TYPE_ALIASES[schema["type"]]
+        schema.pop("pattern", None)
+    if isinstance(schema.get("properties"), dict):
+        properties = schema["properties"]
+        # a `required` list misplaced among the properties
+        if isinstance(properties.get("required"), list) and "required" not in schema:
+            schema["required"] = properties["required"]
+        schema["properties"] = {k: normalize_schema(v) for k, v in properties.items() if isinstance(v, dict)}
+        if schema.get("required") == "all":
+            schema["required"] = list(schema["properties"])
+    if isinstance(schema.get("items"), dict):
+        schema["items"] = normalize_schema(schema["items"])
+    return schema
+
+
+def parse_schema(content: str) -> Dict:
+    return normalize_schema(json.loads(content))
+
+
+def load_schema(schema_path: str) -> Dict:
+    """
+    Get the normalized JSON schema of a schema resource.
+
+    :param schema_path: The path to the schema resource.
+    :return: The JSON schema, cached until the resource changes.
+    """
+    return get_derived_content((schema_path,), parse_schema)
+
+
+def validate(obj: Any, schema: Dict, path: str = "$") -> List[str]:
+    """
+    Validate a value against the subset of JSON schema used by the schema resources:
+    `type`, `enum`, `properties`, `required` and `items`.
+
+    :param obj: The value.
+    :param schema: The JSON schema.
+    :param path: The path of the value, used in error messages.
+    :return: The validation errors, empty if the value is valid.
+    """
+    expected = schema.get("type")
+    types = [t for t in (expected if isinstance(expected, list) else [expected]) if t in JSON_TYPES]
+    if types and not any(isinstance(obj, JSON_TYPES[t]) and not (t in ("integer", "number") and isinstance(obj, bool))
+                         for t in types):
+        return [f"{path} must be of type {' or '.join(types)}"]
+    if "enum" in schema and obj not in schema["enum"]:
+        return [f"{path} must be one of {schema['enum']}"]
+    errors = []
+    if isinstance(obj, dict):
+        for key in schema.get("required") or []:
+            if key not in obj:
+                errors.append(f"{path}.{key} is required")
+        for key, value in obj.items():
+            if key in (schema.get("properties") or {}):
+                errors.extend(validate(value, schema["properties"][key], f"{path}.{key}"))
+    elif isinstance(obj, list) and isinstance(schema.get("items"), dict):
+        for i, value in enumerate(obj):
+            errors.extend(validate(value, schema["items"], f"{path}[{i}]"))
+    return errors
+
+
+def tool_schema(schema: Dict, name: str) -> Dict:
+    """
+    Build the function calling schema of an output schema.
+
+    :param schema: The JSON schema.
+    :param name: The function name.
+    :return: A JSON schema with a title, and arrays wrapped in an object.
+    """
+    if schema.get("type") == "array":
+        schema = {"type": "object", "properties": {ARRAY_WRAPPER: schema}, "required": [ARRAY_WRAPPER]}
+    return dict(schema, title=name, description=schema.get("description") or name)
+
+
+def supports_native(client: Any) -> bool:
+    """
+    Check whether structured output is requested and the client can produce it natively.
+
+    :param client: The chat model.
+    :return: True to use the provider structured output (tool calling) mode.
+    """
+    mode = os.getenv("STRUCTURED_OUTPUT", config.STRUCTURED_OUTPUT)
+    return mode == "native" and hasattr(client, "with_structured_output")
+
+
+def native_pipeline(client: Any, schema: Dict, name: str) -> Any:
+    """
+    Build a pipeline returning the parsed answer of the provider structured output mode.
+
+    :param client: The chat model.
+    :param schema: The JSON schema.
+    :param name: The function name.
+    :return: The runnable.
+    """
+    wrapped = schema.get("type") == "array"
+
+    def unwrap(output: Dict) -> Any:
+        if output.get("parsing_error") is not None or output.get("parsed") is None:
+            raw = output.get("raw")
+            raise StructuredOutputError(f"unparsable structured output: {output.get('parsing_error')}",
+                                        getattr(raw, "content", "") or str(raw))
+        parsed = output["parsed"]
+        return parsed.get(ARRAY_WRAPPER) if wrapped and isinstance(parsed, dict) else parsed
+
+    return client.with_structured_output(tool_schema(schema, name), include_raw=True) | RunnableLambda(unwrap)
+
+
+def previous_answer(output: Any) -> str:
+    """
+    Get the text of a rejected answer, to be shown to the model in the repair request.
+    """
+    if isinstance(output, Exception):
+        llm_output = getattr(output, "llm_output", None)
+        if llm_output:
+            return llm_output
+        return output.args[1] if len(output.args) > 1 else ""
+    return json.dumps(output)
+
+
+def invoke_structured(client: Any, messages: List[List[Any]], schema: Optional[Dict], provider: str,
+                      name: str = "output", models: Optional[List[Optional[str]]] = None) -> List[Any]:
+    """
+    Invoke a chat model concurrently on several prompts, returning answers valid against a schema.
+
+    Malformed or invalid answers are sent back to the model with the validation errors, at most
+    STRUCTURED_OUTPUT_REPAIRS times. Other failures are not retried.
+
+    :param client: The chat model.
+    :param messages: The messages of each prompt.
+    :param schema: The JSON schema of the answers, None to skip validation.
+    :param provider: The provider name the calls are accounted to.
+    :param name: The name of the output, used as function name in native mode.
+    :param models: List filled with the model giving each answer, when recorded, see `llm_executor.invoke_all`.
+    :return: The valid answers, or the exceptions raised, in the order of `messages`.
+    """
+    if schema is not None and supports_native(client):
+        pipeline = native_pipeline(client, schema, name)
+    else:
+        pipeline = client | JsonOutputParser()
+    inputs = list(messages)
+    limit = not getattr(client, "limits_concurrency", False)
+    answered_by = []
+    outputs = llm_executor.invoke_all(pipeline, inputs, provider, limit, answered_by)
+    repairs = int(os.getenv("STRUCTURED_OUTPUT_REPAIRS", config.STRUCTURED_OUTPUT_REPAIRS))
+    for attempt in range(repairs + 1):
+        rejected = {}
+        for i, output in enumerate(outputs):
+            if isinstance(output, Exception):
+                if isinstance(output, (OutputParserException, StructuredOutputError)):
+                    rejected[i] = [f"the answer is not valid JSON ({output.args[0] if output.args else output})"]
+                continue
+            errors = validate(output, schema) if schema is not None else []
+            if errors:
+                rejected[i] = errors
+        if not rejected:
+            break
+        if attempt == repairs:
+            for i, errors in rejected.items():
+                if not isinstance(outputs[i], Exception):
+                    outputs[i] = StructuredOutputError(f"invalid {name} output: {'; '.join(errors[:5])}")
+            break
+        logger.warning(f"{name}: repairing {len(rejected)} of {len(outputs)} answers")
+        indexes = list(rejected)
+        repair_inputs = [inputs[i] + [AIMessage(content=previous_answer(outputs[i])),
+                                      HumanMessage(content=REPAIR_MESSAGE.format(errors='; '.join(rejected[i][:10])))]
+                         for i in indexes]
+        repaired_by = []
+        repaired = llm_executor.invoke_all(pipeline, repair_inputs, provider, limit, repaired_by)
+        for i, output, model in zip(indexes, repaired, repaired_by):
+            outputs[i] = output
+            answered_by[i] = model
+    if models is not None:
+        models[:] = answered_by
+    return outputs
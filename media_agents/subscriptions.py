@@ -1,11 +1,107 @@
 import os
-import dotenv
+import json
+import logging
+from collections import defaultdict
+from typing import Dict, Iterable, List, Tuple
 
-dotenv.load_dotenv()
+import media_agents.config as config
 
-storage_file=os.getenv('SUBSCRIPTIONS_STORAGE')
+# Initialize logger
+logger = logging.getLogger(__name__)
+
+# Subscriber preference fields and the article fields they are matched against
+PREFERENCE_FIELDS = {
+    "topics": "categories",
+    "keywords": "keywords",
+    "people": "people",
+    "organizations": "organizations",
+}
 
 def get_recipients():
+    storage_file = os.getenv('SUBSCRIPTIONS_STORAGE')
     with open(storage_file, 'r', encoding='utf-8') as f:
-        recipients = [r.strip('/n') for r in f.readlines()]
-    return recipients
+        recipients = [r.strip() for r in f.readlines()]
+    return [r for r in recipients if r]
+
+def get_preferences() -> Dict[str, Dict]:
+    """
+    Load the subscriber preferences from the SUBSCRIPTIONS_PREFERENCES JSONL file, subscriptions/preferences.jsonl
+    by default, one subscriber per line:
+    `{"email": "...", "topics": [...], "keywords": [...], "people": [...], "organizations": [...]}`.
+
+    :return: A dictionary mapping subscriber emails to their preferences, empty if the file is not set up.
+    """
+    preferences_file = os.getenv('SUBSCRIPTIONS_PREFERENCES', config.SUBSCRIPTIONS_PREFERENCES)
+    if not preferences_file or not os.path.exists(preferences_file):
+        return {}
+    preferences = {}
+    with open(preferences_file, 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                preferences[record["email"]] = record
+    return preferences
+
+def normalize_term(term: str) -> str:
+    return " ".join(str(term).lower().split())
+
+class SubscriptionIndex:
+    """
+    Inverted index from preference terms to subscribers.
+
+    Subscribers without preferences receive every article.
+    """
+
+    def __init__(self, recipients: Iterable[str], preferences: Dict[str, Dict]):
+        """
+        :param recipients: The subscriber emails.
+        :param preferences: The subscriber preferences by email.
+        """
+        self.recipients = list(recipients)
+        self.catch_all = []
+        # (article field, normalized term) -> subscriber emails
+        self.index = defaultdict(set)
+        for email in self.recipients:
+            prefs = preferences.get(email) or {}
+            terms = [(field, normalize_term(term)) for pref, field in PREFERENCE_FIELDS.items()
+                     for term in prefs.get(pref) or []]
+            if not terms:
+                self.catch_all.append(email)
+            for term in terms:
+                self.index[term].add(email)
+
+    def match(self, article: Dict) -> set:
+        """
+        Find the subscribers interested in an article.
+
+        :param article: The article, with `categories`, `keywords`, `people` and `organizations` lists.
+        :return: The set of matching subscriber emails, excluding catch-all subscribers.
+        """
+        matched = set()
+        for field in PREFERENCE_FIELDS.values():
+            for term in article.get(field) or []:
+                matched |= self.index.get((field, normalize_term(term)), set())
+        return matched
+
+    def group_digests(self, articles: List[Dict]) -> Dict[Tuple[int, ...], List[str]]:
+        """
+        Select the articles of every subscriber in one pass over the articles, and group subscribers
+        receiving the same selection so each distinct digest is rendered once.
+
+        :param articles: The articles.
+        :return: A dictionary mapping article index tuples to the subscribers receiving that digest,
+            subscribers with no matching article are left out.
+        """
+        selections = defaultdict(list)
+        for i, article in enumerate(articles):
+            for email in self.match(article):
+                selections[email].append(i)
+        digests = defaultdict(list)
+        all_articles = tuple(range(len(articles)))
+        if all_articles and self.catch_all:
+            digests[all_articles].extend(self.catch_all)
+        for email in self.recipients:
+            if email in selections:
+                digests[tuple(selections[email])].append(email)
+        logger.info(f"{len(digests)} distinct digests for {sum(len(r) for r in digests.values())} subscribers")
+        return dict(digests)
@@ -1,32 +1,66 @@
 import json
 import datetime
-import json
-from jinja2 import Environment, BaseLoader
-from media_agents.app_resources import get_resource_content
+from typing import Dict, Iterable, List, Optional
+from jinja2 import Environment, BaseLoader, Template
+from media_agents.app_resources import get_derived_content
 
-def render_template(template_res_path, data_json_path) -> str:
-    # Get json
-    data_collection = []
+# Shared Jinja2 environment, templates are compiled once per locale and recompiled when changed
+environment = Environment(loader=BaseLoader())
+
+DATE_FORMAT = '%B %d, %Y'
+
+def get_template(template_res_path: str, locale: Optional[str] = None) -> Template:
+    """
+    Get a compiled template.
+
+    :param template_res_path: The path to the template resource, relative to the locale directory.
+    :param locale: The locale the template is loaded for, defaults to the current locale.
+    :return: The compiled Jinja2 template.
+    """
+    return get_derived_content((template_res_path,), environment.from_string, locale)
+
+def normalize_article(item: Dict) -> Dict:
+    """
+    Format the ISO dates of an article for display.
+
+    :param item: The article record.
+    :return: The article, with every field named like `*date*` formatted as e.g. `March 15, 2024`.
+    """
+    for k in list(item.keys()):
+        if 'date' in k:
+            try:
+                item[k] = datetime.datetime.fromisoformat(item[k]).strftime(DATE_FORMAT)
+            except Exception:
+                continue
+    return item
+
+def load_articles(data_json_path: str) -> List[Dict]:
+    """
+    Load and normalize the articles of a JSONL file.
+
+    :param data_json_path: The path to the JSONL file.
+    :return: The normalized articles.
+    """
     with open(data_json_path, 'r') as fr:
-        for line in fr.readlines():
-            data_collection.append(json.loads(line))
-    for item in data_collection:
-        keys = list(item.keys())
-        for k in keys:
-            if 'date' in k:
-                try:
-                    item[k] = datetime.datetime.fromisoformat(item[k]).strftime('%B %d, %Y')
-                except Exception:
-                    continue
-
-    # Create Jinja2 template
-    template_str = get_resource_content(template_res_path)
-    template = Environment(loader=BaseLoader()).from_string(template_str)
+        return [normalize_article(json.loads(line)) for line in fr if line.strip()]
 
-    # Get current date in UTC
-    current_date = datetime.datetime.now(datetime.UTC).strftime('%B %d, %Y')
+def render_templates(template_res_paths: Iterable[str], data_json_path: Optional[str] = None,
+                     articles: Optional[List[Dict]] = None, locale: Optional[str] = None) -> Dict[str, str]:
+    """
+    Render several templates, e.g. the HTML and text newsletters, from a single load of the articles.
 
-    # Render the template
-    output = template.render(articles=data_collection, current_date=current_date)
+    :param template_res_paths: The paths to the template resources.
+    :param data_json_path: The path to the JSONL file of articles, unless `articles` is given.
+    :param articles: The normalized articles.
+    :param locale: The locale of the templates, defaults to the current locale.
+    :return: A dictionary mapping each template path to its rendered output.
+    """
+    if articles is None:
+        articles = load_articles(data_json_path)
+    # Get current date in UTC
+    current_date = datetime.datetime.now(datetime.UTC).strftime(DATE_FORMAT)
+    return {path: get_template(path, locale).render(articles=articles, current_date=current_date)
+            for path in template_res_paths}
 
-    return output
\ No newline at end of file
+def render_template(template_res_path, data_json_path) -> str:
+    return render_templates([template_res_path], data_json_path)[template_res_path]
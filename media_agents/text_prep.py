@@ -0,0 +1,73 @@
+"""Token counting, chunking and field selection for LLM prompts
+"""
+import logging
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional
+
+# Initialize logger
+logger = logging.getLogger(__name__)
+
+# Average number of characters per token, used when no tokenizer is available
+CHARS_PER_TOKEN = 4
+
+
+@lru_cache
+def get_encoding(name: str = "cl100k_base") -> Optional[object]:
+    """
+    Get a tiktoken encoding, or None if it cannot be loaded (e.g. offline without a cached encoding file).
+
+    :param name: The tiktoken encoding name.
+    :return: The encoding, or None.
+    """
+    try:
+        import tiktoken
+        return tiktoken.get_encoding(name)
+    except Exception as ex:
+        logger.warning(f"tiktoken encoding {name} unavailable, token counts are approximated: {ex}")
+        return None
+
+
+def count_tokens(text: str) -> int:
+    """
+    Count the tokens of a text.
+
+    :param text: The text.
+    :return: The number of tokens, approximated from the text length if no tokenizer is available.
+    """
+    encoding = get_encoding()
+    if encoding is None:
+        return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def chunk_text(text: str, chunk_tokens: int, overlap_tokens: int = 0) -> List[str]:
+    """
+    Split a text into chunks of at most `chunk_tokens` tokens, consecutive chunks sharing `overlap_tokens` tokens.
+
+    :param text: The text to split.
+    :param chunk_tokens: Maximum number of tokens per chunk.
+    :param overlap_tokens: Number of tokens repeated at the start of the next chunk, less than `chunk_tokens`.
+    :return: The chunks.
+    :raises ValueError: If the overlap is not smaller than the chunk, which would start a chunk at every token.
+    """
+    if not 0 <= overlap_tokens < chunk_tokens:
+        raise ValueError(f"chunk overlap of {overlap_tokens} tokens must be between 0 and the chunk size of {chunk_tokens} tokens")
+    step = chunk_tokens - overlap_tokens
+    encoding = get_encoding()
+    if encoding is None:
+        size, step = chunk_tokens * CHARS_PER_TOKEN, step * CHARS_PER_TOKEN
+        return [text[start:start + size] for start in range(0, max(1, len(text) - overlap_tokens * CHARS_PER_TOKEN), step)]
+    tokens = encoding.encode(text, disallowed_special=())
+    return [encoding.decode(tokens[start:start + chunk_tokens])
+            for start in range(0, max(1, len(tokens) - overlap_tokens), step)]
+
+
+def select_fields(record: Dict, fields: Iterable[str]) -> Dict:
+    """
+    Keep only the given fields of a record, e.g. to leave the full opinion text out of a prompt.
+
+    :param record: The record.
+    :param fields: The names of the fields to keep, when present.
+    :return: A new dictionary with the selected fields.
+    """
+    return {field: record[field] for field in fields if field in record}
@@ -0,0 +1,58 @@
+import os
+
+from media_agents.app_resources import ResourceRegistry, get_locale, use_locale
+
+
+def write(path, content, mtime):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(content)
+    os.utime(path, ns=(mtime, mtime))
+
+
+def test_registry_serves_resources_from_memory(tmp_path):
+    """
+    Test that preloaded resources and derived values are served without reading the files again.
+    """
+    write(tmp_path / "en/prompts/p.txt", "prompt", 1)
+    write(tmp_path / "en/schemas/s.json", "{}", 1)
+    registry = ResourceRegistry(str(tmp_path))
+    builds = []
+
+    def compose(prompt, schema):
+        builds.append((prompt, schema))
+        return prompt + schema
+
+    assert registry.preload("en") == 2
+    for _ in range(3):
+        assert registry.get("prompts/p.txt", "en") == "prompt"
+        assert registry.get_derived(("prompts/p.txt", "schemas/s.json"), compose, "en") == "prompt{}"
+    assert registry.reads == 2 and len(builds) == 1
+
+
+def test_registry_hot_reloads_changed_resources(tmp_path):
+    """
+    Test that a changed resource is read again and its derived values rebuilt.
+    """
+    write(tmp_path / "en/prompts/p.txt", "old", 1)
+    registry = ResourceRegistry(str(tmp_path), reload_interval=1e-9)
+    assert registry.get_derived(("prompts/p.txt",), str.upper, "en") == "OLD"
+
+    write(tmp_path / "en/prompts/p.txt", "new", 2)
+
+    assert registry.get("prompts/p.txt", "en") == "new"
+    assert registry.get_derived(("prompts/p.txt",), str.upper, "en") == "NEW"
+
+
+def test_registry_serves_locales_side_by_side(tmp_path):
+    """
+    Test that resources of several locales are cached independently and selected per context.
+    """
+    write(tmp_path / "en/templates/t.txt", "hello", 1)
+    write(tmp_path / "de/templates/t.txt", "hallo", 1)
+    registry = ResourceRegistry(str(tmp_path))
+
+    with use_locale("de"):
+        assert get_locale() == "de"
+        assert registry.get("templates/t.txt") == "hallo"
+    assert get_locale() == "en"
+    assert registry.get("templates/t.txt") == "hello"
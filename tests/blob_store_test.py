@@ -0,0 +1,64 @@
+import json
+import os
+import time
+
+import pytest
+from langchain_core.runnables import RunnableLambda
+
+from media_agents import blob_store, graph_ops
+from media_agents.blob_store import BlobStore
+from tests.fakes import fake_llm
+
+
+def test_store_keeps_one_copy_per_text(tmp_path):
+    """
+    Test that identical texts share one blob, that references give the text length without
+    loading it, and that unused blobs are pruned.
+    """
+    store = BlobStore(str(tmp_path), cache_entries=1)
+    ref = store.put("SUPREME COURT OF THE UNITED STATES")
+    assert store.put("SUPREME COURT OF THE UNITED STATES") == ref and ref["chars"] == 34
+    other = store.put("The appeal is dismissed.")
+    assert store.get(ref) == "SUPREME COURT OF THE UNITED STATES"
+    assert store.get(other) == "The appeal is dismissed."
+
+    old = time.time() - 3600
+    os.utime(store.path(other["key"]), (old, old))
+    assert store.prune(60) == 1
+    assert os.path.exists(store.path(ref["key"])) and not os.path.exists(store.path(other["key"]))
+
+
+def test_stored_text_needs_the_store(monkeypatch):
+    """
+    Test that a text referenced while the store is disabled fails with an error naming the setting.
+    """
+    opinion = {"id": 1, "plain_text": "SUPREME COURT OF THE UNITED STATES"}
+    blob_store.offload_text(opinion)
+    monkeypatch.setenv("TEXT_STORE_DIR", "")
+    blob_store.set_store(None)
+
+    with pytest.raises(blob_store.TextStoreError, match="TEXT_STORE_DIR"):
+        blob_store.load_text(opinion)
+    assert blob_store.load_text({"id": 2, "plain_text": "inline"}) == "inline"
+
+
+def test_state_carries_text_references(monkeypatch):
+    """
+    Test that fetched opinions carry references instead of their text through the news lead stage,
+    while prompts still get the full text.
+    """
+    with open("tests/data/opinion1.json", "r") as fh:
+        opinion = json.load(fh)
+    prompts = []
+    monkeypatch.setattr(graph_ops, "client", RunnableLambda(lambda messages: prompts.append(messages[1].content)
+                                                            or fake_llm(messages)))
+    monkeypatch.setattr(graph_ops, "get_content",
+                        lambda url: {"results": [dict(opinion)]} if url.endswith("page=1") else {"results": []})
+
+    fetched = graph_ops.fetch_update({"last_processed_id": 0})["opinions_to_check"]
+    assert "plain_text" not in fetched[0] and fetched[0]["plain_text_ref"]["chars"] == len(opinion["plain_text"])
+
+    leads = graph_ops.find_news_leads({"opinions_to_check": fetched})["newsworthy_opinions"]
+    assert leads[0]["plain_text_ref"] == fetched[0]["plain_text_ref"] and "plain_text" not in leads[0]
+    assert blob_store.load_text(leads[0]) == opinion["plain_text"]
+    assert prompts[0].endswith(opinion["plain_text"])
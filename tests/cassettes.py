@@ -0,0 +1,124 @@
+"""Record/replay of the LLM and CourtListener traffic of the graph tests
+
+Cassettes are JSON files under tests/data/cassettes. The CASSETTE_MODE setting selects:
+- "replay" (default): answers come from the cassette only, a missing interaction fails the test;
+- "record": missing interactions go to the live LLM / CourtListener and are added to the cassette;
+- "live": cassettes are ignored.
+
+The cassettes of tests/graph_ops_test.py were seeded offline rather than recorded: their CourtListener
+pages hold the opinions of tests/data without their HTML renderings, and their LLM answers were
+written to the stage schemas. Record them from the live services by deleting them and running the
+tests with CASSETTE_MODE=record, see the README.
+"""
+import hashlib
+import json
+import os
+import threading
+from typing import Any, Callable, Dict, Optional
+
+from langchain_core.messages import AIMessage
+from langchain_core.runnables import Runnable
+
+CASSETTES_DIR = os.path.join(os.path.dirname(__file__), 'data', 'cassettes')
+
+
+class CassetteMiss(LookupError):
+    """
+    Raised in replay mode for an interaction missing from the cassette.
+    """
+
+
+def get_mode() -> str:
+    return os.getenv("CASSETTE_MODE", "replay")
+
+
+def message_key(stage: Optional[str], messages: Any) -> str:
+    """
+    Build the key of an LLM call from its stage and messages; the model is left out so
+    cassettes replay whatever LLM_CLIENT is configured.
+    """
+    if isinstance(messages, str):
+        messages = [messages]
+    serialized = [[getattr(m, 'type', 'human'), getattr(m, 'content', m)] for m in messages]
+    return hashlib.sha256(json.dumps([stage, serialized]).encode('utf-8')).hexdigest()
+
+
+class Cassette:
+    """
+    Recorded LLM answers and CourtListener responses of one test.
+    """
+
+    def __init__(self, path: str, mode: str):
+        """
+        :param path: The cassette file.
+        :param mode: "replay" or "record".
+        """
+        self.path = path
+        self.mode = mode
+        self.llm: Dict[str, Dict] = {}
+        self.http: Dict[str, Any] = {}
+        self.dirty = False
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as fh:
+                data = json.load(fh)
+            self.llm = data.get("llm", {})
+            self.http = data.get("http", {})
+
+    def play_llm(self, stage: Optional[str], messages: Any, live: Callable[[], Any]) -> str:
+        key = message_key(stage, messages)
+        with self._lock:
+            if key in self.llm:
+                return self.llm[key]["content"]
+        if self.mode != "record":
+            raise CassetteMiss(f"{stage} LLM call not in {self.path}, record it with CASSETTE_MODE=record")
+        message = live().invoke(messages)
+        with self._lock:
+            self.llm[key] = {"stage": stage, "content": message.content}
+            self.dirty = True
+        return message.content
+
+    def play_http(self, url: str, live: Callable[[str], Any]) -> Any:
+        with self._lock:
+            if url in self.http:
+                return self.http[url]
+        if self.mode != "record":
+            raise CassetteMiss(f"GET {url} not in {self.path}, record it with CASSETTE_MODE=record")
+        content = live(url)
+        with self._lock:
+            self.http[url] = content
+            self.dirty = True
+        return content
+
+    def save(self) -> None:
+        if not self.dirty:
+            return
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path, 'w', encoding='utf-8') as fh:
+            json.dump({"llm": self.llm, "http": self.http}, fh, indent=1, sort_keys=True, ensure_ascii=False)
+            fh.write('\n')
+
+
+class CassetteChatModel(Runnable):
+    """
+    Chat model of one stage answering from a cassette, and recording the live model in record mode.
+
+    It has no native structured output, so answers are parsed from their text in every mode.
+    """
+
+    model_name = "cassette"
+    provider = "cassette"
+    temperature = None
+
+    def __init__(self, cassette: Cassette, stage: Optional[str], live: Callable[[], Any]):
+        """
+        :param cassette: The cassette.
+        :param stage: The stage name.
+        :param live: Function returning the live chat model of the stage.
+        """
+        self.cassette = cassette
+        self.stage = stage
+        self.live = live
+
+    def invoke(self, input: Any, config: Optional[Any] = None, **kwargs: Any) -> AIMessage:
+        return AIMessage(content=self.cassette.play_llm(self.stage, input, self.live))
@@ -0,0 +1,28 @@
+import pytest
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+from langchain_core.runnables import RunnableLambda
+
+from tests.cassettes import Cassette, CassetteChatModel, CassetteMiss
+
+
+def test_record_then_replay(tmp_path):
+    """
+    Test that record mode stores the live answers and responses, which replay mode then serves offline,
+    and that replay mode fails on an interaction missing from the cassette.
+    """
+    path = str(tmp_path / "cassette.json")
+    messages = [SystemMessage(content="Write a headline"), HumanMessage(content="article")]
+    live = RunnableLambda(lambda messages: AIMessage(content='{"headline": "Court rules"}'))
+
+    recorder = Cassette(path, "record")
+    assert CassetteChatModel(recorder, "headline", lambda: live).invoke(messages).content == '{"headline": "Court rules"}'
+    assert recorder.play_http("https://example.com/page=1", lambda url: {"results": []}) == {"results": []}
+    recorder.save()
+
+    player = Cassette(path, "replay")
+    assert CassetteChatModel(player, "headline", None).invoke(messages).content == '{"headline": "Court rules"}'
+    assert player.play_http("https://example.com/page=1", None) == {"results": []}
+    with pytest.raises(CassetteMiss):
+        CassetteChatModel(player, "draft", None).invoke(messages)
+    with pytest.raises(CassetteMiss):
+        player.play_http("https://example.com/page=2", None)
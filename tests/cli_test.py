@@ -0,0 +1,105 @@
+import json
+import sqlite3
+import time
+
+import pytest
+from langchain_core.runnables import RunnableLambda
+
+from media_agents import graph_ops
+from media_agents.cli import parse_args, run
+from media_agents.graph_description import create_checkpointer, prune_checkpoints
+from tests.fakes import fake_llm
+
+
+def test_run_resumes_from_last_completed_node(tmp_path, monkeypatch):
+    """
+    Test that a run crashing while sending email resumes from its checkpoint.
+
+    This test checks that resuming the run id skips the nodes completed before the crash,
+    so no LLM call is repeated, and that the run completes.
+    """
+    opinion = {"id": 1, "resource_uri": "https://www.courtlistener.com/api/rest/v3/opinions/1/",
+               "absolute_url": "/opinion/1/", "download_url": "", "local_path": "",
+               "date_created": "2024-03-15T08:02:22", "date_modified": "2024-03-15T08:02:22",
+               "plain_text": "SUPREME COURT OF THE UNITED STATES"}
+    state_file = tmp_path / "ingestion_state.json"
+    state_file.write_text(json.dumps({"last_processed_id": 0}))
+    llm_calls = []
+    sent = []
+
+    def counting_llm(messages):
+        llm_calls.append(messages)
+        return fake_llm(messages)
+
+    def send_email(*args):
+        if not sent:
+            sent.append(None)
+            raise ConnectionError("SMTP server went away")
+        sent.append(args)
+
+    monkeypatch.setattr(graph_ops, "client", RunnableLambda(counting_llm))
+    monkeypatch.setattr(graph_ops, "get_content",
+                        lambda url: {"results": [opinion]} if url.endswith("page=1") else {"results": []})
+    monkeypatch.setattr(graph_ops, "get_recipients", lambda: ["reader@example.com"])
+    monkeypatch.setattr(graph_ops, "send_email", send_email)
+    monkeypatch.setenv("FETCH_STATE_FILE", str(state_file))
+    monkeypatch.setenv("OUTPUT_DIR", str(tmp_path))
+    monkeypatch.setenv("PREFILTER_SCORERS", "keywords")
+    monkeypatch.setenv("LLM_CACHE_BYPASS", "1")
+    checkpoint_db = str(tmp_path / "checkpoints.sqlite")
+
+    with pytest.raises(ConnectionError):
+        run(parse_args(["--run-id", "crashed", "--checkpoint-db", checkpoint_db]))
+    calls_before_crash = len(llm_calls)
+    assert calls_before_crash > 0
+    assert json.loads(state_file.read_text()) == {"last_processed_id": 0}
+
+    final_state = run(parse_args(["--resume", "crashed", "--checkpoint-db", checkpoint_db]))
+
+    assert len(llm_calls) == calls_before_crash
+    assert final_state["notification"] == "done" and len(sent) == 2
+    assert json.loads(state_file.read_text()) == {"last_processed_id": 1}
+    with sqlite3.connect(checkpoint_db) as conn:
+        assert conn.execute("SELECT COUNT(*) FROM checkpoints WHERE thread_id = 'crashed'").fetchone()[0] == 0
+    with pytest.raises(SystemExit):
+        run(parse_args(["--resume", "crashed", "--checkpoint-db", checkpoint_db]))
+
+
+def test_resume_unknown_run(tmp_path):
+    """
+    Test that resuming a run id missing from the checkpoint database exits.
+    """
+    with pytest.raises(SystemExit):
+        run(parse_args(["--resume", "missing", "--checkpoint-db", str(tmp_path / "checkpoints.sqlite")]))
+
+
+def test_prune_checkpoints_of_inactive_runs(tmp_path):
+    """
+    Test that the checkpoints of a run neither started nor resumed for CHECKPOINT_TTL seconds are deleted,
+    and that the runs checkpointed before their activity was recorded are kept.
+    """
+    checkpoint_db = str(tmp_path / "checkpoints.sqlite")
+    checkpointer = create_checkpointer(checkpoint_db)
+    checkpointer.setup()
+    checkpointer.conn.close()
+    with sqlite3.connect(checkpoint_db) as conn:
+        conn.executemany("INSERT INTO checkpoints (thread_id, thread_ts, checkpoint) VALUES (?, ?, ?)",
+                         [("stale", "1", b""), ("recent", "1", b""), ("legacy", "1", b"")])
+        conn.execute("CREATE TABLE run_activity (thread_id TEXT PRIMARY KEY, updated_at REAL NOT NULL)")
+        conn.executemany("INSERT INTO run_activity (thread_id, updated_at) VALUES (?, ?)",
+                         [("stale", time.time() - 7200), ("recent", time.time())])
+
+    assert prune_checkpoints(checkpoint_db, 3600) == ["stale"]
+    with sqlite3.connect(checkpoint_db) as conn:
+        assert sorted(row[0] for row in conn.execute("SELECT thread_id FROM checkpoints")) == ["legacy", "recent"]
+
+
+def test_metrics_port_from_environment(monkeypatch):
+    """
+    Test that METRICS_PORT sets the metrics port, and that an empty METRICS_PORT, as in .env.example, disables it.
+    """
+    monkeypatch.setenv("METRICS_PORT", "")
+    assert parse_args([]).metrics_port is None
+    monkeypatch.setenv("METRICS_PORT", "9100")
+    assert parse_args([]).metrics_port == 9100
+    assert parse_args(["--metrics-port", "9200"]).metrics_port == 9200
@@ -0,0 +1,63 @@
+import os
+
+import pytest
+
+from media_agents import blob_store, dedup, graph_ops, llm_cache
+from tests.cassettes import CASSETTES_DIR, Cassette, CassetteChatModel, get_mode
+
+
+@pytest.fixture(autouse=True)
+def isolated_llm_cache(tmp_path, monkeypatch):
+    """
+    Give every test its own LLM result cache, so cached results never leak between tests.
+    """
+    monkeypatch.setenv("LLM_CACHE_PATH", str(tmp_path / "llm_cache.sqlite"))
+    llm_cache.set_cache(None)
+    yield
+    cache = llm_cache.get_cache()
+    if cache is not None:
+        cache.close()
+    llm_cache.set_cache(None)
+
+
+@pytest.fixture(autouse=True)
+def isolated_dedup_index(monkeypatch):
+    """
+    Give every test an empty in-memory dedup index, so opinions of a test are never taken for duplicates in another.
+    """
+    monkeypatch.setenv("DEDUP_INDEX_PATH", "")
+    dedup.set_index(None)
+    yield
+    dedup.set_index(None)
+
+
+@pytest.fixture(autouse=True)
+def isolated_text_store(tmp_path_factory, monkeypatch):
+    """
+    Give every test its own opinion text store, out of the test tmp_path.
+    """
+    monkeypatch.setenv("TEXT_STORE_DIR", str(tmp_path_factory.mktemp("texts")))
+    blob_store.set_store(None)
+    yield
+    blob_store.set_store(None)
+
+
+@pytest.fixture
+def cassette(request, monkeypatch):
+    """
+    Replay the LLM and CourtListener traffic of a test from tests/data/cassettes/<module>/<test>.json,
+    or record it with CASSETTE_MODE=record, see `tests.cassettes`.
+    """
+    mode = get_mode()
+    if mode == "live":
+        yield None
+        return
+    module = request.module.__name__.rsplit('.', 1)[-1]
+    tape = Cassette(os.path.join(CASSETTES_DIR, module, request.node.name + '.json'), mode)
+    get_client = graph_ops.get_client
+    get_content = graph_ops.get_content
+    monkeypatch.setattr(graph_ops, "get_client",
+                        lambda stage=None: CassetteChatModel(tape, stage, lambda: get_client(stage)))
+    monkeypatch.setattr(graph_ops, "get_content", lambda url: tape.play_http(url, get_content))
+    yield tape
+    tape.save()
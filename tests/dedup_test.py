@@ -0,0 +1,104 @@
+import json
+
+from media_agents import dedup, graph_ops
+from media_agents.dedup import LSHIndex, MinHasher
+
+
+def load_opinion(name):
+    with open(f"tests/data/{name}", "r") as fh:
+        return json.load(fh)
+
+
+def reupload(opinion, id):
+    """
+    Copy an opinion under a new id, with a new header line and a typo fix, as CourtListener re-uploads look.
+    """
+    copy = dict(opinion, id=id, resource_uri=f"https://www.courtlistener.com/api/rest/v3/opinions/{id}/",
+                absolute_url=f"/opinion/{id}/reupload/")
+    copy["plain_text"] = "Re-uploaded with corrections.\n" + opinion["plain_text"].replace("the", "teh", 1)
+    return copy
+
+
+def test_signatures_estimate_similarity():
+    """
+    Test that signatures of a re-upload are close to the original, and far from another opinion.
+    """
+    opinion1, opinion2 = load_opinion("opinion1.json"), load_opinion("opinion2.json")
+    hasher = MinHasher(128, 5)
+    signature = hasher.signature(opinion1["plain_text"])
+
+    assert dedup.similarity(signature, hasher.signature(reupload(opinion1, 9)["plain_text"])) > 0.9
+    assert dedup.similarity(signature, hasher.signature(opinion2["plain_text"])) < 0.2
+    assert hasher.signature("") is None
+
+
+def test_deduplicate_links_duplicates_to_representative():
+    """
+    Test that a cluster of near-duplicates keeps its first opinion, linked to the others,
+    and that duplicates of an opinion of a previous run are dropped.
+    """
+    opinion1, opinion2 = load_opinion("opinion1.json"), load_opinion("opinion2.json")
+    index, hasher = LSHIndex("", 128, 16), MinHasher(128, 5)
+    copy = reupload(opinion1, opinion1["id"] + 1)
+
+    representatives, duplicates = dedup.deduplicate([copy, opinion2, opinion1], index, hasher, 0.8)
+
+    assert [o["id"] for o in representatives] == [opinion2["id"], opinion1["id"]]
+    assert [d["id"] for d in opinion1["duplicates"]] == [copy["id"]]
+    assert duplicates[0]["duplicate_of"] == opinion1["id"] and duplicates[0]["similarity"] >= 0.8
+
+    later = reupload(opinion2, opinion2["id"] + 100)
+    representatives, duplicates = dedup.deduplicate([later], index, hasher, 0.8)
+    assert representatives == [] and duplicates[0]["duplicate_of"] == opinion2["id"]
+
+
+def test_index_persists_across_successful_runs(tmp_path, monkeypatch):
+    """
+    Test that the dedup node finds duplicates of opinions indexed by a previous successful run,
+    that the opinions of a failed run are not indexed, and that re-fetching the same opinions
+    does not drop them.
+    """
+    opinion1 = load_opinion("opinion1.json")
+    copy = reupload(opinion1, opinion1["id"] + 1)
+    monkeypatch.setenv("DEDUP_INDEX_PATH", str(tmp_path / "dedup_index.sqlite"))
+    monkeypatch.setenv("FETCH_STATE_FILE", str(tmp_path / "ingestion_state.json"))
+
+    def next_run():
+        dedup.get_index()[0].close()
+        dedup.set_index(None)
+
+    # failed run
+    dedup.set_index(None)
+    assert graph_ops.dedup_opinions({"opinions_to_check": [opinion1]})["opinions_to_check"] == [opinion1]
+    next_run()
+    assert graph_ops.dedup_opinions({"opinions_to_check": [copy]})["opinions_to_check"] == [copy]
+    next_run()
+
+    # successful run
+    assert graph_ops.dedup_opinions({"opinions_to_check": [opinion1]})["opinions_to_check"] == [opinion1]
+    graph_ops.save_fetch_state({"last_processed_id": 0, "fetched_last_id": opinion1["id"]})
+    next_run()
+
+    result = graph_ops.dedup_opinions({"opinions_to_check": [opinion1, copy]})
+    assert result["opinions_to_check"] == [opinion1]
+    assert result["duplicate_opinions"][0]["duplicate_of"] == opinion1["id"]
+    result = graph_ops.dedup_opinions({"opinions_to_check": [copy]})
+    assert result["opinions_to_check"] == [] and result["duplicate_opinions"][0]["duplicate_of"] == opinion1["id"]
+    dedup.get_index()[0].close()
+
+
+def test_index_prunes_old_signatures():
+    """
+    Test that committed signatures older than the max age are deleted, and pending ones kept.
+    """
+    opinion1, opinion2 = load_opinion("opinion1.json"), load_opinion("opinion2.json")
+    index, hasher = LSHIndex("", 128, 16), MinHasher(128, 5)
+    signature1 = hasher.signature(opinion1["plain_text"])
+    index.add(opinion1["id"], signature1)
+    assert index.commit_pending() == 1
+    index._conn.execute("UPDATE lsh_signatures SET created_at = created_at - 7200")
+    index.add(opinion2["id"], hasher.signature(opinion2["plain_text"]))
+
+    assert index.prune(3600) == 1
+    assert len(index) == 1 and index.query(signature1) == {}
+    assert index.discard_pending() == 1 and len(index) == 0
@@ -0,0 +1,84 @@
+"""Fakes of the external services shared by the tests
+"""
+import json
+import smtplib
+import threading
+import time
+
+from langchain_core.messages import AIMessage
+
+from media_agents.structured_output import load_schema
+
+
+def fake_llm(messages):
+    """
+    Stage-aware fake LLM: answers each graph node prompt with a minimal valid output.
+    Opinion 2 is slow, so it finishes last.
+    """
+    sys_content = messages[0].content
+    user_content = messages[1].content
+    if "identify potential news leads" in sys_content:
+        id = int(user_content.split("#", 1)[1].split(":", 1)[0])
+        if id == 2:
+            time.sleep(0.2)
+        output = {"id": id, "newsworthy": "True", "influence": "Global", "reason": "test", "labels": ["politics"]}
+    elif "List key points" in sys_content:
+        output = [{"text": "key point", "start_pos": 0, "end_pos": 9}]
+    elif "assess a news articles" in sys_content:
+        output = {criterion: {"score": 9, "comments": []}
+                  for criterion in load_schema('schemas/article_assessment.json')["required"]}
+    elif "improve your news article" in sys_content:
+        output = {"id": 0, "rewritten_news_article": "rewritten article", "keywords": [{"keyword": "court"}]}
+    elif "create a news headlines" in sys_content:
+        output = {"headline": "Court rules"}
+    else:
+        output = {"id": 0, "news_article": "article", "keywords": [{"keyword": "court"}]}
+    return AIMessage(content=json.dumps(output))
+
+
+class FakeSMTP:
+    """
+    In-memory SMTP client recording connections and delivered messages.
+    The connection drops after `drop_after` messages, and `refused` recipients are rejected.
+    """
+    lock = threading.Lock()
+    connections = 0
+    delivered = []
+    drop_after = None
+    refused = set()
+
+    def __init__(self, host, port, timeout=None):
+        with FakeSMTP.lock:
+            FakeSMTP.connections += 1
+        self.sent = 0
+
+    def login(self, user, password):
+        pass
+
+    def sendmail(self, sender, recipient, payload):
+        if FakeSMTP.drop_after is not None and self.sent >= FakeSMTP.drop_after:
+            raise smtplib.SMTPServerDisconnected("connection unexpectedly closed")
+        if recipient in FakeSMTP.refused:
+            raise smtplib.SMTPRecipientsRefused({recipient: (550, b"no such user")})
+        self.sent += 1
+        with FakeSMTP.lock:
+            FakeSMTP.delivered.append((recipient, payload))
+
+    def quit(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def reset_fake_smtp(monkeypatch, drop_after=None, refused=()):
+    """
+    Clear the `FakeSMTP` records and make it the SMTP client of `notification_utils`.
+    """
+    FakeSMTP.connections = 0
+    FakeSMTP.delivered = []
+    FakeSMTP.drop_after = drop_after
+    FakeSMTP.refused = set(refused)
+    monkeypatch.setattr(smtplib, "SMTP_SSL", FakeSMTP)
+    monkeypatch.setenv("SMTP_SECURITY", "ssl")
+    monkeypatch.setenv("SMTP_PASSWORD", "secret")
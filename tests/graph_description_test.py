@@ -0,0 +1,68 @@
+import json
+import os
+
+from langchain_core.runnables import RunnableLambda
+
+from media_agents import graph_ops
+from media_agents.graph_description import build_streaming_workflow, compile_workflow
+from tests.fakes import fake_llm
+
+
+def test_streaming_workflow_processes_opinions_independently(tmp_path, monkeypatch):
+    """
+    Test the streaming workflow end to end with a fake LLM, fake CourtListener and fake email delivery.
+
+    This test checks that each opinion flows through the editorial nodes on its own branch,
+    that articles are published to the stream file as branches complete and that all
+    articles are collected, saved and notified at the end.
+    """
+    opinions = [{"id": id, "resource_uri": "https://www.courtlistener.com/api/rest/v3/opinions/1/",
+                 "absolute_url": f"/opinion/{id}/", "download_url": "", "local_path": "",
+                 "date_created": "2024-03-15T08:02:22", "date_modified": "2024-03-15T08:02:22",
+                 "plain_text": f"SUPREME COURT OF THE UNITED STATES\nDocket No. {id}"} for id in (1, 2, 3)]
+    state_file = tmp_path / "ingestion_state.json"
+    state_file.write_text(json.dumps({"last_processed_id": 0}))
+    sent = []
+    monkeypatch.setattr(graph_ops, "client", RunnableLambda(fake_llm))
+    monkeypatch.setattr(graph_ops, "get_content",
+                        lambda url: {"results": list(reversed(opinions))} if url.endswith("page=1") else {"results": []})
+    monkeypatch.setattr(graph_ops, "get_recipients", lambda: ["reader@example.com"])
+    monkeypatch.setattr(graph_ops, "send_email", lambda *args: sent.append(args))
+    monkeypatch.setenv("FETCH_STATE_FILE", str(state_file))
+    monkeypatch.setenv("OUTPUT_DIR", str(tmp_path))
+    monkeypatch.setenv("PREFILTER_SCORERS", "keywords")
+
+    graph = compile_workflow(build_streaming_workflow())
+    final_state = graph.invoke({"last_processed_id": 0})
+
+    assert sorted(article["source_url"] for article in final_state["articles"]) == \
+        ["https://www.courtlistener.com/opinion/1/", "https://www.courtlistener.com/opinion/2/",
+         "https://www.courtlistener.com/opinion/3/"]
+    assert os.path.dirname(final_state["stream_file"]) == str(tmp_path)
+    with open(final_state["stream_file"]) as fh:
+        streamed = [json.loads(line)["source_url"] for line in fh]
+    assert streamed[-1] == "https://www.courtlistener.com/opinion/2/"
+    assert final_state["news_num"] == 3 and len(sent) == 1
+    assert json.loads(state_file.read_text()) == {"last_processed_id": 3}
+
+
+def test_resumed_stream_skips_published_articles(tmp_path, monkeypatch):
+    """
+    Test that a run starts its own stream file, and that articles already in the file,
+    e.g. published by branches completed before the run was interrupted, are not published again.
+    """
+    monkeypatch.setenv("OUTPUT_DIR", str(tmp_path))
+    articles = [{"headline": f"Court rules {id}", "source_url": f"https://www.courtlistener.com/opinion/{id}/"}
+                for id in (1, 2)]
+    stream_file = graph_ops.open_article_stream({})["stream_file"]
+    graph_ops.publish_articles({"articles": articles[:1], "stream_file": stream_file})
+
+    # a resumed run reloads the published articles from the file
+    graph_ops._published_urls.clear()
+    graph_ops.publish_articles({"articles": articles, "stream_file": stream_file})
+    with open(stream_file) as fh:
+        assert [json.loads(line)["headline"] for line in fh] == ["Court rules 1", "Court rules 2"]
+
+    monkeypatch.setenv("ARTICLE_STREAM_FILE", stream_file)
+    assert graph_ops.open_article_stream({})["stream_file"] == stream_file
+    assert os.path.getsize(stream_file) == 0
@@ -1,8 +1,7 @@
 import pytest
 from media_agents import graph_ops
-from media_agents.graph_description import GraphState
+from media_agents.graph_description import GraphState, build_workflow, compile_workflow
 import json
-import bleu
 import os
 import datetime
 import logging_init
@@ -12,6 +11,12 @@ from langgraph.graph import END, StateGraph, START
 from typing import Dict
 from typing_extensions import TypedDict
 from typing import List
+import time
+import threading
+from langchain_core.messages import AIMessage
+from langchain_core.runnables import RunnableLambda
+from media_agents.structured_output import load_schema
+from tests.fakes import FakeSMTP, reset_fake_smtp
 
 # Test data specimen setup
 test_data_specimen = {"opinions": [], "opinions_with_keypoints": [],
@@ -25,15 +30,20 @@ def setup_module(graph_ops):
     opinions with keypoints, article drafts, articles, and article draft feedback.
     """
     # Load test data from JSON files
-    with open("tests/data/opinion1.json", "r") as fh1:
-        opinion1 = json.load(fh1)
-        test_data_specimen["opinions"].append(opinion1)
-    # ... [similar loading for other JSON files]
+    for key, file_name in (("opinions", "opinion1.json"),
+                           ("newsworthy_opinions", "opinion_newsworthy1.json"),
+                           ("opinions_with_keypoints", "opinion_with_keypoints2.json"),
+                           ("article_drafts", "article_draft1.json"),
+                           ("articles", "article1.json"),
+                           ("article_drafts_feedback", "article_draft_feedback1.json")):
+        with open(f"tests/data/{file_name}", "r") as fh:
+            test_data_specimen[key].append(json.load(fh))
 
     test_data_specimen["attempts"] = 1
     test_data_specimen["news_file"] = "tests/data/legal_news_materials_1.jsonl"
     test_data_specimen["news_num"] = 3
 
+@pytest.mark.usefixtures("cassette")
 def test_find_news_leads():
     """
     Test the find_news_leads function from graph_ops.
@@ -48,6 +58,7 @@ def test_find_news_leads():
             and new_state["newsworthy_opinions"][0]["newsworthy"] == "True")
             and new_state["newsworthy_opinions"][0]["influence"] == "Global")
 
+@pytest.mark.usefixtures("cassette")
 def test_extract_keypoints():
     """
     Test the extract_keypoints function from graph_ops.
@@ -60,6 +71,7 @@ def test_extract_keypoints():
     assert ("opinions_with_keypoints" in new_state and len(new_state["opinions_with_keypoints"]) == 1
             and len(new_state["opinions_with_keypoints"][0]["keypoints"]) > 0)
 
+@pytest.mark.usefixtures("cassette")
 def test_write_articles_draft():
     """
     Test the write_articles_draft function from graph_ops.
@@ -71,7 +83,8 @@ def test_write_articles_draft():
     new_state = graph_ops.write_articles_draft(state)
     assert(("article_drafts" in new_state) and len(new_state["article_drafts"]) == 1 and ("news_article" in new_state["article_drafts"][0]))
 
-def test_editorial_assessment():
+@pytest.mark.usefixtures("cassette")
+def test_editorial_assessment(tmp_path):
     """
     Test the editorial_assessment function from graph_ops.
     
@@ -82,7 +95,7 @@ def test_editorial_assessment():
     new_state = graph_ops.editorial_assessment(state)
     assert(("article_drafts" in new_state) and (len(new_state["article_drafts"]) == 1) and ("editor_feedback" in new_state["article_drafts"][0]))
     article = new_state["article_drafts"][0]
-    with open("article_draft_feedback1.json", "w") as ffd:
+    with open(tmp_path / "article_draft_feedback1.json", "w") as ffd:
         json.dump(article, ffd)
 
 def test_should_continue_loop1():
@@ -127,6 +140,7 @@ def test_should_continue_stop2():
     fname = graph_ops.should_continue(state)
     assert(fname == "generate_headline")
 
+@pytest.mark.usefixtures("cassette")
 def test_write_articles_headline():
     """
     Test the generate_headline function from graph_ops.
@@ -152,17 +166,21 @@ def test_save_articles():
     assert os.path.exists(filepath)
     os.remove(filepath)
 
-def test_notification():
+def test_notification(monkeypatch):
     """
     Test the notify_subscribers function from graph_ops for sending notifications.
     
     This test verifies if notifications are sent when there are news articles.
     It asserts that the notification state is set to "done".
     """
+    reset_fake_smtp(monkeypatch)
+    monkeypatch.setattr(graph_ops, "get_recipients", lambda: ["reader@example.com"])
+    monkeypatch.setenv("EMAIL_DELIVERY", "direct")
     state = {"news_file": test_data_specimen["news_file"], "news_num": 1}
     new_state = graph_ops.notify_subscribers(state)
     assert "notification" in new_state
     assert new_state["notification"] == "done"
+    assert [recipient for recipient, _ in FakeSMTP.delivered] == ["reader@example.com"]
 
 def test_notification_skip():
     """
@@ -176,6 +194,7 @@ def test_notification_skip():
     assert "notification" in new_state
     assert new_state["notification"] == "skipped"
 
+@pytest.mark.usefixtures("cassette")
 def test_loop():
     """
     Test the entire workflow graph.
@@ -200,3 +219,296 @@ def test_loop():
     new_state = graph.invoke({"article_drafts": test_data_specimen["article_drafts"]})
 
     assert(("articles" in new_state) and len(new_state["articles"]) == 1 and ("headline" in new_state["articles"][0]))
+
+def test_fetch_update_merges_pages_in_id_order(monkeypatch):
+    """
+    Test the fetch_update function from graph_ops with concurrently fetched pages.
+
+    This test checks that results are merged oldest page first, skipping opinions
+    older than the last processed one, whatever order the pages arrive in.
+    It asserts that the fetched opinions are sorted by ascending id.
+    """
+    def fake_get_content(url):
+        page = int(url.rsplit("=", 1)[1])
+        if page > 3:
+            return {"results": []}
+        # newest first within a page, page 1 holds the newest opinions
+        ids = [1000 - (page - 1) * 10 - i for i in range(10)]
+        return {"results": [{"id": id} for id in ids]}
+
+    monkeypatch.setattr(graph_ops, "get_content", fake_get_content)
+    monkeypatch.setenv("FETCH_MODE", "full")
+    new_state = graph_ops.fetch_update({"last_processed_id": 980})
+    ids = [opinion["id"] for opinion in new_state["opinions_to_check"]]
+    assert ids == list(range(981, 1001))
+    assert new_state["fetched_last_id"] == 1000
+
+def test_fetch_update_incremental_stops_at_last_processed_id(monkeypatch):
+    """
+    Test the fetch_update function from graph_ops in incremental mode.
+
+    This test checks that pages are walked newest first and paging stops at the
+    first page containing the last processed opinion.
+    It asserts that only the first window of pages is requested.
+    """
+    requested_pages = []
+
+    def fake_get_content(url):
+        page = int(url.rsplit("=", 1)[1])
+        requested_pages.append(page)
+        ids = [1000 - (page - 1) * 10 - i for i in range(10)]
+        return {"results": [{"id": id} for id in ids]}
+
+    monkeypatch.setattr(graph_ops, "get_content", fake_get_content)
+    monkeypatch.setenv("FETCH_MODE", "incremental")
+    monkeypatch.setenv("FETCH_CONCURRENCY", "2")
+    new_state = graph_ops.fetch_update({"last_processed_id": 985})
+    ids = [opinion["id"] for opinion in new_state["opinions_to_check"]]
+    assert ids == list(range(986, 1001))
+    assert sorted(requested_pages) == [1, 2]
+    assert new_state["fetched_last_id"] == 1000
+
+def test_fetch_update_replays_courtlistener(cassette, monkeypatch):
+    """
+    Test the fetch_update function from graph_ops against CourtListener result pages replayed from its cassette.
+
+    This test checks that pages are requested newest first through `get_content` until the
+    last processed opinion is crossed, and that the texts of the fetched opinions are offloaded.
+    It asserts that only the opinions newer than the last processed one are fetched, in id order.
+    """
+    monkeypatch.delenv("COURT_LISTENER_URL", raising=False)
+    monkeypatch.setenv("FETCH_MODE", "incremental")
+    monkeypatch.setenv("FETCH_INGESTION", "memory")
+    monkeypatch.setenv("FETCH_CONCURRENCY", "1")
+    requested = []
+    get_content = graph_ops.get_content
+    monkeypatch.setattr(graph_ops, "get_content", lambda url: requested.append(url) or get_content(url))
+    last_id = 9950991
+    new_state = graph_ops.fetch_update({"last_processed_id": last_id})
+    ids = [opinion["id"] for opinion in new_state["opinions_to_check"]]
+    assert ids and ids == sorted(ids) and min(ids) > last_id
+    assert new_state["fetched_last_id"] == ids[-1]
+    assert all("plain_text_ref" in opinion for opinion in new_state["opinions_to_check"])
+    if cassette is not None and cassette.mode == "replay":
+        assert ids == [9951656]
+        assert requested == [graph_ops.page_url(1), graph_ops.page_url(2)]
+
+@pytest.mark.parametrize("fetch_mode", ["full", "incremental"])
+def test_failed_page_stops_the_run_before_the_checkpoint(tmp_path, monkeypatch, fetch_mode):
+    """
+    Test that a result page failing, e.g. on HTTP 503, stops the run instead of ending paging,
+    so the checkpoint does not move past the opinions of the failed page.
+    """
+    def fake_get_content(url):
+        page = int(url.rsplit("=", 1)[1])
+        if page == 2:
+            return None
+        ids = [1000 - (page - 1) * 10 - i for i in range(10)] if page == 1 else []
+        return {"results": [{"id": id} for id in ids]}
+
+    state_file = tmp_path / "ingestion_state.json"
+    state_file.write_text(json.dumps({"last_processed_id": 900}))
+    monkeypatch.setattr(graph_ops, "get_content", fake_get_content)
+    monkeypatch.setenv("FETCH_STATE_FILE", str(state_file))
+    monkeypatch.setenv("FETCH_MODE", fetch_mode)
+    monkeypatch.setenv("FETCH_CONCURRENCY", "2")
+
+    with pytest.raises(graph_ops.PageFetchError, match="page=2"):
+        compile_workflow(build_workflow()).invoke({"last_processed_id": 900})
+    assert json.loads(state_file.read_text()) == {"last_processed_id": 900}
+
+def test_save_fetch_state(tmp_path, monkeypatch):
+    """
+    Test the save_fetch_state function from graph_ops.
+
+    This test checks that the new last processed id is written to the ingestion state file.
+    It asserts that the file content is updated and no temporary file is left behind.
+    """
+    state_file = tmp_path / "ingestion_state.json"
+    state_file.write_text(json.dumps({"last_processed_id": 10}))
+    monkeypatch.setenv("FETCH_STATE_FILE", str(state_file))
+    graph_ops.save_fetch_state({"last_processed_id": 10, "fetched_last_id": 42})
+    assert json.loads(state_file.read_text()) == {"last_processed_id": 42}
+    assert [p.name for p in tmp_path.iterdir()] == ["ingestion_state.json"]
+
+def assessment(score):
+    """
+    Build an editorial assessment giving the same score to every criterion of the assessment schema.
+    """
+    return {criterion: {"score": score, "comments": []}
+            for criterion in load_schema('schemas/article_assessment.json')["required"]}
+
+def test_find_news_leads_runs_calls_concurrently(monkeypatch):
+    """
+    Test the find_news_leads function from graph_ops with a concurrent fake LLM client.
+
+    This test checks that LLM calls overlap within the configured in-flight limit,
+    that outputs keep the input order and that a failing call only drops its own opinion.
+    It asserts that every other opinion is detected as newsworthy, in input order.
+    """
+    lock = threading.Lock()
+    in_flight = [0, 0]
+
+    def fake_llm(messages):
+        id = int(messages[1].content.split("#", 1)[1].split(":", 1)[0])
+        with lock:
+            in_flight[0] += 1
+            in_flight[1] = max(in_flight[1], in_flight[0])
+        time.sleep(0.05 if id % 2 else 0.01)
+        with lock:
+            in_flight[0] -= 1
+        if id == 3:
+            raise ValueError("LLM failure")
+        return AIMessage(content=json.dumps({"id": id, "newsworthy": "True", "influence": "Global", "reason": "", "labels": []}))
+
+    monkeypatch.setattr(graph_ops, "client", RunnableLambda(fake_llm))
+    monkeypatch.setenv("LLM_MAX_CONCURRENCY", "3")
+    opinions = [{"id": id, "resource_uri": "", "absolute_url": "", "download_url": "", "local_path": "",
+                 "date_created": "", "date_modified": "", "plain_text": "Supreme Court of the United States"}
+                for id in range(8)]
+    new_state = graph_ops.find_news_leads({"opinions_to_check": opinions})
+    assert [opinion["id"] for opinion in new_state["newsworthy_opinions"]] == [0, 1, 2, 4, 5, 6, 7]
+    assert 1 < in_flight[1] <= 3
+
+def test_loop_rewrites_only_failing_drafts(monkeypatch):
+    """
+    Test the editorial assessment / rewrite loop with a fake LLM client.
+
+    This test checks that a draft which passed assessment is neither rewritten nor
+    re-assessed, while a failing draft is rewritten and assessed again.
+    It asserts the number of LLM calls per draft and that both drafts get a headline.
+    """
+    calls = []
+
+    def fake_llm(messages):
+        sys_content, user_content = messages[0].content, messages[1].content
+        if "improve your news article" in sys_content:
+            calls.append(("rewrite", json.loads(user_content.split(":\n", 1)[1])["id"]))
+            return AIMessage(content=json.dumps({"id": 2, "rewritten_news_article": "better draft", "keywords": [{"keyword": "court"}]}))
+        if "assess a news articles" in sys_content:
+            draft = user_content.split("\n\n", 1)[1]
+            calls.append(("assess", draft))
+            score = 6 if draft == "weak draft" else 9
+            return AIMessage(content=json.dumps(assessment(score)))
+        return AIMessage(content=json.dumps({"headline": "Court rules"}))
+
+    monkeypatch.setattr(graph_ops, "client", RunnableLambda(fake_llm))
+    drafts = [{"id": id, "resource_uri": "https://www.courtlistener.com/api/rest/v3/opinions/1/", "absolute_url": f"/opinion/{id}/",
+               "date_created": "", "date_modified": "", "keypoints": [], "reason": "", "news_article": article,
+               "keywords": [{"keyword": "court"}]} for id, article in ((1, "strong draft"), (2, "weak draft"))]
+
+    workflow = StateGraph(GraphState)
+    workflow.add_node("editorial_assessment", graph_ops.editorial_assessment)
+    workflow.add_node("rewrite_articles_draft", graph_ops.rewrite_articles_draft)
+    workflow.add_node("generate_headline", graph_ops.generate_headline)
+    workflow.add_conditional_edges("editorial_assessment", graph_ops.should_continue)
+    workflow.add_edge("rewrite_articles_draft", "editorial_assessment")
+    workflow.add_edge(START, "editorial_assessment")
+    workflow.add_edge("generate_headline", END)
+    new_state = workflow.compile().invoke({"article_drafts": drafts, "best_article_drafts": {}})
+
+    assert sorted(calls, key=str) == sorted([("assess", "strong draft"), ("assess", "weak draft"),
+                                             ("rewrite", 2), ("assess", "better draft")], key=str)
+    assert len(new_state["articles"]) == 2
+    assert new_state["best_article_drafts"][2]["news_article"] == "better draft"
+
+def test_extract_keypoints_condenses_long_opinions(monkeypatch):
+    """
+    Test the extract_keypoints function from graph_ops with an opinion over the prompt token budget.
+
+    This test checks that the opinion is summarized chunk by chunk and that only the
+    condensed text, within the budget, is sent to the key points prompt.
+    It asserts that the key points prompt does not contain the full opinion text.
+    """
+    prompts = []
+
+    def fake_llm(messages):
+        user_content = messages[1].content
+        prompts.append(user_content)
+        if user_content.startswith("Here is part"):
+            return AIMessage(content=json.dumps({"summary": "summary of a part"}))
+        return AIMessage(content=json.dumps([{"text": "key point", "start_pos": 0, "end_pos": 9}]))
+
+    monkeypatch.setattr(graph_ops, "client", RunnableLambda(fake_llm))
+    monkeypatch.setenv("PROMPT_TOKEN_BUDGET", "200")
+    monkeypatch.setenv("SUMMARY_CHUNK_TOKENS", "100")
+    monkeypatch.setenv("SUMMARY_CHUNK_OVERLAP", "10")
+    opinion = {"id": 1, "resource_uri": "", "plain_text": "The Supreme Court reversed the judgment. " * 200}
+    new_state = graph_ops.extract_keypoints({"newsworthy_opinions": [opinion]})
+
+    keypoints_prompt = prompts[-1]
+    assert sum(prompt.startswith("Here is part") for prompt in prompts) > 1
+    assert "summary of a part" in keypoints_prompt and opinion["plain_text"] not in keypoints_prompt
+    assert new_state["opinions_with_keypoints"][0]["keypoints"] == [{"text": "key point", "start_pos": 0, "end_pos": 9}]
+
+def test_find_news_leads_reads_the_head_of_long_opinions(monkeypatch):
+    """
+    Test the find_news_leads function from graph_ops with an opinion over the prompt token budget.
+
+    This test checks that the newsworthiness prompt gets the head of the opinion within the budget,
+    without summarizing it, and that the lead keeps the full text for the key points stage.
+    """
+    prompts = []
+
+    def fake_llm(messages):
+        prompts.append(messages[1].content)
+        return AIMessage(content=json.dumps({"id": 1, "newsworthy": "True", "influence": "Global", "reason": "", "labels": []}))
+
+    monkeypatch.setattr(graph_ops, "client", RunnableLambda(fake_llm))
+    monkeypatch.setenv("PROMPT_TOKEN_BUDGET", "200")
+    opinion = {"id": 1, "resource_uri": "", "absolute_url": "", "download_url": "", "local_path": "",
+               "date_created": "", "date_modified": "", "plain_text": "The Supreme Court reversed the judgment. " * 200}
+    new_state = graph_ops.find_news_leads({"opinions_to_check": [opinion]})
+
+    assert len(prompts) == 1 and not prompts[0].startswith("Here is part")
+    assert opinion["plain_text"].startswith(prompts[0].split(":\n", 1)[1])
+    assert graph_ops.count_tokens(prompts[0].split(":\n", 1)[1]) <= 200
+    lead = new_state["newsworthy_opinions"][0]
+    assert "condensed_text" not in lead and graph_ops.blob_store.load_text(lead) == opinion["plain_text"]
+
+def test_llm_results_are_cached(monkeypatch):
+    """
+    Test the LLM result cache used by graph_ops nodes.
+
+    This test checks that a rerun of a node with the same inputs is served from the cache,
+    and that LLM_CACHE_BYPASS disables it.
+    It asserts the number of LLM calls.
+    """
+    calls = []
+
+    def fake_llm(messages):
+        calls.append(messages)
+        return AIMessage(content=json.dumps({"headline": "Court rules"}))
+
+    monkeypatch.setattr(graph_ops, "client", RunnableLambda(fake_llm))
+    drafts = [{"resource_uri": "https://www.courtlistener.com/api/rest/v3/opinions/1/", "absolute_url": "/opinion/1/",
+               "date_created": "", "date_modified": "", "keypoints": [], "reason": "", "news_article": "article",
+               "keywords": [{"keyword": "court"}]}]
+    graph_ops.generate_headline({"article_drafts": drafts})
+    new_state = graph_ops.generate_headline({"article_drafts": drafts})
+    assert len(calls) == 1 and new_state["articles"][0]["headline"] == "Court rules"
+
+    monkeypatch.setenv("LLM_CACHE_BYPASS", "1")
+    graph_ops.generate_headline({"article_drafts": drafts})
+    assert len(calls) == 2
+
+
+def test_notify_subscribers_sends_personalised_digests(tmp_path, monkeypatch):
+    """
+    Test that each group of subscribers gets one digest with only the articles matching their preferences.
+    """
+    preferences_file = tmp_path / "preferences.jsonl"
+    preferences_file.write_text(json.dumps({"email": "politics@example.com", "topics": ["politics"]}) + "\n")
+    monkeypatch.setenv("SUBSCRIPTIONS_PREFERENCES", str(preferences_file))
+    monkeypatch.setattr(graph_ops, "get_recipients", lambda: ["all@example.com", "politics@example.com"])
+    sent = []
+    monkeypatch.setattr(graph_ops, "send_email", lambda subject, html, txt, recipients: sent.append((txt, recipients)))
+
+    state = {"news_file": "tests/data/legal_news_materials_1.jsonl", "news_num": 4}
+    assert graph_ops.notify_subscribers(state) == {"notification": "done"}
+
+    digests = {tuple(recipients): txt for txt, recipients in sent}
+    assert set(digests) == {("all@example.com",), ("politics@example.com",)}
+    assert "Archirodon" in digests[("all@example.com",)]
+    assert "Colorado Ballot" in digests[("politics@example.com",)]
+    assert "Archirodon" not in digests[("politics@example.com",)]
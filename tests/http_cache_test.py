@@ -0,0 +1,117 @@
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from media_agents import http_client
+from media_agents.http_cache import ResponseCache
+
+
+class EtagHandler(BaseHTTPRequestHandler):
+    """
+    Serves a fixed JSON page with an ETag and answers 304 to matching conditional requests.
+    """
+    requests_seen = []
+
+    def do_GET(self):
+        self.requests_seen.append((self.path, self.headers.get('If-None-Match')))
+        if self.headers.get('If-None-Match') == '"v1"':
+            self.send_response(304)
+            self.end_headers()
+            return
+        body = json.dumps({"results": [{"id": 1}]}).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('ETag', '"v1"')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    EtagHandler.requests_seen = []
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), EtagHandler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{httpd.server_address[1]}"
+    httpd.shutdown()
+    http_client.set_cache(None)
+
+
+def test_cache_is_bounded_by_entries():
+    """
+    Test that the least recently used entry is evicted once the cache is full.
+    """
+    cache = ResponseCache(max_entries=2, ttl=60)
+    cache.store("a", "{}", None, None)
+    cache.store("b", "{}", None, None)
+    cache.lookup("a")
+    cache.store("c", "{}", None, None)
+    assert cache.lookup("b") == (None, False)
+    assert cache.lookup("a")[1] and cache.lookup("c")[1]
+
+
+def test_cache_entries_expire():
+    """
+    Test that entries older than the TTL are returned as stale.
+    """
+    cache = ResponseCache(max_entries=2, ttl=0.01)
+    cache.store("a", "{}", '"v1"', None)
+    time.sleep(0.02)
+    entry, fresh = cache.lookup("a")
+    assert entry["etag"] == '"v1"' and not fresh
+    assert cache.stats()["stale"] == 1
+
+
+def test_cache_persists_on_disk(tmp_path):
+    """
+    Test that entries stored by one cache are served by another cache sharing the directory.
+    """
+    ResponseCache(max_entries=2, ttl=60, cache_dir=str(tmp_path)).store("a", '{"x": 1}', None, None)
+    entry, fresh = ResponseCache(max_entries=2, ttl=60, cache_dir=str(tmp_path)).lookup("a")
+    assert fresh and json.loads(entry["body"]) == {"x": 1}
+
+
+def test_disk_entries_are_pruned_when_stored(tmp_path, monkeypatch):
+    """
+    Test that storing entries prunes the cache directory to its entry count and age limits,
+    dropping the oldest entries first.
+    """
+    monkeypatch.setattr(ResponseCache, "PRUNE_EVERY", 1)
+    cache = ResponseCache(max_entries=10, ttl=60, cache_dir=str(tmp_path), max_disk_entries=2, max_age=3600)
+    for i, url in enumerate(["a", "b", "c"]):
+        cache.store(url, "{}", None, None)
+        # distinct modification times, oldest first
+        os.utime(cache._entry_path(url), (time.time() - 100 + i, time.time() - 100 + i))
+    cache.store("d", "{}", None, None)
+    assert sorted(os.listdir(tmp_path)) == sorted(os.path.basename(cache._entry_path(url)) for url in ("c", "d"))
+
+    old = time.time() - 7200
+    os.utime(cache._entry_path("c"), (old, old))
+    cache.store("d", "{}", None, None)
+    assert os.listdir(tmp_path) == [os.path.basename(cache._entry_path("d"))]
+
+
+def test_get_json_serves_fresh_and_revalidates_stale(server):
+    """
+    Test that get_json serves fresh responses from the cache and revalidates
+    stale ones with If-None-Match.
+    """
+    cache = ResponseCache(max_entries=8, ttl=60)
+    http_client.set_cache(cache)
+    url = server + "/opinions/?page=1"
+    assert http_client.get_json(url) == {"results": [{"id": 1}]}
+    assert http_client.get_json(url) == {"results": [{"id": 1}]}
+    assert len(EtagHandler.requests_seen) == 1
+
+    cache.ttl = 0
+    assert http_client.get_json(url) == {"results": [{"id": 1}]}
+    assert EtagHandler.requests_seen[-1] == ("/opinions/?page=1", '"v1"')
+    assert cache.stats()["hits"] == 1 and cache.stats()["revalidations"] == 1
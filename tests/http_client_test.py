@@ -0,0 +1,55 @@
+import time
+import threading
+from media_agents import http_client
+
+
+def test_fetch_all_preserves_order():
+    """
+    Test that fetch_all returns contents in the order of the requested URLs,
+    even when later requests complete first.
+    """
+    urls = [f"https://example.com/?page={page}" for page in range(10, 0, -1)]
+
+    def fetch(url):
+        page = int(url.rsplit("=", 1)[1])
+        time.sleep(0.001 * page)
+        return {"page": page}
+
+    pages = http_client.fetch_all(urls, fetch, max_workers=4)
+    assert [p["page"] for p in pages] == list(range(10, 0, -1))
+
+
+def test_fetch_all_limits_concurrency():
+    """
+    Test that no more than max_workers requests are in flight at once.
+    """
+    lock = threading.Lock()
+    in_flight = [0, 0]
+
+    def fetch(url):
+        with lock:
+            in_flight[0] += 1
+            in_flight[1] = max(in_flight[1], in_flight[0])
+        time.sleep(0.01)
+        with lock:
+            in_flight[0] -= 1
+        return {}
+
+    http_client.fetch_all([str(i) for i in range(12)], fetch, max_workers=3)
+    assert in_flight[1] <= 3
+
+
+def test_rate_limiter_spaces_requests_per_host():
+    """
+    Test that requests to the same host are spaced by the rate limit interval,
+    while other hosts are not delayed.
+    """
+    limiter = http_client.RateLimiter(50)
+    start = time.monotonic()
+    for _ in range(5):
+        limiter.wait("a.example.com")
+    assert time.monotonic() - start >= 4 * 0.02 * 0.9
+
+    start = time.monotonic()
+    limiter.wait("b.example.com")
+    assert time.monotonic() - start < 0.02
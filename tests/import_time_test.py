@@ -0,0 +1,28 @@
+import json
+import os
+import subprocess
+import sys
+
+# Import time budget of the CLI in seconds, generous enough for slow CI machines
+IMPORT_TIME_BUDGET = 3.0
+
+PROVIDER_MODULES = ["langchain_openai", "langchain_groq", "langchain_fireworks", "openai", "groq", "fireworks"]
+
+
+def test_cli_import_is_lazy_and_within_budget():
+    """
+    Test that importing the CLI in a bare environment (no .env, API keys nor SMTP settings) succeeds
+    without importing any LLM provider SDK, and within the import time budget.
+    """
+    code = ("import json, sys, time\n"
+            "start = time.perf_counter()\n"
+            "import media_agents.cli\n"
+            "elapsed = time.perf_counter() - start\n"
+            f"print(json.dumps({{'elapsed': elapsed, 'providers': [m for m in {PROVIDER_MODULES!r} if m in sys.modules]}}))\n")
+    env = {key: value for key, value in os.environ.items()
+           if key in ("PATH", "HOME", "PYTHONPATH", "VIRTUAL_ENV")}
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, env=env, check=True)
+
+    measure = json.loads(result.stdout.strip().splitlines()[-1])
+    assert measure["providers"] == []
+    assert measure["elapsed"] < IMPORT_TIME_BUDGET
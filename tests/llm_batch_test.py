@@ -0,0 +1,151 @@
+import json
+
+import pytest
+from langchain_core.messages import HumanMessage, SystemMessage
+from langchain_core.runnables import RunnableLambda
+
+from media_agents import graph_ops, llm_batch
+from media_agents.cli import BATCH_PENDING_EXIT_CODE, parse_args, run
+from media_agents.llm_batch import BatchFailed, BatchPending, BatchRunner, LocalBatchBackend
+from media_agents.structured_output import StructuredOutputError
+from tests.fakes import fake_llm
+
+SCHEMA = {"type": "object", "properties": {"headline": {"type": "string"}}, "required": ["headline"]}
+
+
+def respond(body):
+    """
+    Answer a batch request with the stage-aware fake LLM.
+    """
+    messages = [SystemMessage(content=body["messages"][0]["content"]),
+                HumanMessage(content=body["messages"][1]["content"])]
+    return fake_llm(messages).content
+
+
+@pytest.fixture
+def batch_runner(tmp_path):
+    calls = []
+
+    def counting_respond(body):
+        calls.append(body)
+        return respond(body)
+
+    runner = BatchRunner(str(tmp_path / "batches"), LocalBatchBackend(counting_respond))
+    runner.calls = calls
+    llm_batch.set_runner(runner)
+    yield runner
+    llm_batch.set_runner(None)
+
+
+def test_runner_submits_once_and_returns_results_when_completed(tmp_path):
+    """
+    Test that a stage batch is submitted on first use, reported pending while in progress,
+    and that its results are parsed and validated once completed.
+    """
+    backend = LocalBatchBackend(lambda body: '{"headline": "Court rules"}' if "1" in body["messages"][1]["content"]
+                                else '{"title": "missing headline"}', polls=1)
+    runner = BatchRunner(str(tmp_path), backend)
+    args = ("headline", "gpt-4o-mini", "Write a headline as json", ["article 1", "article 2"], 0.7, SCHEMA)
+
+    with pytest.raises(BatchPending) as pending:
+        runner.run(*args)
+    assert pending.value.status == "submitted"
+    with pytest.raises(BatchPending) as pending:
+        runner.run(*args)
+    assert pending.value.status == "in_progress"
+
+    outputs = runner.run(*args)
+
+    assert outputs[0] == {"headline": "Court rules"}
+    assert isinstance(outputs[1], StructuredOutputError)
+    assert len(backend.batches) == 1
+    request = json.loads((tmp_path / f"{llm_batch.batch_key(*args[:5])}.requests.jsonl").read_text().splitlines()[0])
+    assert request["body"]["response_format"] == {"type": "json_object"}
+    # results are kept locally, the backend is not polled again
+    assert runner.run(*args)[0] == outputs[0]
+    assert backend.batches["local-batch-1"]["polls"] == 2
+
+
+def test_failed_batch_is_submitted_again(tmp_path):
+    """
+    Test that a batch failed by the provider is forgotten, so the next run submits it again.
+    """
+    backend = LocalBatchBackend(lambda body: '{"headline": "Court rules"}', polls=0)
+    backend.status = lambda batch_id: "expired" if batch_id == "local-batch-1" else llm_batch.COMPLETED
+    runner = BatchRunner(str(tmp_path), backend)
+    args = ("headline", "gpt-4o-mini", "Write a headline as json", ["article"], None, SCHEMA)
+
+    with pytest.raises(BatchPending):
+        runner.run(*args)
+    with pytest.raises(BatchFailed):
+        runner.run(*args)
+    with pytest.raises(BatchPending) as pending:
+        runner.run(*args)
+
+    assert pending.value.batch_id == "local-batch-2"
+    assert runner.run(*args) == [{"headline": "Court rules"}]
+
+
+def test_stages_of_other_providers_are_not_batched(tmp_path, monkeypatch):
+    """
+    Test that in batch mode the calls of a model without batch API are made directly.
+    """
+    backend = LocalBatchBackend(respond, providers=("openai",))
+    llm_batch.set_runner(BatchRunner(str(tmp_path), backend))
+    monkeypatch.setattr(graph_ops, "client", RunnableLambda(fake_llm))
+    monkeypatch.setenv("LLM_MODE", "batch")
+    try:
+        outputs = graph_ops.invoke_stage("You create a news headlines", ["article"], stage="headline")
+    finally:
+        llm_batch.set_runner(None)
+
+    assert outputs == [{"headline": "Court rules"}]
+    assert backend.batches == {}
+
+
+def test_batch_run_resumes_stage_by_stage(tmp_path, monkeypatch, batch_runner):
+    """
+    Test a batch mode run end to end with the local batch backend.
+
+    This test checks that the run exits at every pending stage batch, that resuming the run
+    feeds the batch results to the next stage, and that no LLM call is made outside batches.
+    """
+    opinion = {"id": 1, "resource_uri": "https://www.courtlistener.com/api/rest/v3/opinions/1/",
+               "absolute_url": "/opinion/1/", "download_url": "", "local_path": "",
+               "date_created": "2024-03-15T08:02:22", "date_modified": "2024-03-15T08:02:22",
+               "plain_text": "SUPREME COURT OF THE UNITED STATES"}
+    state_file = tmp_path / "ingestion_state.json"
+    state_file.write_text(json.dumps({"last_processed_id": 0}))
+    sent = []
+
+    def sync_llm(messages):
+        raise AssertionError("LLM called outside a batch")
+
+    monkeypatch.setattr(graph_ops, "client", RunnableLambda(sync_llm))
+    monkeypatch.setattr(graph_ops, "get_content",
+                        lambda url: {"results": [opinion]} if url.endswith("page=1") else {"results": []})
+    monkeypatch.setattr(graph_ops, "get_recipients", lambda: ["reader@example.com"])
+    monkeypatch.setattr(graph_ops, "send_email", lambda *args: sent.append(args))
+    monkeypatch.setenv("FETCH_STATE_FILE", str(state_file))
+    monkeypatch.setenv("OUTPUT_DIR", str(tmp_path))
+    monkeypatch.setenv("PREFILTER_SCORERS", "keywords")
+    monkeypatch.setenv("LLM_MODE", "sync")
+    checkpoint_db = str(tmp_path / "checkpoints.sqlite")
+
+    with pytest.raises(SystemExit) as exit:
+        run(parse_args(["--batch", "--run-id", "backfill", "--checkpoint-db", checkpoint_db]))
+    assert exit.value.code == BATCH_PENDING_EXIT_CODE
+
+    final_state = None
+    for _ in range(20):
+        try:
+            final_state = run(parse_args(["--batch", "--resume", "backfill", "--checkpoint-db", checkpoint_db]))
+            break
+        except SystemExit as ex:
+            assert ex.code == BATCH_PENDING_EXIT_CODE
+
+    assert final_state is not None and final_state["notification"] == "done"
+    assert len(sent) == 1 and "Court rules" in sent[0][2]
+    # newsworthiness, keypoints, draft, assessment and headline batches
+    assert len(batch_runner.backend.batches) == 5 and len(batch_runner.calls) == 5
+    assert json.loads(state_file.read_text()) == {"last_processed_id": 1}
@@ -0,0 +1,46 @@
+from media_agents.llm_cache import LLMCache, make_key
+
+
+def test_key_depends_on_every_part():
+    """
+    Test that model, system message, user message and temperature all change the cache key.
+    """
+    key = make_key("gpt-4-turbo", "system", "user", 0.7)
+    assert key == make_key("gpt-4-turbo", "system", "user", 0.7)
+    assert len({key, make_key("gpt-4o", "system", "user", 0.7), make_key("gpt-4-turbo", "other", "user", 0.7),
+                make_key("gpt-4-turbo", "system", "other", 0.7), make_key("gpt-4-turbo", "system", "user", 0.0)}) == 5
+
+
+def test_results_persist_across_instances(tmp_path):
+    """
+    Test that results stored by one cache are served by another cache on the same file.
+    """
+    path = str(tmp_path / "cache.sqlite")
+    cache = LLMCache(path, max_entries=10)
+    cache.put("k", {"headline": "Court rules"})
+    cache.close()
+    cache = LLMCache(path, max_entries=10)
+    assert cache.get("k") == {"headline": "Court rules"}
+    assert cache.get("missing") is None
+    assert cache.stats() == {"hits": 1, "misses": 1}
+
+
+def test_eviction_keeps_recently_used(tmp_path):
+    """
+    Test that eviction drops the least recently used entries over the size bound.
+    """
+    cache = LLMCache(str(tmp_path / "cache.sqlite"), max_entries=2)
+    for key in ("a", "b", "c"):
+        cache.put(key, key)
+    cache.get("a")
+    cache.evict()
+    assert len(cache) == 2 and cache.get("a") == "a" and cache.get("b") is None
+
+
+def test_expired_entries_are_misses(tmp_path):
+    """
+    Test that entries older than the TTL are not served.
+    """
+    cache = LLMCache(str(tmp_path / "cache.sqlite"), max_entries=2, ttl=1)
+    cache._conn.execute("INSERT INTO llm_results VALUES ('old', '1', 0, 0)")
+    assert cache.get("old") is None
@@ -0,0 +1,107 @@
+import json
+from contextlib import contextmanager
+
+import pytest
+from langchain_core.messages import AIMessage
+from langchain_core.runnables import RunnableLambda
+
+from media_agents import graph_ops, llm_cache, llm_executor, llm_router
+from media_agents.llm_router import LLMRouter, is_retryable, parse_model
+
+
+class RateLimitError(Exception):
+    pass
+
+
+def fake_model(answer=None, error=None):
+    def invoke(messages):
+        if error is not None:
+            raise error
+        return AIMessage(content=answer, usage_metadata={"input_tokens": 1000, "output_tokens": 100,
+                                                         "total_tokens": 1100})
+    return RunnableLambda(invoke)
+
+
+def test_models_for_stage(monkeypatch):
+    """
+    Test that a stage uses its own model when configured, else the default model, followed by its fallbacks.
+    """
+    monkeypatch.setenv("LLM_CLIENT", "gpt-4-turbo")
+    monkeypatch.setenv("LLM_CLIENT_NEWSWORTHINESS", "gpt-4o-mini")
+    monkeypatch.setenv("LLM_FALLBACK", "groq:llama3-70b-8192, gpt-4-turbo")
+    router = LLMRouter()
+
+    assert router.models_for_stage("newsworthiness") == ["gpt-4o-mini", "groq:llama3-70b-8192", "gpt-4-turbo"]
+    assert router.models_for_stage("draft") == ["gpt-4-turbo", "groq:llama3-70b-8192"]
+    assert parse_model("groq:llama3-70b-8192") == ("groq", "llama3-70b-8192")
+    assert parse_model("accounts/fireworks/models/llama-v3p1-405b-instruct")[0] == "fireworks"
+    assert parse_model("gpt-4o-mini") == ("openai", "gpt-4o-mini")
+
+
+def test_route_falls_back_on_rate_limit_and_tracks_stats(monkeypatch):
+    """
+    Test that a rate limited call is retried on the fallback model, and that latency,
+    tokens and cost are tracked per provider.
+    """
+    models = {"gpt-4o-mini": fake_model(error=RateLimitError("429")),
+              "groq:llama3-70b-8192": fake_model(answer="ok")}
+    monkeypatch.setattr(llm_router, "create_model", lambda model: models[model])
+    monkeypatch.setenv("LLM_CLIENT_HEADLINE", "gpt-4o-mini")
+    monkeypatch.setenv("LLM_FALLBACK_HEADLINE", "groq:llama3-70b-8192")
+    router = LLMRouter()
+
+    route = router.route("headline")
+
+    assert route.invoke("prompt").content == "ok"
+    assert route.model_name == "gpt-4o-mini" and route.provider == "openai"
+    stats = router.stats.snapshot()
+    assert stats["openai"]["failures"] == 1
+    assert stats["groq"]["fallbacks"] == 1 and stats["groq"]["input_tokens"] == 1000
+    assert stats["groq"]["cost"] == pytest.approx((1000 * 0.59 + 100 * 0.79) / 1e6)
+
+
+def test_route_does_not_fall_back_on_other_errors(monkeypatch):
+    """
+    Test that errors other than rate limits and timeouts are raised without trying the fallback model.
+    """
+    models = {"gpt-4o-mini": fake_model(error=ValueError("bad request")), "gpt-4-turbo": fake_model(answer="ok")}
+    monkeypatch.setattr(llm_router, "create_model", lambda model: models[model])
+    monkeypatch.setenv("LLM_CLIENT", "gpt-4o-mini")
+    monkeypatch.setenv("LLM_FALLBACK", "gpt-4-turbo")
+
+    with pytest.raises(ValueError):
+        LLMRouter().route("draft").invoke("prompt")
+    assert is_retryable(TimeoutError()) and not is_retryable(ValueError())
+
+
+def test_fallback_holds_its_provider_slot_and_caches_under_its_model(monkeypatch):
+    """
+    Test that a fallback call holds a slot of the fallback provider, not of the primary one,
+    and that its result is cached under the fallback model, then found again on the next run.
+    """
+    held = []
+
+    @contextmanager
+    def semaphore(provider):
+        held.append(provider)
+        yield
+
+    answer = json.dumps({"newsworthy": True})
+    models = {"gpt-4o-mini": fake_model(error=RateLimitError("429")),
+              "groq:llama3-70b-8192": fake_model(answer=answer)}
+    monkeypatch.setattr(llm_router, "create_model", lambda model: models[model])
+    monkeypatch.setattr(llm_executor, "get_provider_semaphore", semaphore)
+    monkeypatch.setenv("LLM_CLIENT", "gpt-4o-mini")
+    monkeypatch.setenv("LLM_FALLBACK", "groq:llama3-70b-8192")
+    route = LLMRouter().route("draft")
+    monkeypatch.setattr(graph_ops, "get_client", lambda stage=None: route)
+
+    assert graph_ops.invoke_stage("system", ["opinion"]) == [{"newsworthy": True}]
+    assert held == ["openai", "groq"]
+    cache = llm_cache.get_cache()
+    assert cache.get(llm_cache.make_key("llama3-70b-8192", "system", "opinion", None)) == {"newsworthy": True}
+    assert cache.get(llm_cache.make_key("gpt-4o-mini", "system", "opinion", None)) is None
+
+    held.clear()
+    assert graph_ops.invoke_stage("system", ["opinion"]) == [{"newsworthy": True}]
+    assert held == []
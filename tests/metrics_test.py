@@ -0,0 +1,98 @@
+import json
+import time
+import urllib.request
+
+import pytest
+from langchain_core.runnables import RunnableLambda
+
+from media_agents import graph_ops
+from media_agents.cli import parse_args, run
+from media_agents.metrics import Metrics, metrics, start_http_server, timed_node
+from tests.fakes import fake_llm
+
+
+def test_histograms_counters_and_prometheus_text():
+    """
+    Test that observations land in the right buckets, quantiles are estimated from the buckets,
+    and that counters and histograms are exported in the Prometheus text format.
+    """
+    registry = Metrics()
+    for latency in (0.02, 0.03, 0.2, 4.0):
+        registry.observe("llm_call_seconds", latency, provider="openai")
+    registry.inc("llm_tokens_total", 120, provider="openai", direction="input")
+    registry.inc("llm_tokens_total", 30, provider="openai", direction="input")
+
+    snapshot = registry.snapshot()
+    histogram = snapshot["histograms"]['llm_call_seconds{provider="openai"}']
+    assert histogram["count"] == 4 and histogram["max"] == 4.0
+    assert histogram["p50"] == 0.05 and histogram["p95"] == 4.0
+    assert snapshot["counters"]['llm_tokens_total{direction="input",provider="openai"}'] == 150
+
+    text = registry.to_prometheus()
+    assert 'llm_call_seconds_bucket{le="0.05",provider="openai"} 2' in text
+    assert 'llm_call_seconds_bucket{le="+Inf",provider="openai"} 4' in text
+    assert 'llm_call_seconds_count{provider="openai"} 4' in text
+
+
+def test_timed_node_records_failures():
+    """
+    Test that the wall time of a node is recorded with its outcome, including when it raises.
+    """
+    def failing_node(state):
+        raise ValueError("boom")
+
+    metrics.reset()
+    timed_node("slow", lambda state: time.sleep(0.01) or {})({})
+    with pytest.raises(ValueError):
+        timed_node("failing", failing_node)({})
+
+    histograms = metrics.snapshot()["histograms"]
+    assert histograms['node_seconds{node="slow",outcome="ok"}']["sum"] >= 0.01
+    assert histograms['node_seconds{node="failing",outcome="ValueError"}']["count"] == 1
+
+
+def test_metrics_endpoint():
+    """
+    Test that the metrics are served on /metrics.
+    """
+    metrics.reset()
+    metrics.inc("emails_total", 3, outcome="sent")
+    server = start_http_server(0, "127.0.0.1")
+    try:
+        url = f"http://127.0.0.1:{server.server_address[1]}/metrics"
+        with urllib.request.urlopen(url, timeout=5) as response:
+            assert 'emails_total{outcome="sent"} 3' in response.read().decode('utf-8')
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_run_writes_summary(tmp_path, monkeypatch):
+    """
+    Test that a run writes its summary with the wall time of every node and the LLM calls and cache hits.
+    """
+    opinion = {"id": 1, "resource_uri": "https://www.courtlistener.com/api/rest/v3/opinions/1/",
+               "absolute_url": "/opinion/1/", "download_url": "", "local_path": "",
+               "date_created": "2024-03-15T08:02:22", "date_modified": "2024-03-15T08:02:22",
+               "plain_text": "SUPREME COURT OF THE UNITED STATES"}
+    state_file = tmp_path / "ingestion_state.json"
+    state_file.write_text(json.dumps({"last_processed_id": 0}))
+    monkeypatch.setattr(graph_ops, "client", RunnableLambda(fake_llm))
+    monkeypatch.setattr(graph_ops, "get_content",
+                        lambda url: {"results": [opinion]} if url.endswith("page=1") else {"results": []})
+    monkeypatch.setattr(graph_ops, "get_recipients", lambda: ["reader@example.com"])
+    monkeypatch.setattr(graph_ops, "send_email", lambda *args: None)
+    monkeypatch.setenv("FETCH_STATE_FILE", str(state_file))
+    monkeypatch.setenv("OUTPUT_DIR", str(tmp_path))
+    monkeypatch.setenv("PREFILTER_SCORERS", "keywords")
+
+    run(parse_args(["--run-id", "measured", "--checkpoint-db", str(tmp_path / "checkpoints.sqlite")]))
+
+    summary = json.loads((tmp_path / "run_summary_measured.json").read_text())
+    assert summary["run_id"] == "measured" and summary["status"] == "completed"
+    nodes = [series for series in summary["histograms"] if series.startswith("node_seconds")]
+    assert 'node_seconds{node="fetch_update",outcome="ok"}' in nodes
+    assert 'node_seconds{node="notify_subscribers",outcome="ok"}' in nodes
+    assert summary["histograms"]['llm_call_seconds{outcome="ok",provider="runnablelambda"}']["count"] == 5
+    assert summary["counters"]['llm_stage_calls_total{stage="headline"}'] == 1
+    assert summary["counters"]['llm_cache_hits_total{stage="headline"}'] == 0
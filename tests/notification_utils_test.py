@@ -0,0 +1,30 @@
+from media_agents.notification_utils import send_email
+from tests.fakes import FakeSMTP, reset_fake_smtp
+
+
+def test_send_email_reuses_sessions(monkeypatch):
+    """
+    Test that the newsletter is serialized once and delivered over one session per pool slot.
+    """
+    reset_fake_smtp(monkeypatch)
+    recipients = [f"reader{i}@example.com" for i in range(10)]
+
+    report = send_email("subject", "<p>html</p>", "text", recipients, pool_size=2)
+
+    assert sorted(report["sent"]) == sorted(recipients) and report["failed"] == {}
+    assert FakeSMTP.connections == 2
+    assert len({id(payload) for _, payload in FakeSMTP.delivered}) == 1
+
+
+def test_send_email_reconnects_and_reports_failures(monkeypatch):
+    """
+    Test that a dropped connection is reopened and that refused recipients are reported.
+    """
+    reset_fake_smtp(monkeypatch, drop_after=3, refused={"reader4@example.com"})
+    recipients = [f"reader{i}@example.com" for i in range(8)]
+
+    report = send_email("subject", "<p>html</p>", "text", recipients, pool_size=1)
+
+    assert report["sent"] == [r for r in recipients if r != "reader4@example.com"]
+    assert list(report["failed"]) == ["reader4@example.com"]
+    assert FakeSMTP.connections == 3
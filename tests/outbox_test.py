@@ -0,0 +1,140 @@
+import os
+import socket
+import time
+
+import pytest
+
+from media_agents import notification_utils
+from media_agents.outbox import Outbox, drain, run_worker
+from tests.fakes import FakeSMTP, reset_fake_smtp
+
+
+def test_drain_delivers_and_acks(tmp_path, monkeypatch):
+    """
+    Test that a queued newsletter is delivered to every recipient and removed from the queue.
+    """
+    reset_fake_smtp(monkeypatch)
+    outbox = Outbox(str(tmp_path))
+    outbox.enqueue("subject", "<p>html</p>", "text", ["a@example.com", "b@example.com"])
+
+    assert drain(outbox) == 1
+    assert sorted(r for r, _ in FakeSMTP.delivered) == ["a@example.com", "b@example.com"]
+    assert outbox.size() == {"pending": 0, "processing": 0, "dead": 0}
+
+
+def test_drain_retries_failed_recipients_with_backoff(tmp_path, monkeypatch):
+    """
+    Test that only failed recipients are requeued, and not before the backoff delay.
+    """
+    reset_fake_smtp(monkeypatch, refused={"b@example.com"})
+    monkeypatch.setenv("OUTBOX_BACKOFF_BASE", "100")
+    outbox = Outbox(str(tmp_path))
+    outbox.enqueue("subject", "<p>html</p>", "text", ["a@example.com", "b@example.com"])
+
+    assert drain(outbox) == 1
+    assert [r for r, _ in FakeSMTP.delivered] == ["a@example.com"]
+    assert outbox.claim() is None
+    message = outbox.claim(now=time.time() + 100)
+    assert message["recipients"] == ["b@example.com"] and message["attempts"] == 1
+    assert list(message["errors"]) == ["b@example.com"]
+
+
+def test_drain_dead_letters_after_max_attempts(tmp_path, monkeypatch):
+    """
+    Test that a message still failing after the max number of attempts is dead-lettered.
+    """
+    reset_fake_smtp(monkeypatch, refused={"b@example.com"})
+    monkeypatch.setenv("OUTBOX_MAX_ATTEMPTS", "3")
+    monkeypatch.setenv("OUTBOX_BACKOFF_BASE", "0")
+    outbox = Outbox(str(tmp_path))
+    outbox.enqueue("subject", "<p>html</p>", "text", ["a@example.com", "b@example.com"])
+
+    assert drain(outbox) == 3
+    assert [r for r, _ in FakeSMTP.delivered] == ["a@example.com"]
+    assert outbox.size() == {"pending": 0, "processing": 0, "dead": 1}
+
+
+def test_worker_recovers_interrupted_messages(tmp_path, monkeypatch):
+    """
+    Test that a message claimed by a crashed worker is delivered by the next one once the claim is stale,
+    and that a recent claim, maybe of a live worker, is kept.
+    """
+    reset_fake_smtp(monkeypatch)
+    outbox = Outbox(str(tmp_path))
+    outbox.enqueue("subject", "<p>html</p>", "text", ["a@example.com"])
+    assert outbox.claim() is not None
+
+    run_worker(outbox, once=True)
+    assert FakeSMTP.delivered == [] and outbox.size()["processing"] == 1
+
+    monkeypatch.setenv("OUTBOX_CLAIM_TIMEOUT", "0")
+    run_worker(outbox, once=True)
+
+    assert [r for r, _ in FakeSMTP.delivered] == ["a@example.com"]
+    assert outbox.size() == {"pending": 0, "processing": 0, "dead": 0}
+
+
+def test_long_delivery_refreshes_its_claim(tmp_path, monkeypatch):
+    """
+    Test that the claim of a message is refreshed after each recipient batch, so a delivery outliving
+    OUTBOX_CLAIM_TIMEOUT is not recovered, and sent again, while in flight.
+    """
+    reset_fake_smtp(monkeypatch)
+    monkeypatch.setenv("OUTBOX_BATCH_SIZE", "2")
+    outbox = Outbox(str(tmp_path))
+    message_id = outbox.enqueue("subject", "<p>html</p>", "text", [f"reader{i}@example.com" for i in range(5)])
+    send_email = notification_utils.send_email
+    recovered = []
+
+    def slow_send_email(*args, **kwargs):
+        recovered.append(outbox.recover(600))
+        report = send_email(*args, **kwargs)
+        # each batch takes 400s, the whole delivery longer than the claim timeout
+        path = os.path.join(outbox.processing_dir, message_id + '.json')
+        claimed_at = os.path.getmtime(path) - 400
+        os.utime(path, (claimed_at, claimed_at))
+        return report
+
+    monkeypatch.setattr(notification_utils, "send_email", slow_send_email)
+
+    assert drain(outbox) == 1
+    assert recovered == [0, 0, 0] and len(FakeSMTP.delivered) == 5
+    assert outbox.size() == {"pending": 0, "processing": 0, "dead": 0}
+
+
+def test_worker_delivers_to_local_smtp_server(tmp_path, monkeypatch):
+    """
+    Test the outbox worker against a local aiosmtpd server.
+    """
+    aiosmtpd_controller = pytest.importorskip("aiosmtpd.controller")
+    from aiosmtpd.handlers import Sink
+
+    class Recorder(Sink):
+        def __init__(self):
+            self.envelopes = []
+
+        async def handle_DATA(self, server, session, envelope):
+            self.envelopes.append(envelope)
+            return '250 OK'
+
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    handler = Recorder()
+    controller = aiosmtpd_controller.Controller(handler, hostname="127.0.0.1", port=port)
+    controller.start()
+    try:
+        monkeypatch.setenv("SMTP_SERVER", "127.0.0.1")
+        monkeypatch.setenv("SMTP_PORT_SSL", str(port))
+        monkeypatch.setenv("SMTP_USER", "news@example.com")
+        monkeypatch.setenv("SMTP_PASSWORD", "")
+        monkeypatch.setenv("SMTP_SECURITY", "plain")
+        outbox = Outbox(str(tmp_path))
+        outbox.enqueue("subject", "<p>html</p>", "text", ["a@example.com", "b@example.com"])
+
+        run_worker(outbox, once=True)
+    finally:
+        controller.stop()
+
+    assert sorted(e.rcpt_tos[0] for e in handler.envelopes) == ["a@example.com", "b@example.com"]
+    assert outbox.size() == {"pending": 0, "processing": 0, "dead": 0}
@@ -0,0 +1,57 @@
+import json
+
+from media_agents import prefilter
+
+
+def load_opinion():
+    with open("tests/data/opinion1.json", "r") as fh:
+        return json.load(fh)
+
+
+def make_opinion(id, plain_text, **fields):
+    opinion = {"id": id, "plain_text": plain_text, "type": "010combined", "opinions_cited": [], "download_url": ""}
+    opinion.update(fields)
+    return opinion
+
+
+def test_keyword_score_requires_supreme_court():
+    """
+    Test that opinions not mentioning a supreme court are dropped by the keyword scorer.
+    """
+    assert prefilter.keyword_score(make_opinion(1, "The district court affirmed the judgment.")) is None
+    assert prefilter.keyword_score(make_opinion(2, "The Supreme Court held the statute unconstitutional.")) == 2.0
+
+
+def test_length_score_drops_short_opinions():
+    """
+    Test that opinions shorter than the minimum length are dropped.
+    """
+    assert prefilter.length_score(make_opinion(1, "Supreme Court. Affirmed.")) is None
+    assert prefilter.length_score(load_opinion()) == 0.0
+
+
+def test_prefilter_ranks_and_keeps_top_k():
+    """
+    Test that the pre-filter ranks opinions by total score, keeps the top K and
+    returns them in their original order.
+    """
+    lead = load_opinion()
+    routine = make_opinion(2, "Supreme Court of Ohio. Memorandum. The sentencing order is affirmed. " * 40,
+                           type="040dissent")
+    other = make_opinion(3, "Supreme Court. The First Amendment claim fails and the judgment is reversed. " * 40)
+    unrelated = make_opinion(4, "The appeal is dismissed. " * 100)
+    opinions = [routine, lead, other, unrelated]
+    scorers = ["length", "keywords", "metadata", "terms"]
+
+    assert [o["id"] for o in prefilter.prefilter(opinions, scorers, top_k=0)] == [2, lead["id"], 3]
+    assert [o["id"] for o in prefilter.prefilter(opinions, scorers, top_k=2)] == [lead["id"], 3]
+    assert [o["id"] for o in prefilter.prefilter(opinions, scorers, top_k=0, min_score=0.0)] == [lead["id"], 3]
+
+
+def test_register_scorer(monkeypatch):
+    """
+    Test that custom scorers can be plugged in by name.
+    """
+    monkeypatch.setitem(prefilter.SCORERS, "even_ids", lambda opinion: None if opinion["id"] % 2 else 1.0)
+    opinions = [make_opinion(id, "") for id in range(4)]
+    assert [o["id"] for o in prefilter.prefilter(opinions, ["even_ids"], top_k=0)] == [0, 2]
@@ -0,0 +1,90 @@
+import json
+
+import pytest
+
+from langchain_core.runnables import RunnableLambda
+
+from media_agents import graph_ops
+from media_agents.graph_description import build_workflow, compile_workflow
+from media_agents.spool import OpinionSpool
+from tests.fakes import fake_llm
+
+
+def make_opinion(id):
+    return {"id": id, "resource_uri": f"https://www.courtlistener.com/api/rest/v3/opinions/{id}/",
+            "absolute_url": f"/opinion/{id}/", "download_url": "", "local_path": "",
+            "date_created": "2024-03-15T08:02:22", "date_modified": "2024-03-15T08:02:22",
+            "plain_text": f"SUPREME COURT OF THE UNITED STATES\nDocket No. {id}",
+            "html_with_citations": "<pre>SUPREME COURT OF THE UNITED STATES</pre>"}
+
+
+def test_spool_iterates_by_id_while_updated(tmp_path):
+    """
+    Test that staged opinions are compacted, iterated by ascending id across read batches,
+    and that discarding or updating opinions during the iteration is safe.
+    """
+    spool = OpinionSpool.create(str(tmp_path))
+    spool.READ_BATCH = 2
+    spool.add([make_opinion(id) for id in (5, 3, 1, 4, 2)])
+    spool.add([make_opinion(3)])
+
+    seen = []
+    for opinion in spool:
+        seen.append(opinion["id"])
+        assert "plain_text_ref" in opinion and "html_with_citations" not in opinion
+        if opinion["id"] == 2:
+            spool.discard(3)
+            spool.update(dict(opinion, duplicates=[{"id": 3}]))
+    assert seen == [1, 2, 4, 5] and len(spool) == 4 and spool.max_id() == 5
+    assert spool.get(2)["duplicates"] == [{"id": 3}]
+    spool.remove()
+
+
+def test_spooled_run_matches_in_memory_run(tmp_path, monkeypatch):
+    """
+    Test the staged workflow with spooled ingestion: the same articles as with in-memory ingestion
+    and the spool deleted after the run.
+    """
+    opinions = [make_opinion(id) for id in range(1, 8)]
+    pages = {1: opinions[4:], 2: opinions[:4]}
+    monkeypatch.setattr(graph_ops, "client", RunnableLambda(fake_llm))
+    monkeypatch.setattr(graph_ops, "get_content", lambda url: {
+        "results": [dict(o) for o in reversed(pages.get(int(url.rsplit("=", 1)[1]), []))]})
+    monkeypatch.setattr(graph_ops, "get_recipients", lambda: ["reader@example.com"])
+    monkeypatch.setattr(graph_ops, "send_email", lambda *args: None)
+    monkeypatch.setenv("OUTPUT_DIR", str(tmp_path))
+    monkeypatch.setenv("PREFILTER_SCORERS", "keywords")
+    monkeypatch.setenv("FETCH_SPOOL_DIR", str(tmp_path / "spool"))
+    monkeypatch.setenv("FETCH_CONCURRENCY", "1")
+
+    source_urls = {}
+    for ingestion in ("memory", "spool"):
+        state_file = tmp_path / f"ingestion_state_{ingestion}.json"
+        state_file.write_text(json.dumps({"last_processed_id": 2}))
+        monkeypatch.setenv("FETCH_STATE_FILE", str(state_file))
+        monkeypatch.setenv("FETCH_INGESTION", ingestion)
+        final_state = compile_workflow(build_workflow()).invoke({"last_processed_id": 2})
+        source_urls[ingestion] = sorted(article["source_url"] for article in final_state["articles"])
+        assert json.loads(state_file.read_text()) == {"last_processed_id": 7}
+
+    assert source_urls["spool"] == source_urls["memory"] and len(source_urls["spool"]) == 5
+    assert list((tmp_path / "spool").iterdir()) == []
+
+
+def test_failed_page_stops_spooled_run(tmp_path, monkeypatch):
+    """
+    Test that with spooled ingestion a failed result page stops the run, without moving the checkpoint
+    or leaving the spool behind.
+    """
+    state_file = tmp_path / "ingestion_state.json"
+    state_file.write_text(json.dumps({"last_processed_id": 0}))
+    monkeypatch.setattr(graph_ops, "get_content",
+                        lambda url: {"results": [make_opinion(2), make_opinion(1)]} if url.endswith("page=1") else None)
+    monkeypatch.setenv("FETCH_STATE_FILE", str(state_file))
+    monkeypatch.setenv("FETCH_INGESTION", "spool")
+    monkeypatch.setenv("FETCH_SPOOL_DIR", str(tmp_path / "spool"))
+
+    with pytest.raises(graph_ops.PageFetchError):
+        compile_workflow(build_workflow()).invoke({"last_processed_id": 0})
+    assert json.loads(state_file.read_text()) == {"last_processed_id": 0}
+    assert list((tmp_path / "spool").iterdir()) == []
@@ -0,0 +1,73 @@
+import json
+
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+from langchain_core.runnables import RunnableLambda
+
+from media_agents.structured_output import StructuredOutputError, invoke_structured, load_schema, validate
+
+MESSAGES = [SystemMessage(content="system"), HumanMessage(content="user")]
+
+
+def test_schema_resources_are_normalized():
+    """
+    Test that the schema resources are turned into standard JSON schemas and validate answers.
+    """
+    schema = load_schema('schemas/newsworthiness_output.json')
+    answer = {"id": 1234567, "newsworthy": "True", "reason": "", "influence": "Global", "labels": ["politics"]}
+
+    assert schema["required"] == ["id", "newsworthy", "reason", "influence", "labels"]
+    assert validate(answer, schema) == []
+    assert validate(dict(answer, newsworthy="Maybe", labels=["gossip"]), schema) == \
+        ["$.newsworthy must be one of ['True', 'False']", "$.labels[0] must be one of " +
+         str(schema["properties"]["labels"]["items"]["enum"])]
+    assert validate([{"text": "key point"}], load_schema('schemas/keypoints_output.json')) == \
+        ["$[0].start_pos is required", "$[0].end_pos is required"]
+
+
+def test_invalid_answers_are_repaired_once():
+    """
+    Test that malformed and invalid answers are sent back with the errors for one repair attempt,
+    and fail if still invalid.
+    """
+    schema = load_schema('schemas/headline_output.json')
+    calls = []
+
+    def fake_llm(messages):
+        calls.append(messages)
+        prompt = messages[1].content
+        if len(messages) == 2:
+            return AIMessage(content="not json" if prompt == "malformed" else json.dumps({"title": "x"}))
+        if prompt == "stubborn":
+            return AIMessage(content=json.dumps({"title": "x"}))
+        return AIMessage(content=json.dumps({"headline": "Court rules"}))
+
+    prompts = ["malformed", "invalid", "stubborn"]
+    outputs = invoke_structured(RunnableLambda(fake_llm), [[SystemMessage(content="system"), HumanMessage(content=p)]
+                                                           for p in prompts], schema, "fake", "headline")
+
+    assert outputs[:2] == [{"headline": "Court rules"}, {"headline": "Court rules"}]
+    assert isinstance(outputs[2], StructuredOutputError)
+    assert len(calls) == 6
+    repair = [c for c in calls if c[1].content == "invalid" and len(c) == 4][0]
+    assert repair[2].content == json.dumps({"title": "x"}) and "$.headline is required" in repair[3].content
+
+
+def test_native_structured_output_is_used_when_supported(monkeypatch):
+    """
+    Test that a model supporting structured output is called in that mode, with array answers unwrapped.
+    """
+    requested = []
+
+    class FakeModel:
+        def with_structured_output(self, schema, include_raw=False):
+            requested.append(schema)
+            raw = AIMessage(content="")
+            return RunnableLambda(lambda messages: {"raw": raw, "parsing_error": None, "parsed": {
+                "items": [{"text": "key point", "start_pos": 0, "end_pos": 9}]}})
+
+    monkeypatch.setenv("STRUCTURED_OUTPUT", "native")
+    outputs = invoke_structured(FakeModel(), [MESSAGES], load_schema('schemas/keypoints_output.json'), "fake",
+                                "keypoints")
+
+    assert outputs == [[{"text": "key point", "start_pos": 0, "end_pos": 9}]]
+    assert requested[0]["title"] == "keypoints" and requested[0]["properties"]["items"]["type"] == "array"
@@ -0,0 +1,54 @@
+import json
+
+from media_agents.subscriptions import SubscriptionIndex, get_preferences, get_recipients
+
+
+ARTICLES = [
+    {"headline": "a", "categories": ["politics"], "keywords": ["Election"], "people": [], "organizations": []},
+    {"headline": "b", "categories": ["business"], "keywords": ["arbitration"], "people": [],
+     "organizations": ["Supreme Court of the United States"]},
+    {"headline": "c", "categories": ["labor"], "keywords": ["FLSA"]},
+]
+
+
+def test_group_digests_matches_preferences_and_groups_identical_digests():
+    """
+    Test that subscribers get the articles matching their preferences, case-insensitively,
+    that subscribers without preferences get every article and that identical digests are grouped.
+    """
+    preferences = {
+        "p1@example.com": {"email": "p1@example.com", "topics": ["Politics"]},
+        "p2@example.com": {"email": "p2@example.com", "keywords": ["election"]},
+        "b@example.com": {"email": "b@example.com", "organizations": ["supreme court of the united states"],
+                          "keywords": ["flsa"]},
+        "none@example.com": {"email": "none@example.com", "topics": ["sports"]},
+    }
+    recipients = ["all@example.com", "p1@example.com", "p2@example.com", "b@example.com", "none@example.com"]
+
+    digests = SubscriptionIndex(recipients, preferences).group_digests(ARTICLES)
+
+    assert digests == {(0, 1, 2): ["all@example.com"],
+                       (0,): ["p1@example.com", "p2@example.com"],
+                       (1, 2): ["b@example.com"]}
+
+
+def test_get_recipients_and_preferences(tmp_path, monkeypatch):
+    """
+    Test loading the recipients list, skipping blank lines, and the preferences JSONL file,
+    subscriptions/preferences.jsonl when SUBSCRIPTIONS_PREFERENCES is not set.
+    """
+    recipients_file = tmp_path / "recipients.txt"
+    recipients_file.write_text("a@example.com\n\nb@example.com\n")
+    preferences_file = tmp_path / "preferences.jsonl"
+    preferences_file.write_text(json.dumps({"email": "a@example.com", "topics": ["politics"]}) + "\n")
+    monkeypatch.setenv("SUBSCRIPTIONS_STORAGE", str(recipients_file))
+    monkeypatch.setenv("SUBSCRIPTIONS_PREFERENCES", str(preferences_file))
+
+    assert get_recipients() == ["a@example.com", "b@example.com"]
+    assert get_preferences() == {"a@example.com": {"email": "a@example.com", "topics": ["politics"]}}
+    monkeypatch.delenv("SUBSCRIPTIONS_PREFERENCES")
+    monkeypatch.chdir(tmp_path)
+    assert get_preferences() == {}
+    (tmp_path / "subscriptions").mkdir()
+    preferences_file.rename(tmp_path / "subscriptions" / "preferences.jsonl")
+    assert list(get_preferences()) == ["a@example.com"]
@@ -0,0 +1,39 @@
+import json
+
+from media_agents import template_rendering
+from media_agents.app_resources import registry
+from media_agents.template_rendering import render_template, render_templates
+
+
+def write_articles(path):
+    articles = [{"headline": "Court rules", "news_article": "article", "source_url": "https://example.com/1",
+                 "date_created": "2024-03-15T08:02:22", "keywords": [{"keyword": "court"}], "labels": ["politics"]}]
+    with open(path, 'w') as fw:
+        for article in articles:
+            fw.write(json.dumps(article) + '\n')
+
+
+def test_render_templates_single_pass(tmp_path, monkeypatch):
+    """
+    Test that the HTML and text newsletters are rendered from one load of the articles,
+    with dates formatted and compiled templates reused across calls.
+    """
+    news_file = tmp_path / "news.jsonl"
+    write_articles(news_file)
+    loads = []
+    load_articles = template_rendering.load_articles
+    monkeypatch.setattr(template_rendering, "load_articles", lambda path: loads.append(path) or load_articles(path))
+    registry.clear()
+    compiled = []
+    from_string = template_rendering.environment.from_string
+    monkeypatch.setattr(template_rendering.environment, "from_string",
+                        lambda source: compiled.append(source) or from_string(source))
+
+    bodies = render_templates(['templates/email_html.jinja', 'templates/email_txt.jinja'], str(news_file))
+    render_templates(['templates/email_html.jinja', 'templates/email_txt.jinja'], str(news_file))
+
+    assert len(loads) == 2
+    assert len(compiled) == 2
+    assert "Court rules" in bodies['templates/email_html.jinja']
+    assert "Court rules" in bodies['templates/email_txt.jinja']
+    assert render_template('templates/email_txt.jinja', str(news_file)) == bodies['templates/email_txt.jinja']
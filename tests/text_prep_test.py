@@ -0,0 +1,37 @@
+import pytest
+
+from media_agents import text_prep
+
+
+def test_chunk_text_respects_token_budget():
+    """
+    Test that chunks stay within the token budget, overlap and cover the whole text.
+    """
+    text = " ".join(f"word{i}" for i in range(2000))
+    chunks = text_prep.chunk_text(text, chunk_tokens=300, overlap_tokens=30)
+    assert len(chunks) > 1
+    assert all(text_prep.count_tokens(chunk) <= 300 for chunk in chunks)
+    assert chunks[0].startswith("word0 ") and chunks[-1].endswith("word1999")
+
+
+def test_chunk_text_rejects_overlap_not_smaller_than_chunk():
+    """
+    Test that an overlap as large as the chunk is rejected instead of starting a chunk at every token.
+    """
+    with pytest.raises(ValueError):
+        text_prep.chunk_text("Supreme Court " * 50, chunk_tokens=10, overlap_tokens=10)
+
+
+def test_chunk_text_short_text_is_one_chunk():
+    """
+    Test that a text under the budget is returned as a single chunk.
+    """
+    assert text_prep.chunk_text("Supreme Court", chunk_tokens=100, overlap_tokens=10) == ["Supreme Court"]
+
+
+def test_select_fields():
+    """
+    Test that only the requested fields present in the record are kept.
+    """
+    record = {"id": 1, "plain_text": "long text", "keypoints": []}
+    assert text_prep.select_fields(record, ["id", "keypoints", "reason"]) == {"id": 1, "keypoints": []}
@@ -0,0 +1,27 @@
+from benchmarks.workflow_bench import find_regressions, format_report, run_scale
+
+
+def test_benchmark_runs_offline_end_to_end():
+    """
+    Test that the benchmark runs the workflow against the fake LLM, the CourtListener stand-in
+    and the SMTP sink, and reports per-node timings.
+    """
+    result = run_scale(6, "instant", trace_memory=False)
+
+    assert result["articles"] > 0 and result["llm_calls"] > 0
+    assert result["http_requests"] > 0 and result["emails"] > 0
+    assert {"fetch_update", "find_news_leads", "notify_subscribers"} <= set(result["nodes"])
+    assert result["llm_tokens"]["input"] > 0
+    assert "6 opinions (instant)" in format_report([result])
+
+
+def test_find_regressions():
+    """
+    Test that only runs slower than their baseline beyond the tolerance are reported.
+    """
+    baseline = [{"opinions": 10, "profile": "fast", "wall_seconds": 1.0},
+                {"opinions": 100, "profile": "fast", "wall_seconds": 10.0}]
+    results = [{"opinions": 10, "profile": "fast", "wall_seconds": 1.1},
+               {"opinions": 100, "profile": "fast", "wall_seconds": 13.0}]
+
+    assert find_regressions(results, baseline, 0.2) == ["100 opinions (fast): 13.00s vs 10.00s baseline"]